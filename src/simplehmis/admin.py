@@ -1,7 +1,10 @@
 from django.contrib import admin
+from django.contrib.admin.templatetags.admin_list import DOT
+from django.contrib.admin.views.main import ChangeList, PAGE_VAR
 from django.contrib.auth.decorators import user_passes_test
-from django.core.management import call_command
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.core.urlresolvers import reverse
+from django.db import connections
 from django.db.models import fields
 from django.forms import widgets
 from django.template.loader import render_to_string
@@ -24,28 +27,44 @@ def dump_hud_data(request):
     """
     Download the complete set of CSV data.
     """
-    # NOTE: This will start to cause problems if the amount of data in the
-    #       system becomes HUGE. It should be moved to a background process.
-    import os
-    from io import BytesIO
-    from tempfile import mkdtemp
-    from zipfile import ZipFile
-    from os.path import join as pathjoin
-    from django.http import HttpResponse
-
-    # Dump the files into a temporary directory
-    dirpath = mkdtemp()
-    call_command('dump_hud_data', dirpath)
-
-    # Copy each of the files into a zip buffer
-    zipbuffer = BytesIO()
-    with ZipFile(zipbuffer, 'w') as zipfile:
-        for filename in os.listdir(dirpath):
-            filepath = pathjoin(dirpath, filename)
-            zipfile.write(filepath, filename)
-
-    # Write the zip file buffer out as a downloadable file
-    response = HttpResponse(zipbuffer.getvalue(), content_type='application/zip')
+    # NOTE: The zip archive is generated while it is being sent, so memory
+    #       use stays flat, but the download still holds a worker for as
+    #       long as it takes to read all of the data.
+    from django.http import StreamingHttpResponse
+    from .management.dumper_utils import iter_hud_export_zip
+
+    response = StreamingHttpResponse(iter_hud_export_zip(), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="simplehmis_data.zip"'
+    return response
+
+
+@user_passes_test(superuser_check)
+def request_hud_data_export(request):
+    """
+    Queue up a background job to build the complete set of CSV data.
+    """
+    from django.http import HttpResponseNotAllowed, HttpResponseRedirect
+
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    models.ExportJob.objects.enqueue(request.user)
+    return HttpResponseRedirect(reverse('admin:index'))
+
+
+@user_passes_test(superuser_check)
+def download_hud_data_export(request, job_id):
+    """
+    Download the archive built by a finished export job.
+    """
+    from django.http import FileResponse, Http404
+    from django.shortcuts import get_object_or_404
+
+    job = get_object_or_404(models.ExportJob, pk=job_id)
+    if not job.is_ready():
+        raise Http404('Export {} is not ready for download.'.format(job_id))
+
+    response = FileResponse(open(job.archive, 'rb'), content_type='application/zip')
     response['Content-Disposition'] = 'attachment; filename="simplehmis_data.zip"'
     return response
 
@@ -55,43 +74,10 @@ def dump_enrollment_demographics(request):
     """
     Download winter initiative data as a CSV.
     """
-    import csv
-    from io import StringIO
-    from django.http import HttpResponse
-
-    enrollments = models.HouseholdMember.objects.all()\
-        .select_related('client')\
-        .select_related('household')\
-        .select_related('household__project')
-
-    fields = ('project name', 'entry date', 'exit date', 'referral created', 'referral last edited',
-              'client name', 'client dob', 'client ssn', 'client gender', 'client vet status')
-    data = []
-    for enrollment in enrollments:
-        client = enrollment.client
-        referral = enrollment.household
-        data.append(
-            (
-                referral.project.name,
-                enrollment.entry_date.isoformat() if enrollment.entry_date else None,
-                enrollment.exit_date.isoformat() if enrollment.exit_date else None,
-                referral.created_at.date().isoformat(),
-                referral.updated_at.date().isoformat(),
-                client.name_display(),
-                client.dob.isoformat() if client.dob else None,
-                client.ssn,
-                dict(consts.HUD_CLIENT_GENDER).get(client.gender),
-                dict(consts.HUD_YES_NO).get(client.veteran_status)
-            )
-        )
-
-    csvbuffer = StringIO()
-    writer = csv.writer(csvbuffer)
-    writer.writerow(fields)
-    for row in data:
-        writer.writerow(row)
+    from django.http import StreamingHttpResponse
+    from simplehmis.management.dumper_utils import iter_enrollment_demographics_csv
 
-    response = HttpResponse(csvbuffer.getvalue(), content_type='text/csv')
+    response = StreamingHttpResponse(iter_enrollment_demographics_csv(), content_type='text/csv')
     response['Content-Disposition'] = 'attachment; filename="enrollment_demographics.csv"'
     return response
 
@@ -178,7 +164,142 @@ class AvailableProjectsListFilter(admin.SimpleListFilter):
         return queryset
 
 
-class HouseholdAdmin (VersionAdmin):
+# The query parameter that asks a changelist for an exact count.
+EXACT_COUNT_VAR = 'exact_count'
+
+
+def get_estimated_count(queryset):
+    """
+    Estimate the number of rows in an unfiltered queryset from the
+    database's table statistics (which are only as fresh as the last
+    ANALYZE), or return None if there's no estimate.
+    """
+    if queryset.query.where:
+        return None
+
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [connection.ops.quote_name(table)])
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if not cursor.fetchone()[0]:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+
+    if row is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
+
+
+class ApproximateCountPaginator (Paginator):
+    """
+    A paginator that doesn't count more than `count_limit` rows. Unfiltered
+    lists get their counts estimated from the table statistics, and other
+    lists are counted up to the limit, and no further. With a `count_limit`
+    of None, the count is exact.
+    """
+    count_limit = 10000
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, count_limit=count_limit):
+        super().__init__(object_list, per_page, orphans=orphans, allow_empty_first_page=allow_empty_first_page)
+        self.count_limit = count_limit
+        self.count_label = None
+
+    def _get_count(self):
+        if self._count is None:
+            if self.count_limit is None:
+                self._count = self.object_list.count()
+                return self._count
+
+            estimate = get_estimated_count(self.object_list)
+            if estimate is not None and estimate > self.count_limit:
+                self._count = estimate
+                self.count_label = _('about {:,}').format(estimate)
+            else:
+                self._count = self.object_list.order_by().values('pk')[:self.count_limit + 1].count()
+                if self._count > self.count_limit:
+                    self.count_label = '{:,}+'.format(self.count_limit)
+        return self._count
+    count = property(_get_count)
+
+    def page(self, number):
+        # There may be more rows than an approximate count, so any page
+        # could have some: look, instead of checking the number against the
+        # count, and don't cut the last page short either.
+        self._get_count()
+        if self.count_label is None:
+            return super().page(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+
+        bottom = (number - 1) * self.per_page
+        object_list = self.object_list[bottom:bottom + self.per_page]
+        if number > 1 and not object_list:
+            raise EmptyPage(_('That page contains no results'))
+        return self._get_page(object_list, number, self)
+
+
+def get_open_ended_page_range(page_num, on_each_side=3, on_ends=2):
+    """
+    Get the (0-based) page numbers to link to around the current page of a
+    list with an approximate count, like the admin's `pagination` tag does,
+    but with the list left open at the end: the pages after the current
+    one are followed by dots, instead of the last pages by the count.
+    """
+    if page_num > on_each_side + on_ends:
+        page_range = list(range(0, on_ends)) + [DOT] + list(range(page_num - on_each_side, page_num + 1))
+    else:
+        page_range = list(range(0, page_num + 1))
+    return page_range + list(range(page_num + 1, page_num + on_each_side + 1)) + [DOT]
+
+
+class ApproximateCountChangeList (ChangeList):
+    """
+    A changelist that shows the approximate count from an
+    `ApproximateCountPaginator`, with a link to count exactly.
+    """
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(EXACT_COUNT_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.result_count_label = getattr(self.paginator, 'count_label', None)
+        self.open_ended_page_range = None
+        if self.result_count_label is not None:
+            self.open_ended_page_range = get_open_ended_page_range(self.page_num)
+        self.exact_count_url = self.get_query_string({EXACT_COUNT_VAR: '1'}, [PAGE_VAR])
+
+
+class ApproximateCountAdminMixin (object):
+    """
+    Count the rows of a (large) changelist approximately, unless the
+    request asks for an exact count, and skip counting the unfiltered rows
+    for the "total" next to the search box.
+    """
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return ApproximateCountChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        count_limit = None if EXACT_COUNT_VAR in request.GET else self.paginator.count_limit
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, count_limit=count_limit)
+
+
+class HouseholdAdmin (ApproximateCountAdminMixin, VersionAdmin):
     inlines = [HouseholdMemberInline]
     raw_id_fields = ['project']
 
@@ -216,6 +337,13 @@ class HouseholdAdmin (VersionAdmin):
             .prefetch_related('members__exit_assessment')\
             .prefetch_related('members__client')
 
+    def get_search_results(self, request, queryset, search_term):
+        # Match the members in a subquery, instead of joining them through
+        # the search_fields, which would need a DISTINCT.
+        if not search_term:
+            return queryset, False
+        return queryset.search(search_term), False
+
     def get_list_filter(self, request):
         list_filter = [IsEnrolledListFilter, IsAssessedListFilter]
         user = models.HMISUser(request.user)
@@ -279,7 +407,7 @@ class HouseholdAdmin (VersionAdmin):
         obj.save()
 
 
-class ClientAdmin (VersionAdmin):
+class ClientAdmin (ApproximateCountAdminMixin, VersionAdmin):
     actions_on_top = actions_on_bottom = False
     list_display = ['name_display', 'ssn_display', 'dob']
     search_fields = ['first', 'middle', 'last', 'ssn']
@@ -307,6 +435,13 @@ class ClientAdmin (VersionAdmin):
         js = ("js/show-strrep.js?2", "js/hmis-forms.js?2")
         css = {"all": ("css/hmis-forms.css",)}
 
+    def get_search_results(self, request, queryset, search_term):
+        # Search the normalized keys instead of the search_fields.
+        if not search_term:
+            return queryset, False
+        keys = models.ClientSearchKey.objects.search(search_term)
+        return queryset.filter(pk__in=keys.values('client_id')), False
+
 
 
 HEALTH_INSURANCE_RADIO_FIELDS = (
@@ -513,7 +648,7 @@ class ClientAnnualAssessmentInline (admin.StackedInline):
       + INCOME_FIELDSETS
 
 
-class HouseholdMemberAdmin (VersionAdmin):
+class HouseholdMemberAdmin (ApproximateCountAdminMixin, VersionAdmin):
     raw_id_fields = ('client',)
     exclude = ('household', 'present_at_enrollment', 'entry_date', 'exit_date')
     readonly_fields = ('hoh_relationship',)
@@ -545,6 +680,13 @@ class HouseholdMemberAdmin (VersionAdmin):
             .select_related('household')\
             .select_related('household__project')\
 
+    def get_search_results(self, request, queryset, search_term):
+        # Search the normalized client keys instead of the search_fields.
+        if not search_term:
+            return queryset, False
+        keys = models.ClientSearchKey.objects.search(search_term)
+        return queryset.filter(client__in=keys.values('client_id')), False
+
     def get_list_filter(self, request):
         list_filter = [IsEnrolledListFilter]
         user = models.HMISUser(request.user)
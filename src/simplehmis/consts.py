@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+from types import MappingProxyType
 from django.utils.translation import ugettext as _
 
 HUD_CLIENT_DOESNT_KNOW = 8
@@ -268,3 +269,159 @@ HUD_FUNDING_PROGRAM_CHOICES = (
     (34, _('N/A')),
 )
 
+
+# Strings found in imported spreadsheets, mapped to the labels above that
+# they stand for.
+HUD_CODE_EQUIVALENTS = {
+    # Mapping sheet strings to equivalent consts strings
+    'Permanent housing for formerly homeless persons': 'Permanent housing for formerly homeless persons (such as: CoC project; or HUD legacy programs; or HOPWA PH)',
+    'Client Refused': 'Client refused',
+    'Refused Info': 'Client refused',
+    'Refused': 'Client refused',
+    'Client doesn\'t know': 'Client doesn’t know',
+    'Client Doesn’t Know': 'Client doesn’t know',
+    'Client Doesn\'t Know': 'Client doesn’t know',
+    "CLIENT DOESN'T KNOW": 'Client doesn’t know',
+    'UNKNOWN': 'Client doesn’t know',
+    'YES': 'Yes',
+    'NO': 'No',
+
+    'Drugs': 'Drug abuse',
+
+    # 'Self (head of household': 'Self (head of household)',
+    'Head of household’s other relation member': 'Head of household’s other relation member (other relation to head of household)',
+    'HEAD OF HOUSEHOLD CHILD': 'Head of household’s child',
+    "Head of household's child": 'Head of household’s child',
+    'AUNT': 'Head of household’s other relation member (other relation to head of household)',
+
+    # Destinations
+    'Staying with family': 'Staying or living with family, temporary tenure (e.g., room, apartment or house)',
+    'Staying or living with friends, temporary tenure': 'Staying or living with friends, temporary tenure (e.g., room apartment or house)',
+    'Staying or living  with friends, temporary tenure': 'Staying or living with friends, temporary tenure (e.g., room apartment or house)',
+    'Staying or living  with friends, permanent tenure': 'Staying or living with friends, permanent tenure',
+    'Staying or living in a family member\'s room, apartment or house': 'Staying or living in a family member’s room, apartment or house',
+    'Staying or living in a friend\'s room, apartment or house': 'Staying or living in a friend’s room, apartment or house',
+    'Staying or living with family, temporary tenure': 'Staying or living with family, temporary tenure (e.g., room, apartment or house)',
+    'Place not meant for human habitation': 'Place not meant for habitation (e.g., a vehicle, an abandoned building, bus/train/subway station/airport or anywhere outside)',
+    'On the street or other place not meant for human habitation': 'Place not meant for habitation (e.g., a vehicle, an abandoned building, bus/train/subway station/airport or anywhere outside)',
+    'Rental by client': 'Rental by client, no ongoing housing subsidy',
+    'Permanent Housing': 'Permanent housing for formerly homeless persons (such as: CoC project; or HUD legacy programs; or HOPWA PH)',
+    #'Permanent housing for formerly homeless persons': 'Permanent housing for formerly homeless persons (such as: a CoC project; HUD legacy programs; or HOPWA PH)',
+    'Permanent Supportive Housing': 'Permanent housing for formerly homeless persons (such as: CoC project; or HUD legacy programs; or HOPWA PH)',
+    'PHA': 'Permanent housing for formerly homeless persons (such as: CoC project; or HUD legacy programs; or HOPWA PH)',
+    'Staying with friends': 'Staying or living with friends, temporary tenure (e.g., room apartment or house)',
+    'Transitional Housing': 'Transitional housing for homeless persons (including homeless youth)',
+
+    'Data Not Collected': 'Data not collected',
+    'Jail, prison, or juvenile facility': 'Jail, prison or juvenile detention facility',
+    'Rental by client, no ongoing housing subsidy (Private Market)': 'Rental by client, no ongoing housing subsidy',
+    'TRANSITIONAL HOUSING FOR HOMELESS PERSONS': 'Transitional housing for homeless persons (including homeless youth)',
+    "STAYING OR LIVING IN A FRIEND'S ROOM, APARTMENT OR HOUSE": 'Staying or living in a friend’s room, apartment or house',
+    "STAYING OR LIVING IN A FAMILY MEMBER'S ROOM, APARTMENT OR HOUSE": 'Staying or living in a family member’s room, apartment or house',
+
+    # Totally random destinations.
+    'Methodist Hope': 'Other',
+    'find housing': 'Other',
+    'OTHER SUPPORTIVE HOUSING': 'Other',
+
+    # Times homeless
+    '0 (NOT HOMELESS - PREVENTION ONLY)': 'Never in 3 years',
+    '1 (homeless only this time)': 'One time',
+    '1 (HOMELESS ONLY THIS TIME)': 'One time',
+    '2': 'Two times',
+    '3': 'Three times',
+    '4': 'Four or more times',
+    '4 OR MORE': 'Four or more times',
+    "DON'T KNOW": 'Client doesn’t know',
+    'OTHER (PLEASE SPECIFY)': 'Other',
+
+    'Non-Hispanic / Non-Latino': 'Non-Hispanic/Non-Latino',
+    'Non- Hispanic/Non-Latino': 'Non-Hispanic/Non-Latino',
+    'Non-Hispanic/ Non Latin': 'Non-Hispanic/Non-Latino',
+    'Non-Hipanic/Non-Latino': 'Non-Hispanic/Non-Latino',
+    'Non-Hispanic/Non Latin': 'Non-Hispanic/Non-Latino',
+    'Hispanic / Latino': 'Hispanic/Latino',
+    'Hispanic': 'Hispanic/Latino',
+    'Black': 'Black or African American',
+    'BLACK/AFRICAN-AMERICAN': 'Black or African American',
+    'BLACK/NON AFRICAN-AMERICAN': 'Black or African American',
+    'NONE': 'No',
+}
+
+
+class HudCodeLookup (object):
+    """
+    A precompiled, read-only set of lookups for a list of HUD choices: code
+    to label, and label (or any of its equivalents) back to code.
+
+    """
+    __slots__ = ('choices', 'labels', '_by_label', '_by_normalized_label', '_blank')
+
+    def __init__(self, choices, equivalents=HUD_CODE_EQUIVALENTS):
+        choices = tuple(choices)
+        by_label = {}
+        by_normalized_label = {}
+        for index, (code, label) in enumerate(choices):
+            by_label.setdefault(label, (index, code))
+            by_normalized_label.setdefault(label.lower(), (index, code))
+
+        object.__setattr__(self, 'choices', choices)
+        object.__setattr__(self, 'labels', MappingProxyType(dict(choices)))
+        object.__setattr__(self, '_by_normalized_label', MappingProxyType(by_normalized_label))
+        # An equivalent string counts as a match for the first choice with
+        # exactly the label it stands for.
+        object.__setattr__(self, '_by_label', MappingProxyType(dict(
+            (string, by_label[label])
+            for string, label in equivalents.items()
+            if label in by_label)))
+        # As a special case, the empty string is read as "Data not
+        # collected" when "Data not collected" is one of the choices.
+        object.__setattr__(self, '_blank', by_normalized_label.get('data not collected'))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('HUD code lookups are read-only')
+
+    def __iter__(self):
+        return iter(self.choices)
+
+    def label(self, code, default=None):
+        return self.labels.get(code, default)
+
+    def code(self, value):
+        """
+        Get the code for a (stripped) string value, matching labels without
+        regard to case. Where a value matches more than one choice, the
+        first choice wins. Raises a KeyError if nothing matches.
+        """
+        matches = [
+            self._by_normalized_label.get(value.lower()),
+            self._by_label.get(value),
+            self._blank if value == '' else None,
+        ]
+        matches = [match for match in matches if match is not None]
+        if not matches:
+            raise KeyError(value)
+        return min(matches)[1]
+
+
+HUD_YES_NO_LOOKUP = HudCodeLookup(HUD_YES_NO)
+HUD_CLIENT_NAME_QUALITY_LOOKUP = HudCodeLookup(HUD_CLIENT_NAME_QUALITY)
+HUD_CLIENT_SSN_QUALITY_LOOKUP = HudCodeLookup(HUD_CLIENT_SSN_QUALITY)
+HUD_CLIENT_DOB_QUALITY_LOOKUP = HudCodeLookup(HUD_CLIENT_DOB_QUALITY)
+HUD_CLIENT_RACE_LOOKUP = HudCodeLookup(HUD_CLIENT_RACE)
+HUD_CLIENT_ETHNICITY_LOOKUP = HudCodeLookup(HUD_CLIENT_ETHNICITY)
+HUD_CLIENT_GENDER_LOOKUP = HudCodeLookup(HUD_CLIENT_GENDER)
+HUD_CLIENT_HOH_RELATIONSHIP_LOOKUP = HudCodeLookup(HUD_CLIENT_HOH_RELATIONSHIP)
+HUD_CLIENT_SUBSTANCE_ABUSE_LOOKUP = HudCodeLookup(HUD_CLIENT_SUBSTANCE_ABUSE)
+HUD_CLIENT_UNINSURED_REASON_LOOKUP = HudCodeLookup(HUD_CLIENT_UNINSURED_REASON)
+HUD_CLIENT_EXIT_DESTINATION_LOOKUP = HudCodeLookup(HUD_CLIENT_EXIT_DESTINATION)
+HUD_CLIENT_PRIOR_RESIDENCE_LOOKUP = HudCodeLookup(HUD_CLIENT_PRIOR_RESIDENCE)
+HUD_CLIENT_LENGTH_AT_PRIOR_RESIDENCE_LOOKUP = HudCodeLookup(HUD_CLIENT_LENGTH_AT_PRIOR_RESIDENCE)
+HUD_CLIENT_DESTINATION_LOOKUP = HudCodeLookup(HUD_CLIENT_DESTINATION)
+HUD_CLIENT_HOMELESS_COUNT_LOOKUP = HudCodeLookup(HUD_CLIENT_HOMELESS_COUNT)
+HUD_CLIENT_HOMELESS_MONTHS_LOOKUP = HudCodeLookup(HUD_CLIENT_HOMELESS_MONTHS)
+HUD_CLIENT_HOUSING_STATUS_LOOKUP = HudCodeLookup(HUD_CLIENT_HOUSING_STATUS)
+HUD_CLIENT_DOMESTIC_VIOLENCE_LOOKUP = HudCodeLookup(HUD_CLIENT_DOMESTIC_VIOLENCE)
+HUD_PROJECT_TYPE_LOOKUP = HudCodeLookup(HUD_PROJECT_TYPE_CHOICES)
+HUD_PROJECT_TRACKING_METHOD_LOOKUP = HudCodeLookup(HUD_PROJECT_TRACKING_METHOD_CHOICES)
+HUD_FUNDING_PROGRAM_LOOKUP = HudCodeLookup(HUD_FUNDING_PROGRAM_CHOICES)
@@ -0,0 +1,169 @@
+from collections import OrderedDict, defaultdict
+from copy import copy
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils.timezone import now
+from simplehmis.models import Client, ClientRace, update_client_search_keys
+from simplehmis.management.loader_utils import ClientIndex, ClientLoaderHelper, batches, is_head_of_household
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def bulk_create_with_pks(model, objs):
+    """
+    Insert the objects with `bulk_create`, and set the primary key of each
+    one. Django doesn't return the keys of bulk-inserted rows, so they are
+    read back from the range of keys after the highest one that existed
+    before the insert. Must be called inside a transaction.
+    """
+    if not objs:
+        return objs
+
+    last_pk = model.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+    model.objects.bulk_create(objs)
+    pks = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True))
+    if len(pks) != len(objs):
+        raise RuntimeError(
+            'Expected {} new {} rows, but found {}. Were rows added by someone '
+            'else during the load?'.format(len(objs), model._meta.verbose_name, len(pks)))
+
+    for obj, pk in zip(objs, pks):
+        obj.pk = pk
+    return objs
+
+
+class BulkClientLoaderHelper (ClientLoaderHelper):
+    """
+    A `ClientLoaderHelper` that reads the whole file (or window of rows) up
+    front, matches its clients against existing ones with a handful of `IN` queries, and inserts
+    the new clients and their races in bulk.
+
+    Matching works the same as for the row-by-row loader: each row matches
+    the first client (by primary key) with the same SSN (and last name, if
+    strong matching), or failing that, the same name and date of birth,
+    including any client created for an earlier row in the file.
+
+    """
+    def load_rows(self, manager, rows, interactive=True, strong_matching=False, pending=None):
+        with transaction.atomic():
+            parsed_rows = [self.parse_client_values(row, interactive=interactive) for row in rows]
+            self.get_or_create_clients_from_rows(manager, rows, parsed_rows, strong_matching=strong_matching)
+
+            # With all of the clients in place, create the households for
+            # the heads of household, in order, and then the dependents.
+            self.create_missing_projects(rows)
+            for row, (ssn, name_and_dob, client_values, race) in zip(rows, parsed_rows):
+                if is_head_of_household(row):
+                    self.check_head_of_household_ssn(row, ssn, client_values, interactive=interactive)
+                    self.get_or_create_household_member_from_row(manager, row, interactive=interactive)
+                    self.add_assessments_from_row(manager, row, interactive=interactive)
+
+            self.load_dependents_from_rows(manager, rows, interactive=interactive, pending=pending)
+            self.assessments.flush()
+
+    def build_client_index(self, manager, parsed_rows):
+        """
+        Load every existing client that could match one of the rows into an
+        index, in primary key order.
+        """
+        ssns = set()
+        last_names = set()
+        for ssn, name_and_dob, client_values, race in parsed_rows:
+            if ssn:
+                ssns.add(ssn)
+            elif all(name_and_dob.values()):
+                last_names.add(name_and_dob['last'])
+
+        candidates = {}
+        for batch in batches(ssns):
+            candidates.update((client.pk, client) for client in manager.filter(ssn__in=batch))
+        for batch in batches(last_names):
+            candidates.update((client.pk, client) for client in manager.filter(last__in=batch))
+
+        index = ClientIndex()
+        for pk in sorted(candidates):
+            index.add(candidates[pk])
+        return index
+
+    def get_or_create_clients_from_rows(self, manager, rows, parsed_rows, strong_matching=False):
+        index = self.build_client_index(manager, parsed_rows)
+        new_clients = []
+        matched_pks = set()
+        races = OrderedDict()
+
+        for row, (ssn, name_and_dob, client_values, race) in zip(rows, parsed_rows):
+            key, params = self.get_client_match(ssn, name_and_dob, strong_matching=strong_matching)
+            matches = index.get(key) if key is not None else []
+            if not matches and key is not None and self.unsaved is not None:
+                # A client created for an earlier window of a dry run.
+                matches = self.unsaved.clients.get(key)
+            if len(matches) > 1:
+                logger.warn('more than one client found for {}'.format(params))
+
+            if matches:
+                client = matches[0]
+                if client.pk is not None:
+                    matched_pks.add(client.pk)
+                # Compare against a copy, so that later rows are compared
+                # against the client as it's stored, like they would be if
+                # it were fetched again.
+                self.update_client_values(copy(client), client_values, ssn)
+            else:
+                client = manager.model(**client_values)
+                new_clients.append(client)
+                if key is not None:
+                    index.add(client)
+
+            row['_client'] = client
+            # As with the row-by-row loader, each client ends up with the
+            # races from the last row that it appears in.
+            races[id(client)] = (client, race)
+
+        if self.unsaved is not None:
+            self.unsaved.add(new_clients)
+            return
+
+        bulk_create_with_pks(manager.model, new_clients)
+        update_client_search_keys(new_clients)
+        logger.debug('Created {} clients'.format(len(new_clients)))
+
+        self.set_client_races(list(races.values()), matched_pks)
+
+    def set_client_races(self, clients_and_races, existing_pks):
+        """
+        Replace the races of the given clients in bulk. Only the clients with
+        the `existing_pks` can have races already; the ones whose races
+        change are marked as updated, for the incremental exports.
+        """
+        field = Client._meta.get_field('race')
+        through = field.rel.through
+        source = field.m2m_field_name() + '_id'
+        target = field.m2m_reverse_field_name() + '_id'
+        known_races = set(ClientRace.objects.values_list('pk', flat=True))
+
+        current_races = defaultdict(set)
+        for batch in batches(existing_pks):
+            rows = through.objects\
+                .filter(**{source + '__in': batch})\
+                .values_list(source, target)
+            for client_id, code in rows:
+                current_races[client_id].add(code)
+
+        changed = []
+        for client, race in clients_and_races:
+            codes = set(race) & known_races
+            if codes != current_races.get(client.pk, set()):
+                changed.append((client, codes))
+        changed_pks = [client.pk for client, codes in changed if client.pk in existing_pks]
+
+        for batch in batches(changed_pks):
+            through.objects.filter(**{source + '__in': batch}).delete()
+            Client.objects.filter(pk__in=batch).update(updated_at=now())
+
+        through.objects.bulk_create([
+            through(**{source: client.pk, target: code})
+            for client, codes in changed
+            for code in sorted(codes)
+        ])
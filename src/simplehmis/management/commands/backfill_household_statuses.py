@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from simplehmis.models import Household
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the stored enrollment and assessment statuses of '
+            'every household from its members.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            Household.objects.all().update_statuses()
+        self.stdout.write('Updated the statuses of {} households'.format(Household.objects.count()))
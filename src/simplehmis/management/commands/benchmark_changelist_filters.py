@@ -0,0 +1,165 @@
+import random
+import time
+from datetime import date, timedelta
+from importlib import import_module
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import RequestFactory
+from simplehmis import admin
+from simplehmis.models import Client, ClientEntryAssessment, ClientExitAssessment, Household, HouseholdMember, Project
+
+changelist_indexes = import_module('simplehmis.migrations.0015_add_changelist_filter_indexes')
+
+
+# The changelists and filter values to time: (model, filter parameter,
+# values), with None for the unfiltered changelist.
+CHANGELIST_FILTERS = [
+    (Household, 'enrolled', [None, '-1', '0', '1']),
+    (Household, 'assessed', ['0', '1']),
+    (HouseholdMember, 'enrolled', [None, '-1', '0', '1']),
+]
+
+# The number of household members to generate and insert at a time.
+DATASET_CHUNK_SIZE = 20000
+
+
+class Command(BaseCommand):
+    help = ('Times each value of the household and household member '
+            'changelist filters against a synthetic dataset, without and with '
+            'the changelist filter indexes. Everything the benchmark creates '
+            'is rolled back at the end, but run it against a scratch database: '
+            'it holds a write lock for the whole run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-m', '--members', type=int, default=1000000,
+            help='The number of household members to generate (default 1,000,000).')
+        parser.add_argument('-r', '--repeat', type=int, default=3,
+            help='Time each changelist this many times, and report the fastest (default 3).')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if connection.vendor not in changelist_indexes.CHANGELIST_INDEXES:
+            raise CommandError('There are no changelist indexes for {} databases.'.format(connection.vendor))
+        if options['members'] < 1 or options['repeat'] < 1:
+            raise CommandError('The number of members and repeats must be at least 1.')
+
+        with transaction.atomic():
+            self.create_dataset(options['members'], random.Random(options['seed']))
+
+            with connection.schema_editor() as schema_editor:
+                changelist_indexes.drop_changelist_indexes(None, schema_editor)
+            self.analyze()
+            before = self.time_changelists(options['repeat'])
+
+            with connection.schema_editor() as schema_editor:
+                changelist_indexes.create_changelist_indexes(None, schema_editor)
+            self.analyze()
+            after = self.time_changelists(options['repeat'])
+
+            transaction.set_rollback(True)
+
+        self.stdout.write('{:<40} {:>8} {:>12} {:>12}'.format('changelist', 'rows', 'before (ms)', 'after (ms)'))
+        for key in before:
+            (label, count), before_ms = before[key]
+            _, after_ms = after[key]
+            self.stdout.write('{:<40} {:>8} {:>12.1f} {:>12.1f}'.format(label, count, before_ms, after_ms))
+
+    def create_dataset(self, member_count, rng):
+        """
+        Create households of one to four members, spread over a handful of
+        projects, in each stage of enrollment, with most of their
+        assessments done. The rows are inserted a chunk of households at a
+        time, to keep memory use down.
+        """
+        projects = [Project.objects.create(name='Benchmark project {}'.format(n)) for n in range(10)]
+        next_pk = dict(
+            (model, (model.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0) + 1)
+            for model in (Client, Household, HouseholdMember))
+        first_household_pk = next_pk[Household]
+
+        created = 0
+        while created < member_count:
+            chunk_size = min(DATASET_CHUNK_SIZE, member_count - created)
+            self.create_households(chunk_size, projects, next_pk, rng)
+            created += chunk_size
+            self.stdout.write('Created {} of {} household members'.format(created, member_count))
+
+        Household.objects.filter(pk__gte=first_household_pk).update_statuses()
+
+    def create_households(self, member_count, projects, next_pk, rng):
+        clients, households, members, entries, exits = [], [], [], [], []
+        while len(members) < member_count:
+            household = Household(pk=next_pk[Household], project=rng.choice(projects))
+            next_pk[Household] += 1
+            households.append(household)
+
+            stage = rng.random()
+            entry_date = None if stage < 0.2 else date(2015, 1, 1) + timedelta(days=rng.randrange(700))
+            exit_date = entry_date + timedelta(days=rng.randrange(1, 365)) if stage >= 0.7 else None
+
+            for n in range(min(rng.randint(1, 4), member_count - len(members))):
+                client = Client(pk=next_pk[Client], first='First{}'.format(rng.randrange(1000)), last='Last{}'.format(rng.randrange(5000)))
+                next_pk[Client] += 1
+                clients.append(client)
+
+                member = HouseholdMember(
+                    pk=next_pk[HouseholdMember], client=client, household=household,
+                    hoh_relationship=1 if n == 0 else rng.choice([2, 3]),
+                    present_at_enrollment=(n == 0 or rng.random() < 0.95),
+                    entry_date=entry_date, exit_date=exit_date)
+                next_pk[HouseholdMember] += 1
+                members.append(member)
+
+                if entry_date is not None and rng.random() < 0.9:
+                    entries.append(ClientEntryAssessment(member=member, project_entry_date=entry_date))
+                if exit_date is not None and rng.random() < 0.9:
+                    exits.append(ClientExitAssessment(member=member, project_exit_date=exit_date))
+
+        for model, objs in ((Client, clients), (Household, households), (HouseholdMember, members),
+                            (ClientEntryAssessment, entries), (ClientExitAssessment, exits)):
+            batch_size = min(1000, connection.ops.bulk_batch_size(model._meta.concrete_fields, objs))
+            model.objects.bulk_create(objs, batch_size=batch_size)
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def time_changelists(self, repeat):
+        """
+        Time building each changelist the way the admin does, and reading
+        its first page, keeping the fastest of `repeat` runs.
+        """
+        user = get_user_model()(is_active=True, is_staff=True, is_superuser=True)
+        timings = {}
+        for model, parameter, values in CHANGELIST_FILTERS:
+            model_admin = admin.site._registry[model]
+            for value in values:
+                request = RequestFactory().get('/', {} if value is None else {parameter: value})
+                request.user = user
+
+                best = None
+                for _ in range(repeat):
+                    start = time.time()
+                    changelist = self.get_changelist(model_admin, request)
+                    list(changelist.result_list)
+                    elapsed = (time.time() - start) * 1000
+                    best = elapsed if best is None else min(best, elapsed)
+
+                label = '{} {}'.format(model._meta.verbose_name_plural, 'unfiltered' if value is None else '{}={}'.format(parameter, value))
+                timings[(model, parameter, value)] = ((label, changelist.result_count), best)
+        return timings
+
+    def get_changelist(self, model_admin, request):
+        # As in ModelAdmin.changelist_view
+        ChangeList = model_admin.get_changelist(request)
+        list_display = model_admin.get_list_display(request)
+        return ChangeList(
+            request, model_admin.model, list_display,
+            model_admin.get_list_display_links(request, list_display),
+            model_admin.get_list_filter(request), model_admin.date_hierarchy,
+            model_admin.get_search_fields(request), model_admin.list_select_related,
+            model_admin.list_per_page, model_admin.list_max_show_all,
+            model_admin.list_editable, model_admin)
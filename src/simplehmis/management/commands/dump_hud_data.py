@@ -1,98 +1,87 @@
 import os
-from django.core.management.base import BaseCommand
-from django.db import transaction
-from simplehmis import consts
-from simplehmis.models import (Client, HouseholdMember, ClientEntryAssessment,
-                               ClientAnnualAssessment, ClientExitAssessment)
-from simplehmis.management.dumper_utils import DumpHelper
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import datetime, timedelta
+from simplehmis.models import ExportRun
+from simplehmis.management.dumper_utils import (
+    EXPORT_CHUNK_SIZE, EXPORT_WRITERS, SNAPSHOT_VENDORS, export_filename,
+    hud_export_tables, iter_parallel_hud_dump, set_repeatable_read)
 
 
 class Command(BaseCommand):
-    help = ('Loads clients from a CSV file.')
+    help = ('Dumps all HUD data to CSV (or Parquet) files in a directory.')
 
     def add_arguments(self, parser):
         parser.add_argument('dirname', nargs=1, type=str)
+        parser.add_argument('--since', type=str,
+            help=('Only dump the rows created, updated, or deleted after the '
+                  'given date/time (e.g. 2015-08-01 or 2015-08-01T17:30), or '
+                  'after the last successful dump if "last" is given.'))
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+            help=('The number of rows to read from the database at a time '
+                  '(default {}).'.format(EXPORT_CHUNK_SIZE)))
+        parser.add_argument('-j', '--jobs', type=int, default=1,
+            help=('The number of files to dump at once, each in a separate '
+                  'process. Only supported on PostgreSQL and SQLite.'))
+        parser.add_argument('--format', choices=sorted(EXPORT_WRITERS), default='csv',
+            help=('The file format to dump to. The parquet format keeps the '
+                  'CSV columns, typed, and requires the pyarrow package.'))
+
+    def parse_since(self, value):
+        if value is None:
+            return None
+
+        if value == 'last':
+            try:
+                return ExportRun.objects.latest().as_of
+            except ExportRun.DoesNotExist:
+                raise CommandError('There is no previous dump to continue from. Run a full dump first.')
+
+        since = parse_datetime(value)
+        if since is None:
+            date = parse_date(value)
+            if date is None:
+                raise CommandError('Could not understand the date/time {!r}'.format(value))
+            since = datetime.combine(date, datetime.min.time())
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since, timezone.get_current_timezone())
+        return since
 
     def handle(self, *args, **options):
         dirname = options['dirname'][0]
+        since = self.parse_since(options['since'])
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('The chunk size must be a positive number of rows.')
+        jobs = options['jobs']
+        if jobs < 1:
+            raise CommandError('The number of jobs must be a positive number.')
+        if jobs > 1 and connection.vendor not in SNAPSHOT_VENDORS:
+            raise CommandError('Dumping more than one file at once is only supported on PostgreSQL and SQLite.')
+        format = options['format']
 
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
         with transaction.atomic():
-            print('dumping clients')
-            Client.objects.dump_to_csv_file(os.path.join(dirname, 'clients.csv'))
-            print('enrollments')
-            HouseholdMember.objects.filter(present_at_enrollment=True)\
-                .dump_to_csv_file(os.path.join(dirname, 'enrollments.csv'))
-
-            print('dumping entry assessments')
-            DumpHelper().dump_to_csv_file(
-                ClientEntryAssessment.objects.filter(member__present_at_enrollment=True),
-                os.path.join(dirname, 'entry_assessments.csv'),
-                all_fields=(
-                    'enrollment_id',
-                    'health_insurance', 'health_insurance_medicaid', 'health_insurance_medicare', 'health_insurance_chip', 'health_insurance_va', 'health_insurance_employer', 'health_insurance_cobra', 'health_insurance_private', 'health_insurance_state', 'health_insurance_none_reason',
-                    'physical_disability', 'physical_disability_impairing', 'developmental_disability', 'developmental_disability_impairing', 'chronic_health', 'chronic_health_impairing', 'hiv_aids', 'hiv_aids_impairing', 'mental_health', 'mental_health_impairing', 'substance_abuse', 'substance_abuse_impairing',
-                    'housing_status', 'entering_from_streets', 'homeless_start_date', 'homeless_in_three_years', 'homeless_months_in_three_years', 'status_documented', 'prior_residence', 'prior_residence_other', 'length_at_prior_residence',
-                    'domestic_violence', 'domestic_violence_occurred',
-                    'income_status', 'income_notes',
-                ),
-                hud_code_fields={
-                    'health_insurance': dict(consts.HUD_YES_NO), 'health_insurance_medicaid': dict(consts.HUD_YES_NO), 'health_insurance_medicare': dict(consts.HUD_YES_NO), 'health_insurance_chip': dict(consts.HUD_YES_NO), 'health_insurance_va': dict(consts.HUD_YES_NO), 'health_insurance_employer': dict(consts.HUD_YES_NO), 'health_insurance_cobra': dict(consts.HUD_YES_NO), 'health_insurance_private': dict(consts.HUD_YES_NO), 'health_insurance_state': dict(consts.HUD_YES_NO), 'health_insurance_none_reason': dict(consts.HUD_CLIENT_UNINSURED_REASON),
-                    'physical_disability': dict(consts.HUD_YES_NO), 'physical_disability_impairing': dict(consts.HUD_YES_NO), 'developmental_disability': dict(consts.HUD_YES_NO), 'developmental_disability_impairing': dict(consts.HUD_YES_NO), 'chronic_health': dict(consts.HUD_YES_NO), 'chronic_health_impairing': dict(consts.HUD_YES_NO), 'hiv_aids': dict(consts.HUD_YES_NO), 'hiv_aids_impairing': dict(consts.HUD_YES_NO), 'mental_health': dict(consts.HUD_YES_NO), 'mental_health_impairing': dict(consts.HUD_YES_NO), 'substance_abuse': dict(consts.HUD_CLIENT_SUBSTANCE_ABUSE), 'substance_abuse_impairing': dict(consts.HUD_YES_NO),
-                    'housing_status': dict(consts.HUD_CLIENT_HOUSING_STATUS), 'entering_from_streets': dict(consts.HUD_YES_NO), 'homeless_in_three_years': dict(consts.HUD_CLIENT_HOMELESS_COUNT), 'homeless_months_in_three_years': dict(consts.HUD_CLIENT_HOMELESS_MONTHS), 'status_documented': dict(consts.HUD_YES_NO), 'prior_residence': dict(consts.HUD_CLIENT_PRIOR_RESIDENCE), 'length_at_prior_residence': dict(consts.HUD_CLIENT_LENGTH_AT_PRIOR_RESIDENCE),
-                    'domestic_violence': dict(consts.HUD_YES_NO), 'domestic_violence_occurred': dict(consts.HUD_CLIENT_DOMESTIC_VIOLENCE),
-                    'income_status': dict(consts.HUD_YES_NO),
-                },
-                multi_hud_code_fields=set(),
-                renamed_fields={
-                    'enrollment_id': 'member_id'
-                },)
-
-            print('dumping annual assessments')
-            DumpHelper().dump_to_csv_file(
-                ClientAnnualAssessment.objects.filter(member__present_at_enrollment=True),
-                os.path.join(dirname, 'annual_assessments.csv'),
-                all_fields=(
-                    'enrollment_id',
-                    'health_insurance', 'health_insurance_medicaid', 'health_insurance_medicare', 'health_insurance_chip', 'health_insurance_va', 'health_insurance_employer', 'health_insurance_cobra', 'health_insurance_private', 'health_insurance_state', 'health_insurance_none_reason',
-                    'physical_disability', 'physical_disability_impairing', 'developmental_disability', 'developmental_disability_impairing', 'chronic_health', 'chronic_health_impairing', 'hiv_aids', 'hiv_aids_impairing', 'mental_health', 'mental_health_impairing', 'substance_abuse', 'substance_abuse_impairing',
-                    'domestic_violence', 'domestic_violence_occurred',
-                    'income_status', 'income_notes',
-                ),
-                hud_code_fields={
-                    'health_insurance': dict(consts.HUD_YES_NO), 'health_insurance_medicaid': dict(consts.HUD_YES_NO), 'health_insurance_medicare': dict(consts.HUD_YES_NO), 'health_insurance_chip': dict(consts.HUD_YES_NO), 'health_insurance_va': dict(consts.HUD_YES_NO), 'health_insurance_employer': dict(consts.HUD_YES_NO), 'health_insurance_cobra': dict(consts.HUD_YES_NO), 'health_insurance_private': dict(consts.HUD_YES_NO), 'health_insurance_state': dict(consts.HUD_YES_NO), 'health_insurance_none_reason': dict(consts.HUD_CLIENT_UNINSURED_REASON),
-                    'physical_disability': dict(consts.HUD_YES_NO), 'physical_disability_impairing': dict(consts.HUD_YES_NO), 'developmental_disability': dict(consts.HUD_YES_NO), 'developmental_disability_impairing': dict(consts.HUD_YES_NO), 'chronic_health': dict(consts.HUD_YES_NO), 'chronic_health_impairing': dict(consts.HUD_YES_NO), 'hiv_aids': dict(consts.HUD_YES_NO), 'hiv_aids_impairing': dict(consts.HUD_YES_NO), 'mental_health': dict(consts.HUD_YES_NO), 'mental_health_impairing': dict(consts.HUD_YES_NO), 'substance_abuse': dict(consts.HUD_CLIENT_SUBSTANCE_ABUSE), 'substance_abuse_impairing': dict(consts.HUD_YES_NO),
-                    'domestic_violence': dict(consts.HUD_YES_NO), 'domestic_violence_occurred': dict(consts.HUD_CLIENT_DOMESTIC_VIOLENCE),
-                    'income_status': dict(consts.HUD_YES_NO),
-                },
-                multi_hud_code_fields=set(),
-                renamed_fields={
-                    'enrollment_id': 'member_id'
-                },)
-
-            print('dumping exit assessments')
-            DumpHelper().dump_to_csv_file(
-                ClientExitAssessment.objects.filter(member__present_at_enrollment=True),
-                os.path.join(dirname, 'exit_assessments.csv'),
-                all_fields=(
-                    'enrollment_id',
-                    'health_insurance', 'health_insurance_medicaid', 'health_insurance_medicare', 'health_insurance_chip', 'health_insurance_va', 'health_insurance_employer', 'health_insurance_cobra', 'health_insurance_private', 'health_insurance_state', 'health_insurance_none_reason',
-                    'physical_disability', 'physical_disability_impairing', 'developmental_disability', 'developmental_disability_impairing', 'chronic_health', 'chronic_health_impairing', 'hiv_aids', 'hiv_aids_impairing', 'mental_health', 'mental_health_impairing', 'substance_abuse', 'substance_abuse_impairing',
-                    'domestic_violence', 'domestic_violence_occurred',
-                    'income_status', 'income_notes',
-                    'destination',
-                    'destination_other',
-                ),
-                hud_code_fields={
-                    'health_insurance': dict(consts.HUD_YES_NO), 'health_insurance_medicaid': dict(consts.HUD_YES_NO), 'health_insurance_medicare': dict(consts.HUD_YES_NO), 'health_insurance_chip': dict(consts.HUD_YES_NO), 'health_insurance_va': dict(consts.HUD_YES_NO), 'health_insurance_employer': dict(consts.HUD_YES_NO), 'health_insurance_cobra': dict(consts.HUD_YES_NO), 'health_insurance_private': dict(consts.HUD_YES_NO), 'health_insurance_state': dict(consts.HUD_YES_NO), 'health_insurance_none_reason': dict(consts.HUD_CLIENT_UNINSURED_REASON),
-                    'physical_disability': dict(consts.HUD_YES_NO), 'physical_disability_impairing': dict(consts.HUD_YES_NO), 'developmental_disability': dict(consts.HUD_YES_NO), 'developmental_disability_impairing': dict(consts.HUD_YES_NO), 'chronic_health': dict(consts.HUD_YES_NO), 'chronic_health_impairing': dict(consts.HUD_YES_NO), 'hiv_aids': dict(consts.HUD_YES_NO), 'hiv_aids_impairing': dict(consts.HUD_YES_NO), 'mental_health': dict(consts.HUD_YES_NO), 'mental_health_impairing': dict(consts.HUD_YES_NO), 'substance_abuse': dict(consts.HUD_CLIENT_SUBSTANCE_ABUSE), 'substance_abuse_impairing': dict(consts.HUD_YES_NO),
-                    'domestic_violence': dict(consts.HUD_YES_NO), 'domestic_violence_occurred': dict(consts.HUD_CLIENT_DOMESTIC_VIOLENCE),
-                    'income_status': dict(consts.HUD_YES_NO),
-                    'destination': dict(consts.HUD_CLIENT_DESTINATION),
-                },
-                multi_hud_code_fields=set(),
-                renamed_fields={
-                    'enrollment_id': 'member_id'
-                },)
+            # Rows are stamped when they're saved rather than when they're
+            # committed, so a transaction that is still open now may yet
+            # commit rows stamped before now, which this dump can't see. The
+            # next dump starts far enough back to catch them (at the cost of
+            # repeating some of this dump's rows).
+            as_of = timezone.now() - timedelta(seconds=settings.HUD_EXPORT_MAX_TRANSACTION_SECONDS)
+            if jobs > 1:
+                for filename in iter_parallel_hud_dump(dirname, jobs, since=since, chunk_size=chunk_size,
+                                                       format=format):
+                    self.stdout.write('dumped {}'.format(filename))
+            else:
+                set_repeatable_read()
+                for filename, helper, queryset, dump_options in hud_export_tables(since=since):
+                    filename = export_filename(filename, format)
+                    self.stdout.write('dumping {}'.format(filename))
+                    helper.dump_to_file(queryset, os.path.join(dirname, filename), format=format,
+                                        chunk_size=chunk_size, **dump_options)
+            ExportRun.objects.create(as_of=as_of, since=since)
@@ -1,23 +1,80 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from simplehmis.models import Client
+from simplehmis.management.loader_utils import LOAD_WINDOW_SIZE, LoadDiffReport, LoadErrorReport
 
 
 class Command(BaseCommand):
-    help = ('Loads clients from a CSV file.')
+    help = ('Loads clients from a CSV file. Use "-" as the filename to read '
+            'from standard input.')
 
     def add_arguments(self, parser):
         parser.add_argument('filename', type=str)
         parser.add_argument('-s', '--strong-matching', action='store_true')
         parser.add_argument('-i', '--interactive', action='store_true')
+        parser.add_argument('-b', '--bulk', action='store_true',
+            help=('Match and create the clients for the whole file at once, '
+                  'instead of one row at a time. Much faster for large files.'))
+        parser.add_argument('-w', '--window-size', type=int, default=0,
+            help=('The number of rows to read, load, and commit at a time, '
+                  'so that large files can be loaded in bounded memory (try '
+                  '{}). By default the whole file is read in and loaded in a '
+                  'single transaction.'.format(LOAD_WINDOW_SIZE)))
+        parser.add_argument('-j', '--jobs', type=int, default=1,
+            help=('The number of processes to parse and validate the rows '
+                  'in (default 1).'))
+        parser.add_argument('-r', '--resume', action='store_true',
+            help=('Pick up after the last window that was committed by an '
+                  'earlier load of the same file.'))
+        parser.add_argument('-e', '--error-report', type=str, metavar='FILENAME',
+            help=('Skip any rows with bad values, and list each bad cell in '
+                  'this file, as CSV or (for a .json filename) JSON.'))
+        parser.add_argument('-n', '--dry-run', action='store_true',
+            help=('Go through the whole load without writing anything to '
+                  'the database, and summarize what it would have done. Best '
+                  'combined with --bulk for large files.'))
+        parser.add_argument('-d', '--diff-report', type=str, metavar='FILENAME',
+            help=('List the clients, household members, and assessments '
+                  'that the load creates, matches, or changes in this JSON '
+                  'file.'))
 
     def handle(self, *args, **options):
         filename = options['filename']
         strong_matching = options['strong_matching']
         interactive = options['interactive']
+        bulk = options['bulk']
+        window_size = options['window_size']
+        if window_size < 0:
+            raise CommandError('The window size must not be negative.')
+        jobs = options['jobs']
+        if jobs < 1:
+            raise CommandError('The number of jobs must be at least 1.')
+        error_report = LoadErrorReport() if options['error_report'] else None
+        dry_run = options['dry_run']
+        if dry_run and options['resume']:
+            raise CommandError('A dry run cannot be resumed.')
+        diff_report = LoadDiffReport() if options['diff_report'] or dry_run else None
 
+        load_options = dict(interactive=interactive, strong_matching=strong_matching, bulk=bulk, window_size=window_size, jobs=jobs, error_report=error_report, diff_report=diff_report, dry_run=dry_run)
         if filename == '-':
+            if options['resume']:
+                raise CommandError('A load from standard input cannot be resumed.')
             from sys import stdin
-            Client.objects.load_from_csv_stream(stdin, interactive=interactive, strong_matching=strong_matching)
+            Client.objects.load_from_csv_stream(stdin, **load_options)
         else:
-            Client.objects.load_from_csv_file(filename, interactive=interactive, strong_matching=strong_matching)
+            if options['resume'] and not window_size:
+                raise CommandError('Only a load with a window size can be resumed.')
+            Client.objects.load_from_csv_file(filename, resume=options['resume'], **load_options)
+
+        if error_report is not None:
+            error_report.write(options['error_report'])
+            self.stdout.write('Skipped {} rows with {} bad values; see {}'.format(
+                error_report.row_count(), len(error_report), options['error_report']))
+
+        if diff_report is not None:
+            if options['diff_report']:
+                diff_report.write(options['diff_report'])
+            if dry_run:
+                self.stdout.write('Dry run; nothing was saved. The load would have:')
+                for name, count in diff_report.summary().items():
+                    self.stdout.write('  {}: {}'.format(name.replace('_', ' '), count))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from simplehmis.models import Client, update_client_search_keys
+
+# The number of clients to read at a time.
+CLIENT_CHUNK_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = ('Brings the search key of every client up to date with its '
+            'names and SSN.')
+
+    def handle(self, *args, **options):
+        count = 0
+        last_pk = 0
+        with transaction.atomic():
+            while True:
+                clients = list(Client.objects\
+                    .filter(pk__gt=last_pk)\
+                    .order_by('pk')\
+                    .only('first', 'middle', 'last', 'ssn')[:CLIENT_CHUNK_SIZE])
+                if not clients:
+                    break
+                update_client_search_keys(clients)
+                count += len(clients)
+                last_pk = clients[-1].pk
+        self.stdout.write('Updated the search keys of {} clients'.format(count))
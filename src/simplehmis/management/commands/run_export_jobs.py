@@ -0,0 +1,39 @@
+import time
+from django.core.management.base import BaseCommand
+from simplehmis.models import ExportJob
+
+
+class Command(BaseCommand):
+    help = ('Runs queued HUD data export jobs, and deletes the archives of '
+            'jobs older than HUD_EXPORT_RETENTION_DAYS. Jobs that have been '
+            'running for more than HUD_EXPORT_JOB_TIMEOUT_HOURS are marked as '
+            'failed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+            help='Run any pending jobs and then exit, instead of waiting for more.')
+        parser.add_argument('--interval', type=float, default=5,
+            help='Seconds to wait between checks for new jobs.')
+
+    def handle(self, *args, **options):
+        while True:
+            # A job that is still marked as running long after it started
+            # was interrupted when its worker stopped; it will never finish.
+            # (Other jobs may be in the hands of other workers.)
+            stalled = ExportJob.objects.fail_stalled()
+            if stalled:
+                self.stdout.write('gave up on {} stalled export(s)'.format(stalled))
+
+            expired = ExportJob.objects.delete_expired()
+            if expired:
+                self.stdout.write('deleted {} expired export(s)'.format(expired))
+
+            job = ExportJob.objects.claim_next()
+            if job is not None:
+                self.stdout.write('running export job {}'.format(job.pk))
+                job.run()
+                self.stdout.write('export job {} {}'.format(job.pk, job.status))
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['interval'])
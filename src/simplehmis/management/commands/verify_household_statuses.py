@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from simplehmis.models import Household, HOUSEHOLD_STATUS_BATCH_SIZE, get_household_statuses
+
+
+class Command(BaseCommand):
+    help = ('Checks that the stored enrollment and assessment statuses of '
+            'every household match its members, and lists any that do not. '
+            'Fix them with backfill_household_statuses.')
+
+    def handle(self, *args, **options):
+        stored = Household.objects\
+            .order_by('pk')\
+            .values_list('pk', 'enrollment_status', 'assessments_complete')
+        stored = list(stored)
+
+        mismatches = 0
+        for start in range(0, len(stored), HOUSEHOLD_STATUS_BATCH_SIZE):
+            batch = stored[start:start + HOUSEHOLD_STATUS_BATCH_SIZE]
+            expected = get_household_statuses([pk for pk, _, _ in batch])
+            for pk, status, complete in batch:
+                if (status, complete) != expected[pk]:
+                    mismatches += 1
+                    self.stdout.write('household {}: stored {}, expected {}'.format(
+                        pk, (status, complete), expected[pk]))
+
+        if mismatches:
+            raise CommandError('{} of {} households have stale statuses.'.format(mismatches, len(stored)))
+        self.stdout.write('All {} household statuses are up to date'.format(len(stored)))
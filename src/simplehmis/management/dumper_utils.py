@@ -1,78 +1,732 @@
 import csv
+import os
+import shutil
+import sqlite3
+from contextlib import contextmanager
+from io import StringIO
+from multiprocessing import Pool
+from operator import attrgetter, itemgetter
+from tempfile import mkdtemp
 
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections, transaction
+from simplehmis import consts
 from simplehmis.models import (
-    ClientRace, Household, HouseholdMember, Project, ClientEntryAssessment,
-    ClientExitAssessment)
+    Client, ClientRace, Household, HouseholdMember, Project,
+    ClientEntryAssessment, ClientAnnualAssessment, ClientExitAssessment,
+    DeletedRecord)
+from simplehmis.management.loader_utils import batches
+from simplehmis.management.zip_utils import ZipStream
 
 import logging
 logger = logging.getLogger(__name__)
 
 
+EXPORT_CHUNK_SIZE = 2000
+
+
+def iter_queryset_chunks(queryset, chunk_size=EXPORT_CHUNK_SIZE, key=attrgetter('pk')):
+    """
+    Generate lists of the objects in a queryset, `chunk_size` objects at a
+    time, in primary key order.
+
+    Each chunk is fetched with its own query, starting after the last
+    primary key of the previous chunk, so only one chunk is ever held in
+    memory. (Django's `QuerySet.iterator` doesn't use a server-side cursor,
+    so on PostgreSQL it would still load the whole result set into the
+    client.) For `values_list` querysets, pass a `key` that picks the
+    primary key out of each row.
+    """
+    queryset = queryset.order_by('pk')
+    page = queryset
+    while True:
+        chunk = list(page[:chunk_size])
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            break
+        page = queryset.filter(pk__gt=key(chunk[-1]))
+
+
+# The kind of data in each column of an export, by the internal type of the
+# model field that it comes from. Any other field is exported as text.
+FIELD_KINDS = {
+    'AutoField': 'integer',
+    'IntegerField': 'integer',
+    'PositiveIntegerField': 'integer',
+    'SmallIntegerField': 'integer',
+    'PositiveSmallIntegerField': 'integer',
+    'BigIntegerField': 'integer',
+    'ForeignKey': 'integer',
+    'OneToOneField': 'integer',
+    'BooleanField': 'boolean',
+    'NullBooleanField': 'boolean',
+    'DateField': 'date',
+    'DateTimeField': 'datetime',
+}
+
+
+def lookup_field(model, lookup):
+    """
+    Get the model field at the end of a lookup like 'household__project__id'.
+    """
+    field = None
+    for name in lookup.split('__'):
+        field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        if field.rel is not None:
+            model = field.rel.to
+    return field
+
+
+class ExportPlan:
+    """
+    A precompiled plan for dumping the rows of a model to CSV. The output
+    columns, the `values_list` lookups that feed them, and the code-to-label
+    maps for HUD-coded columns are all worked out once, so that each row is
+    built from a plain tuple with no per-field branching.
+
+    Each column also has a kind, for writers that store typed data: one of
+    'integer', 'boolean', 'date', 'datetime', 'text', or 'label' (for the
+    display value of a HUD code).
+
+    """
+    def __init__(self, model, all_fields=tuple(), hud_code_fields=dict(),
+                 multi_hud_code_fields=set(), renamed_fields=dict(),
+                 field_lookups=dict()):
+        self.model = model
+        self.multi_fields = [field for field in all_fields if field in multi_hud_code_fields]
+
+        # The primary key always comes first in each fetched row, so that
+        # many-to-many values can be matched up with their rows.
+        self.lookups = ['pk']
+        for field in all_fields:
+            if field not in multi_hud_code_fields:
+                lookup = renamed_fields.get(field) or field_lookups.get(field, field)
+                if lookup not in self.lookups:
+                    self.lookups.append(lookup)
+
+        # The values for any many-to-many fields are appended to the end of
+        # each fetched row, as a (codes, labels) pair per field.
+        self.columns = []
+        self.column_kinds = []
+        self.steps = []
+        self.step_fields = []
+        for field in all_fields:
+            if field in multi_hud_code_fields:
+                position = len(self.lookups) + 2 * self.multi_fields.index(field)
+                self.add_column(field, 'text', position)
+                self.add_column(field + ' display value', 'text', position + 1)
+            else:
+                lookup = renamed_fields.get(field) or field_lookups.get(field, field)
+                position = self.lookups.index(lookup)
+                kind = FIELD_KINDS.get(lookup_field(model, lookup).get_internal_type(), 'text')
+                self.add_column(field, kind, position)
+                if field in hud_code_fields:
+                    self.add_column(field + ' display value', 'label', position, hud_code_fields[field], field)
+
+        self.empty_multi_values = ('', '') * len(self.multi_fields)
+
+    def add_column(self, column, kind, position, labels=None, field=None):
+        self.columns.append(column)
+        self.column_kinds.append(kind)
+        self.steps.append((position, labels))
+        self.step_fields.append(field or column)
+
+    def build_rows(self, rows):
+        steps = self.steps
+        try:
+            return [
+                [row[position] if labels is None else labels[row[position]]
+                 for position, labels in steps]
+                for row in rows
+            ]
+        except KeyError:
+            # Find the culprit so that the error is useful.
+            for row in rows:
+                for (position, labels), field in zip(steps, self.step_fields):
+                    if labels is not None and row[position] not in labels:
+                        raise KeyError('Hud code {} for field {} not found in {}'.format(row[position], field, labels))
+            raise
+
+    def load_multi_codes(self):
+        """
+        Load the (code, label) pairs for every choice that the many-to-many
+        fields can take, keyed by the choice's primary key. The choice
+        tables (like `ClientRace`) are tiny, so each is read just once.
+        """
+        codes = []
+        for field_name in self.multi_fields:
+            field = self.model._meta.get_field(field_name)
+            codes.append(dict(
+                (pk, (str(hud_value), label))
+                for pk, hud_value, label
+                in field.rel.to.objects.values_list('pk', 'hud_value', 'label')))
+        return codes
+
+    def load_multi_values(self, rows, multi_codes):
+        """
+        Load the codes and labels for the many-to-many fields of a chunk of
+        fetched rows, with a query on each field's through table for every
+        IN_QUERY_BATCH_SIZE rows.
+        """
+        pks = [row[0] for row in rows]
+
+        values = {}
+        for index, (field_name, codes) in enumerate(zip(self.multi_fields, multi_codes)):
+            field = self.model._meta.get_field(field_name)
+            source = field.m2m_field_name() + '_id'
+            target = field.m2m_reverse_field_name() + '_id'
+
+            # A filtered export's chunk can be spread thinly over a wide range
+            # of keys, so the chunk's own keys are looked up, a batch at a
+            # time to stay under the database's parameter limit.
+            selected = {}
+            for batch in batches(pks):
+                for pk, code_pk in field.rel.through.objects\
+                        .filter(**{source + '__in': batch})\
+                        .order_by('pk')\
+                        .values_list(source, target):
+                    selected.setdefault(pk, []).append(codes[code_pk])
+
+            for pk, pairs in selected.items():
+                row_values = values.setdefault(pk, list(self.empty_multi_values))
+                row_values[2 * index] = ';'.join(hud_value for hud_value, label in pairs)
+                row_values[2 * index + 1] = ';'.join(label for hud_value, label in pairs)
+
+        return dict((pk, tuple(row_values)) for pk, row_values in values.items())
+
+    def iter_row_chunks(self, queryset, chunk_size=EXPORT_CHUNK_SIZE):
+        """
+        Generate lists of output rows, `chunk_size` rows at a time.
+        """
+        queryset = queryset.prefetch_related(None)
+        multi_codes = self.load_multi_codes() if self.multi_fields else None
+        values = queryset.values_list(*self.lookups)
+
+        for rows in iter_queryset_chunks(values, chunk_size, key=itemgetter(0)):
+            if multi_codes is not None:
+                multi_values = self.load_multi_values(rows, multi_codes)
+                empty = self.empty_multi_values
+                rows = [row + multi_values.get(row[0], empty) for row in rows]
+            yield self.build_rows(rows)
+
+
 class DumpHelper:
     """
     A helper class for a `Manager` to dump data to a CSV file.
 
     """
-    def dump_to_csv_file(self, manager, filename,
-                         all_fields=tuple(), hud_code_fields=dict(),
-                         multi_hud_code_fields=set(),
-                         renamed_fields=dict()):
-        logger.debug('Opening the CSV file {}'.format(filename))
+    # Lookups (relative to the dumped model) for any columns that don't
+    # correspond to a field on the model itself.
+    field_lookups = {}
 
-        all_fields = list(all_fields)
+    def dump_to_csv_file(self, manager, filename, **options):
+        self.dump_to_file(manager, filename, format='csv', **options)
 
-        for field in hud_code_fields.keys() | multi_hud_code_fields:
-            i = all_fields.index(field)
-            all_fields.insert(i + 1, field + ' display value')
+    def dump_to_file(self, manager, filename, format='csv',
+                     chunk_size=EXPORT_CHUNK_SIZE, **options):
+        """
+        Dump the objects in the manager to a file, using the writer for the
+        given format (see `EXPORT_WRITERS`).
+        """
+        logger.debug('Opening the {} file {}'.format(format, filename))
 
-        with open(filename, 'w') as csvfile:
-            writer = csv.DictWriter(csvfile, all_fields)
+        plan = self.get_export_plan(manager.model, **options)
+        writer = EXPORT_WRITERS[format](filename, plan)
+        try:
+            for rows in plan.iter_row_chunks(manager.all(), chunk_size):
+                writer.write_rows(rows)
+        finally:
+            writer.close()
 
-            writer.writeheader()
+    def get_export_plan(self, model, **options):
+        return ExportPlan(model, field_lookups=self.field_lookups, **options)
 
-            for obj in manager.all():
-                data = self.build_row(obj, all_fields, hud_code_fields,
-                                      multi_hud_code_fields, renamed_fields)
-                writer.writerow(data)
+    def iter_csv_chunks(self, manager, chunk_size=EXPORT_CHUNK_SIZE, **options):
+        """
+        Generate blocks of CSV data for the objects in the manager,
+        `chunk_size` rows at a time.
+        """
+        plan = self.get_export_plan(manager.model, **options)
 
-    def build_row(self, obj, all_fields, hud_code_fields,
-                  multi_hud_code_fields, renamed_fields, data=None):
-        if data is None:
-            data = {}
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(plan.columns)
 
-        for field in all_fields:
-            if field in data:
-                continue
-
-            if field in hud_code_fields:
-                display = hud_code_fields[field]
-                code = getattr(obj, field)
-                data[field] = code
-                try:
-                    data[field + ' display value'] = display[code]
-                except KeyError:
-                    raise KeyError('Hud code {} for field {} not found in {}'.format(code, field, display))
-            elif field in multi_hud_code_fields:
-                codes = getattr(obj, field).all()
-                data[field] = ';'.join(str(code.hud_value) for code in codes)
-                data[field + ' display value'] = ';'.join(code.label for code in codes)
-            elif field in renamed_fields:
-                orig_field = renamed_fields[field]
-                data[field] = getattr(obj, orig_field)
+        for rows in plan.iter_row_chunks(manager.all(), chunk_size):
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
+class CSVExportWriter:
+    """
+    Write exported rows to a CSV file.
+
+    """
+    extension = 'csv'
+
+    def __init__(self, filename, plan):
+        self.file = open(filename, 'w')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(plan.columns)
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetExportWriter:
+    """
+    Write exported rows to a Parquet file, with the same columns as the CSV
+    export but typed: HUD codes are stored as integers, dates as dates, and
+    display values as dictionary-encoded strings. Requires the optional
+    `pyarrow` package.
+
+    """
+    extension = 'parquet'
+
+    def __init__(self, filename, plan):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImproperlyConfigured(
+                'Dumping to Parquet requires the pyarrow package. Install it '
+                'with "pip install pyarrow".')
+
+        types = {
+            'integer': pyarrow.int64(),
+            'boolean': pyarrow.bool_(),
+            'date': pyarrow.date32(),
+            'datetime': pyarrow.timestamp('us', tz='UTC'),
+            'label': pyarrow.dictionary(pyarrow.int32(), pyarrow.string()),
+            'text': pyarrow.string(),
+        }
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([
+            pyarrow.field(column, types[kind])
+            for column, kind in zip(plan.columns, plan.column_kinds)
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(filename, self.schema)
+
+    def write_rows(self, rows):
+        pyarrow = self.pyarrow
+        arrays = []
+        for index, field in enumerate(self.schema):
+            values = [row[index] for row in rows]
+            if pyarrow.types.is_dictionary(field.type):
+                arrays.append(pyarrow.array(values, type=pyarrow.string()).dictionary_encode())
             else:
-                data[field] = getattr(obj, field)
-        return data
+                arrays.append(pyarrow.array(values, type=field.type))
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+EXPORT_WRITERS = {
+    'csv': CSVExportWriter,
+    'parquet': ParquetExportWriter,
+}
+
+
+def export_filename(filename, format):
+    """
+    Get the name of an export file for the given format.
+    """
+    return os.path.splitext(filename)[0] + '.' + EXPORT_WRITERS[format].extension
 
 
 class HouseholdMemberDumpHelper (DumpHelper):
-    def build_row(self, obj, all_fields, hud_code_fields,
-                  multi_hud_code_fields, renamed_fields, data=None):
-        if data is None:
-            data = {}
+    field_lookups = {
+        'project_id': 'household__project__id',
+        'project_name': 'household__project__name',
+    }
+
+
+CLIENT_DUMP_OPTIONS = dict(
+    all_fields=('client_id', 'first', 'middle', 'last', 'suffix',
+                'dob', 'ssn','gender', 'race', 'ethnicity',
+                'veteran_status'),
+    hud_code_fields={
+        'gender': consts.HUD_CLIENT_GENDER_LOOKUP.labels,
+        'ethnicity': consts.HUD_CLIENT_ETHNICITY_LOOKUP.labels,
+        'veteran_status': consts.HUD_YES_NO_LOOKUP.labels,
+    },
+    multi_hud_code_fields={'race'},
+    renamed_fields={'client_id': 'id'}
+)
+
+
+ENROLLMENT_DUMP_OPTIONS = dict(
+    all_fields=('project_id', 'project_name', 'client_id',
+                'household_id', 'enrollment_id', 'hoh_relationship',
+                'entry_date', 'exit_date'),
+    hud_code_fields={
+        'hoh_relationship': consts.HUD_CLIENT_HOH_RELATIONSHIP_LOOKUP.labels,
+    },
+    renamed_fields={'enrollment_id': 'id'}
+)
+
+
+ENTRY_ASSESSMENT_DUMP_OPTIONS = dict(
+    all_fields=(
+        'enrollment_id',
+        'health_insurance', 'health_insurance_medicaid', 'health_insurance_medicare', 'health_insurance_chip', 'health_insurance_va', 'health_insurance_employer', 'health_insurance_cobra', 'health_insurance_private', 'health_insurance_state', 'health_insurance_none_reason',
+        'physical_disability', 'physical_disability_impairing', 'developmental_disability', 'developmental_disability_impairing', 'chronic_health', 'chronic_health_impairing', 'hiv_aids', 'hiv_aids_impairing', 'mental_health', 'mental_health_impairing', 'substance_abuse', 'substance_abuse_impairing',
+        'housing_status', 'entering_from_streets', 'homeless_start_date', 'homeless_in_three_years', 'homeless_months_in_three_years', 'status_documented', 'prior_residence', 'prior_residence_other', 'length_at_prior_residence',
+        'domestic_violence', 'domestic_violence_occurred',
+        'income_status', 'income_notes',
+    ),
+    hud_code_fields={
+        'health_insurance': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_medicaid': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_medicare': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_chip': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_va': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_employer': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_cobra': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_private': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_state': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_none_reason': consts.HUD_CLIENT_UNINSURED_REASON_LOOKUP.labels,
+        'physical_disability': consts.HUD_YES_NO_LOOKUP.labels, 'physical_disability_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'developmental_disability': consts.HUD_YES_NO_LOOKUP.labels, 'developmental_disability_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'chronic_health': consts.HUD_YES_NO_LOOKUP.labels, 'chronic_health_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'hiv_aids': consts.HUD_YES_NO_LOOKUP.labels, 'hiv_aids_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'mental_health': consts.HUD_YES_NO_LOOKUP.labels, 'mental_health_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'substance_abuse': consts.HUD_CLIENT_SUBSTANCE_ABUSE_LOOKUP.labels, 'substance_abuse_impairing': consts.HUD_YES_NO_LOOKUP.labels,
+        'housing_status': consts.HUD_CLIENT_HOUSING_STATUS_LOOKUP.labels, 'entering_from_streets': consts.HUD_YES_NO_LOOKUP.labels, 'homeless_in_three_years': consts.HUD_CLIENT_HOMELESS_COUNT_LOOKUP.labels, 'homeless_months_in_three_years': consts.HUD_CLIENT_HOMELESS_MONTHS_LOOKUP.labels, 'status_documented': consts.HUD_YES_NO_LOOKUP.labels, 'prior_residence': consts.HUD_CLIENT_PRIOR_RESIDENCE_LOOKUP.labels, 'length_at_prior_residence': consts.HUD_CLIENT_LENGTH_AT_PRIOR_RESIDENCE_LOOKUP.labels,
+        'domestic_violence': consts.HUD_YES_NO_LOOKUP.labels, 'domestic_violence_occurred': consts.HUD_CLIENT_DOMESTIC_VIOLENCE_LOOKUP.labels,
+        'income_status': consts.HUD_YES_NO_LOOKUP.labels,
+    },
+    multi_hud_code_fields=set(),
+    renamed_fields={
+        'enrollment_id': 'member_id'
+    }
+)
+
+
+ANNUAL_ASSESSMENT_DUMP_OPTIONS = dict(
+    all_fields=(
+        'annual_assessment_id', 'enrollment_id',
+        'health_insurance', 'health_insurance_medicaid', 'health_insurance_medicare', 'health_insurance_chip', 'health_insurance_va', 'health_insurance_employer', 'health_insurance_cobra', 'health_insurance_private', 'health_insurance_state', 'health_insurance_none_reason',
+        'physical_disability', 'physical_disability_impairing', 'developmental_disability', 'developmental_disability_impairing', 'chronic_health', 'chronic_health_impairing', 'hiv_aids', 'hiv_aids_impairing', 'mental_health', 'mental_health_impairing', 'substance_abuse', 'substance_abuse_impairing',
+        'domestic_violence', 'domestic_violence_occurred',
+        'income_status', 'income_notes',
+    ),
+    hud_code_fields={
+        'health_insurance': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_medicaid': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_medicare': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_chip': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_va': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_employer': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_cobra': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_private': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_state': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_none_reason': consts.HUD_CLIENT_UNINSURED_REASON_LOOKUP.labels,
+        'physical_disability': consts.HUD_YES_NO_LOOKUP.labels, 'physical_disability_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'developmental_disability': consts.HUD_YES_NO_LOOKUP.labels, 'developmental_disability_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'chronic_health': consts.HUD_YES_NO_LOOKUP.labels, 'chronic_health_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'hiv_aids': consts.HUD_YES_NO_LOOKUP.labels, 'hiv_aids_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'mental_health': consts.HUD_YES_NO_LOOKUP.labels, 'mental_health_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'substance_abuse': consts.HUD_CLIENT_SUBSTANCE_ABUSE_LOOKUP.labels, 'substance_abuse_impairing': consts.HUD_YES_NO_LOOKUP.labels,
+        'domestic_violence': consts.HUD_YES_NO_LOOKUP.labels, 'domestic_violence_occurred': consts.HUD_CLIENT_DOMESTIC_VIOLENCE_LOOKUP.labels,
+        'income_status': consts.HUD_YES_NO_LOOKUP.labels,
+    },
+    multi_hud_code_fields=set(),
+    renamed_fields={
+        'annual_assessment_id': 'id',
+        'enrollment_id': 'member_id'
+    }
+)
 
-        data['project_id'] = obj.household.project.id
-        data['project_name'] = obj.household.project.name
 
-        return super().build_row(obj, all_fields, hud_code_fields,
-                                 multi_hud_code_fields, renamed_fields,
-                                 data=data)
+EXIT_ASSESSMENT_DUMP_OPTIONS = dict(
+    all_fields=(
+        'enrollment_id',
+        'health_insurance', 'health_insurance_medicaid', 'health_insurance_medicare', 'health_insurance_chip', 'health_insurance_va', 'health_insurance_employer', 'health_insurance_cobra', 'health_insurance_private', 'health_insurance_state', 'health_insurance_none_reason',
+        'physical_disability', 'physical_disability_impairing', 'developmental_disability', 'developmental_disability_impairing', 'chronic_health', 'chronic_health_impairing', 'hiv_aids', 'hiv_aids_impairing', 'mental_health', 'mental_health_impairing', 'substance_abuse', 'substance_abuse_impairing',
+        'domestic_violence', 'domestic_violence_occurred',
+        'income_status', 'income_notes',
+        'destination',
+        'destination_other',
+    ),
+    hud_code_fields={
+        'health_insurance': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_medicaid': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_medicare': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_chip': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_va': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_employer': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_cobra': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_private': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_state': consts.HUD_YES_NO_LOOKUP.labels, 'health_insurance_none_reason': consts.HUD_CLIENT_UNINSURED_REASON_LOOKUP.labels,
+        'physical_disability': consts.HUD_YES_NO_LOOKUP.labels, 'physical_disability_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'developmental_disability': consts.HUD_YES_NO_LOOKUP.labels, 'developmental_disability_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'chronic_health': consts.HUD_YES_NO_LOOKUP.labels, 'chronic_health_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'hiv_aids': consts.HUD_YES_NO_LOOKUP.labels, 'hiv_aids_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'mental_health': consts.HUD_YES_NO_LOOKUP.labels, 'mental_health_impairing': consts.HUD_YES_NO_LOOKUP.labels, 'substance_abuse': consts.HUD_CLIENT_SUBSTANCE_ABUSE_LOOKUP.labels, 'substance_abuse_impairing': consts.HUD_YES_NO_LOOKUP.labels,
+        'domestic_violence': consts.HUD_YES_NO_LOOKUP.labels, 'domestic_violence_occurred': consts.HUD_CLIENT_DOMESTIC_VIOLENCE_LOOKUP.labels,
+        'income_status': consts.HUD_YES_NO_LOOKUP.labels,
+        'destination': consts.HUD_CLIENT_DESTINATION_LOOKUP.labels,
+    },
+    multi_hud_code_fields=set(),
+    renamed_fields={
+        'enrollment_id': 'member_id'
+    }
+)
+
+
+DELETED_RECORD_DUMP_OPTIONS = dict(
+    all_fields=('filename', 'key_field', 'key', 'deleted_at'),
+)
+
+
+def hud_export_tables(since=None):
+    """
+    List the files in a complete HUD data export, as tuples of
+    (filename, helper, queryset, dump options).
+
+    If `since` is given, only the rows created or updated after that time
+    are included, and a deleted.csv file lists the rows that have been
+    deleted since then.
+    """
+    tables = [
+        ('clients.csv', DumpHelper(),
+         Client.objects.all(),
+         CLIENT_DUMP_OPTIONS),
+        ('enrollments.csv', HouseholdMemberDumpHelper(),
+         HouseholdMember.objects.filter(present_at_enrollment=True),
+         ENROLLMENT_DUMP_OPTIONS),
+        ('entry_assessments.csv', DumpHelper(),
+         ClientEntryAssessment.objects.filter(member__present_at_enrollment=True),
+         ENTRY_ASSESSMENT_DUMP_OPTIONS),
+        ('annual_assessments.csv', DumpHelper(),
+         ClientAnnualAssessment.objects.filter(member__present_at_enrollment=True),
+         ANNUAL_ASSESSMENT_DUMP_OPTIONS),
+        ('exit_assessments.csv', DumpHelper(),
+         ClientExitAssessment.objects.filter(member__present_at_enrollment=True),
+         EXIT_ASSESSMENT_DUMP_OPTIONS),
+    ]
+
+    if since is not None:
+        # Every exported model is timestamped, and updated_at is always at
+        # least created_at, so one condition covers new and changed rows.
+        tables = [
+            (filename, helper, queryset.filter(updated_at__gt=since), options)
+            for filename, helper, queryset, options in tables
+        ]
+        tables.append(
+            ('deleted.csv', DumpHelper(),
+             DeletedRecord.objects.filter(deleted_at__gt=since).order_by('deleted_at'),
+             DELETED_RECORD_DUMP_OPTIONS))
+
+    return tables
+
+
+def set_repeatable_read():
+    """
+    Make the current transaction read the whole database as of one moment.
+    Must be called at the start of the transaction, before any queries are
+    run.
+
+    Each query of a READ COMMITTED transaction (PostgreSQL's default) sees
+    the rows committed before that query started, so the export files would
+    be read at different points in time. SQLite transactions are already
+    serializable.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+
+
+def iter_hud_export_zip(progress=None, since=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Generate a zip archive of the complete HUD data export, chunk by chunk.
+    Rows are read, formatted, and compressed as the archive is consumed, so
+    the archive is never held in memory or written to disk.
+
+    If a `progress` callback is given, it is called with the filename, its
+    index, and the total number of files before each file is started. If
+    `since` is given, only the changes after that time are exported. Rows
+    are read from the database `chunk_size` at a time.
+
+    All of the files are read in one transaction, so that they agree with
+    each other.
+    """
+    zipstream = ZipStream()
+    tables = hud_export_tables(since=since)
+
+    starts_transaction = not connection.in_atomic_block
+    with transaction.atomic():
+        if starts_transaction:
+            set_repeatable_read()
+        for index, (filename, helper, queryset, options) in enumerate(tables):
+            if progress is not None:
+                progress(filename, index, len(tables))
+            chunks = helper.iter_csv_chunks(queryset, chunk_size=chunk_size, **options)
+            chunks = (chunk.encode('utf-8') for chunk in chunks)
+            yield from zipstream.add(filename, chunks)
+    yield from zipstream.finish()
+
+
+ENROLLMENT_DEMOGRAPHICS_COLUMNS = (
+    'project name', 'entry date', 'exit date', 'referral created', 'referral last edited',
+    'client name', 'client dob', 'client ssn', 'client gender', 'client vet status')
+
+
+def iter_enrollment_demographics_csv(chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Generate the enrollment demographics (winter initiative) CSV, a block of
+    rows at a time. Only the columns that end up in the file are fetched.
+    """
+    gender_labels = consts.HUD_CLIENT_GENDER_LOOKUP.labels
+    yes_no_labels = consts.HUD_YES_NO_LOOKUP.labels
+
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(ENROLLMENT_DEMOGRAPHICS_COLUMNS)
+    # Send the header straight away, before the first query.
+    yield buffer.getvalue()
+
+    enrollments = HouseholdMember.objects.values_list(
+        'pk', 'household__project__name', 'entry_date', 'exit_date',
+        'household__created_at', 'household__updated_at',
+        'client__first', 'client__middle', 'client__last', 'client__suffix',
+        'client__dob', 'client__ssn', 'client__gender', 'client__veteran_status')
+
+    for rows in iter_queryset_chunks(enrollments, chunk_size, key=itemgetter(0)):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            (
+                project_name,
+                entry_date.isoformat() if entry_date else None,
+                exit_date.isoformat() if exit_date else None,
+                created_at.date().isoformat(),
+                updated_at.date().isoformat(),
+                ' '.join(piece for piece in (first, middle, last, suffix) if piece),
+                dob.isoformat() if dob else None,
+                ssn,
+                gender_labels.get(gender),
+                yes_no_labels.get(veteran_status),
+            )
+            for (pk, project_name, entry_date, exit_date, created_at, updated_at,
+                 first, middle, last, suffix, dob, ssn, gender, veteran_status) in rows
+        )
+        yield buffer.getvalue()
+
+
+# The databases that an export snapshot can be shared from.
+SNAPSHOT_VENDORS = ('postgresql', 'sqlite')
+
+
+@contextmanager
+def export_snapshot():
+    """
+    Share the current transaction's view of the database with other
+    processes. Must be entered at the start of a transaction, before any
+    queries are run. Yields a (database name, snapshot id) pair for
+    `init_dump_worker`.
+
+    On PostgreSQL the transaction is made REPEATABLE READ and its snapshot
+    is exported, so that other sessions can adopt it. On SQLite the database
+    is copied to a temporary file for the other processes to read.
+    """
+    if connection.vendor == 'postgresql':
+        set_repeatable_read()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_export_snapshot()')
+            snapshot_id = cursor.fetchone()[0]
+        yield None, snapshot_id
+
+    elif connection.vendor == 'sqlite':
+        dirname = mkdtemp()
+        try:
+            database_name = os.path.join(dirname, 'snapshot.sqlite3')
+            copy_sqlite_database(database_name)
+            yield database_name, None
+        finally:
+            shutil.rmtree(dirname)
+
+    else:
+        raise NotImplementedError(
+            'Cannot share a snapshot of a {} database.'.format(connection.vendor))
+
+
+def iterdump_without_virtual_tables(sqlite_connection):
+    """
+    Dump the SQLite database like `iterdump`, but without any virtual tables
+    (like the client search index), their shadow tables, or the triggers
+    that write to them, which `iterdump` can't restore, and a dump doesn't
+    read.
+    """
+    virtual_tables = [name for name, in sqlite_connection.execute(
+        "SELECT name FROM sqlite_master WHERE sql LIKE 'CREATE VIRTUAL TABLE%'")]
+    for statement in sqlite_connection.iterdump():
+        if not any(name in statement for name in virtual_tables):
+            yield statement
+
+
+def copy_sqlite_database(filename):
+    """
+    Copy the default SQLite database to a new file, as of the current moment.
+    """
+    name = connection.settings_dict['NAME']
+
+    if connection.is_in_memory_db(name):
+        # An in-memory database (like the test database) can only be read
+        # through the connection that owns it.
+        connection.ensure_connection()
+        target = sqlite3.connect(filename)
+        target.executescript('\n'.join(iterdump_without_virtual_tables(connection.connection)))
+        target.close()
+        return
+
+    # Hold the write lock while copying, so that no one can change the file
+    # part way through.
+    source = sqlite3.connect(name, isolation_level=None)
+    try:
+        source.execute('BEGIN IMMEDIATE')
+        shutil.copyfile(name, filename)
+        if os.path.exists(name + '-wal'):
+            shutil.copyfile(name + '-wal', filename + '-wal')
+        source.execute('ROLLBACK')
+    finally:
+        source.close()
+
+
+# The database connections that a dump worker inherits from its parent. They
+# are kept around so that they're never closed (which would end the parent's
+# database session) from the worker.
+_inherited_connections = []
+_worker_snapshot_id = None
+
+
+def init_dump_worker(database_name, snapshot_id):
+    """
+    Set up a forked process to dump tables from an `export_snapshot`.
+    """
+    global _worker_snapshot_id
+
+    for alias in connections:
+        _inherited_connections.append(connections[alias])
+        del connections[alias]
+
+    if database_name is not None:
+        connections.databases['default']['NAME'] = database_name
+    _worker_snapshot_id = snapshot_id
+
+
+def dump_table(task):
+    """
+    Dump a table of the HUD export from a worker process. The task is a
+    tuple of (table index, since, filename, chunk size, format).
+    """
+    index, since, filename, chunk_size, format = task
+    name, helper, queryset, options = hud_export_tables(since=since)[index]
+
+    with transaction.atomic():
+        if _worker_snapshot_id is not None:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+                cursor.execute('SET TRANSACTION SNAPSHOT %s', [_worker_snapshot_id])
+        helper.dump_to_file(queryset, filename, format=format,
+                            chunk_size=chunk_size, **options)
+    return os.path.basename(filename)
+
+
+def iter_parallel_hud_dump(dirname, jobs, since=None, chunk_size=EXPORT_CHUNK_SIZE,
+                           format='csv'):
+    """
+    Dump the HUD export tables to files in a directory, `jobs` tables at
+    a time, each in its own process and with its own database connection.
+    Every process reads from the same snapshot of the database. Must be
+    called at the start of a transaction.
+
+    Generates the name of each file as it is finished.
+    """
+    tasks = [
+        (index, since, os.path.join(dirname, export_filename(filename, format)),
+         chunk_size, format)
+        for index, (filename, helper, queryset, options)
+        in enumerate(hud_export_tables(since=since))
+    ]
+
+    with export_snapshot() as (database_name, snapshot_id):
+        pool = Pool(jobs, initializer=init_dump_worker,
+                    initargs=(database_name, snapshot_id))
+        try:
+            for filename in pool.imap_unordered(dump_table, tasks):
+                yield filename
+        finally:
+            pool.terminate()
+            pool.join()
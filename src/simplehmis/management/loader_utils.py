@@ -1,9 +1,25 @@
 import csv
+import hashlib
+import json
+import os
+import re
+import shutil
 import sys
-
-from django.utils.timezone import datetime
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date
+from functools import lru_cache
+from multiprocessing import Pool
+from tempfile import mkdtemp
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Case, F, Max, Value, When
+from django.utils.timezone import now
 from simplehmis import consts
-from simplehmis.models import ClientRace, Household, HouseholdMember, Project, ClientEntryAssessment, ClientExitAssessment
+from simplehmis.models import Client, ClientRace, Household, HouseholdMember, Project, ClientEntryAssessment, ClientExitAssessment, LoadCheckpoint
+from simplehmis.models import deferred_household_status_updates, record_members_left_export, update_household_statuses
 
 import pprint
 pretty = pprint.PrettyPrinter(indent=2)
@@ -24,108 +40,66 @@ def try_to_correct_value(message, retry_func, interactive=True):
         raise ValueError(message)
 
 
-def hud_code(value, items, interactive=True):
+# The number of distinct (lookup, value) pairs to remember the HUD codes
+# for. An intake file only has a few dozen distinct values per column.
+HUD_CODE_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=HUD_CODE_CACHE_SIZE)
+def cached_hud_code(lookup, value):
     """
-    Get the corresponding HUD code from a string value.
-    """
-    equivalents = {
-        # Mapping sheet strings to equivalent consts strings
-        'Permanent housing for formerly homeless persons': 'Permanent housing for formerly homeless persons (such as: CoC project; or HUD legacy programs; or HOPWA PH)',
-        'Client Refused': 'Client refused',
-        'Refused Info': 'Client refused',
-        'Refused': 'Client refused',
-        'Client doesn\'t know': 'Client doesn’t know',
-        'Client Doesn’t Know': 'Client doesn’t know',
-        'Client Doesn\'t Know': 'Client doesn’t know',
-        "CLIENT DOESN'T KNOW": 'Client doesn’t know',
-        'UNKNOWN': 'Client doesn’t know',
-        'YES': 'Yes',
-        'NO': 'No',
-
-        'Drugs': 'Drug abuse',
-
-        # 'Self (head of household': 'Self (head of household)',
-        'Head of household’s other relation member': 'Head of household’s other relation member (other relation to head of household)',
-        'HEAD OF HOUSEHOLD CHILD': 'Head of household’s child',
-        "Head of household's child": 'Head of household’s child',
-        'AUNT': 'Head of household’s other relation member (other relation to head of household)',
-
-        # Destinations
-        'Staying with family': 'Staying or living with family, temporary tenure (e.g., room, apartment or house)',
-        'Staying or living with friends, temporary tenure': 'Staying or living with friends, temporary tenure (e.g., room apartment or house)',
-        'Staying or living  with friends, temporary tenure': 'Staying or living with friends, temporary tenure (e.g., room apartment or house)',
-        'Staying or living  with friends, permanent tenure': 'Staying or living with friends, permanent tenure',
-        'Staying or living in a family member\'s room, apartment or house': 'Staying or living in a family member’s room, apartment or house',
-        'Staying or living in a friend\'s room, apartment or house': 'Staying or living in a friend’s room, apartment or house',
-        'Staying or living with family, temporary tenure': 'Staying or living with family, temporary tenure (e.g., room, apartment or house)',
-        'Place not meant for human habitation': 'Place not meant for habitation (e.g., a vehicle, an abandoned building, bus/train/subway station/airport or anywhere outside)',
-        'On the street or other place not meant for human habitation': 'Place not meant for habitation (e.g., a vehicle, an abandoned building, bus/train/subway station/airport or anywhere outside)',
-        'Rental by client': 'Rental by client, no ongoing housing subsidy',
-        'Permanent Housing': 'Permanent housing for formerly homeless persons (such as: CoC project; or HUD legacy programs; or HOPWA PH)',
-        #'Permanent housing for formerly homeless persons': 'Permanent housing for formerly homeless persons (such as: a CoC project; HUD legacy programs; or HOPWA PH)',
-        'Permanent Supportive Housing': 'Permanent housing for formerly homeless persons (such as: CoC project; or HUD legacy programs; or HOPWA PH)',
-        'PHA': 'Permanent housing for formerly homeless persons (such as: CoC project; or HUD legacy programs; or HOPWA PH)',
-        'Staying with friends': 'Staying or living with friends, temporary tenure (e.g., room apartment or house)',
-        'Transitional Housing': 'Transitional housing for homeless persons (including homeless youth)',
-
-        'Data Not Collected': 'Data not collected',
-        'Jail, prison, or juvenile facility': 'Jail, prison or juvenile detention facility',
-        'Rental by client, no ongoing housing subsidy (Private Market)': 'Rental by client, no ongoing housing subsidy',
-        'TRANSITIONAL HOUSING FOR HOMELESS PERSONS': 'Transitional housing for homeless persons (including homeless youth)',
-        "STAYING OR LIVING IN A FRIEND'S ROOM, APARTMENT OR HOUSE": 'Staying or living in a friend’s room, apartment or house',
-        "STAYING OR LIVING IN A FAMILY MEMBER'S ROOM, APARTMENT OR HOUSE": 'Staying or living in a family member’s room, apartment or house',
-
-        # Totally random destinations.
-        'Methodist Hope': 'Other',
-        'find housing': 'Other',
-        'OTHER SUPPORTIVE HOUSING': 'Other',
-
-        # Times homeless
-        '0 (NOT HOMELESS - PREVENTION ONLY)': 'Never in 3 years',
-        '1 (homeless only this time)': 'One time',
-        '1 (HOMELESS ONLY THIS TIME)': 'One time',
-        '2': 'Two times',
-        '3': 'Three times',
-        '4': 'Four or more times',
-        '4 OR MORE': 'Four or more times',
-        "DON'T KNOW": 'Client doesn’t know',
-        'OTHER (PLEASE SPECIFY)': 'Other',
-
-        'Non-Hispanic / Non-Latino': 'Non-Hispanic/Non-Latino',
-        'Non- Hispanic/Non-Latino': 'Non-Hispanic/Non-Latino',
-        'Non-Hispanic/ Non Latin': 'Non-Hispanic/Non-Latino',
-        'Non-Hipanic/Non-Latino': 'Non-Hispanic/Non-Latino',
-        'Non-Hispanic/Non Latin': 'Non-Hispanic/Non-Latino',
-        'Hispanic / Latino': 'Hispanic/Latino',
-        'Hispanic': 'Hispanic/Latino',
-        'Black': 'Black or African American',
-        'BLACK/AFRICAN-AMERICAN': 'Black or African American',
-        'BLACK/NON AFRICAN-AMERICAN': 'Black or African American',
-        'NONE': 'No',
-    }
+    Get the HUD code for a raw (unstripped) cell value from a precompiled
+    `consts.HudCodeLookup`, remembering the result. Raises a KeyError if
+    nothing matches; misses aren't remembered.
+    """
+    return lookup.code(value.strip())
+
 
+def hud_code(value, items, interactive=True):
+    """
+    Get the corresponding HUD code from a string value. The `items` may be
+    a list of choices, or (better) a precompiled `consts.HudCodeLookup`,
+    whose results are cached.
+    """
     if not isinstance(value, str):
         raise ValueError('"value" must be a string, not {}'.format(value))
 
-    value = value.strip()
+    try:
+        if isinstance(items, consts.HudCodeLookup):
+            return cached_hud_code(items, value)
+        else:
+            items = consts.HudCodeLookup(items)
+            return items.code(value.strip())
+    except KeyError:
+        value = value.strip()
+        return try_to_correct_value(
+            'No value {!r} found among {}'.format(value, pretty.pformat([s for n, s in items])),
+            lambda v: hud_code(v, items, interactive),
+            interactive=interactive)
 
-    for number, string in items:
-        if string.lower() == value.lower():
-            return number
 
-        # As a special case, interpret the empty string as
-        # "Data not collected" when "Data not collected" is
-        # available as an option.
-        if value.lower() == '' and string.lower() == 'data not collected':
-            return number
+# The same dates that `strptime` would read with '%m/%d/%Y' or '%m/%d/%y'.
+DATE_PATTERN = re.compile(r'(1[0-2]|0[1-9]|[1-9])/(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])/(\d\d\d\d|\d\d)$')
 
-        if equivalents.get(value) == string:
-            return number
+# The number of distinct date strings to remember the parsed dates for.
+DATE_CACHE_SIZE = 65536
 
-    return try_to_correct_value(
-        'No value {!r} found among {}'.format(value, pretty.pformat([s for n, s in items])),
-        lambda v: hud_code(v, items, interactive),
-        interactive=interactive)
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def cached_date(value):
+    """
+    Parse a stripped mm/dd/yyyy or mm/dd/yy date, remembering the result.
+    Two-digit years are read the way `strptime` reads them (00-68 are in
+    the 2000s). Raises a ValueError if the value isn't a valid date.
+    """
+    match = DATE_PATTERN.match(value)
+    if match is None:
+        raise ValueError('Could not parse the date {!r}'.format(value))
+
+    month, day, year = match.groups()
+    if len(year) == 2:
+        year = int(year) + (2000 if int(year) <= 68 else 1900)
+    return date(int(year), int(month), int(day))
 
 
 def parse_date(d, interactive=True):
@@ -137,12 +111,9 @@ def parse_date(d, interactive=True):
     elif d.lower() in ('not collected',):
         return None
 
-    for fmt in ('%m/%d/%Y', '%m/%d/%y'):
-        try:
-            return datetime.strptime(d.strip(), fmt).date()
-        except ValueError:
-            continue
-    else:
+    try:
+        return cached_date(d.strip())
+    except ValueError:
         return try_to_correct_value(
             'Could not parse the date {!r}'.format(d),
             lambda d: parse_date(d, interactive),
@@ -166,15 +137,1043 @@ def parse_ssn(ssn, interactive=True):
     return norm_ssn
 
 
+def parse_races(value, interactive=True):
+    """
+    Get the HUD codes from a semicolon-separated list of races.
+    """
+    return [
+        hud_code(race, consts.HUD_CLIENT_RACE_LOOKUP, interactive=interactive)
+        for race in value.split(';')
+    ]
+
+
+def hud_code_parser(lookup):
+    def parse(value, interactive=True):
+        return hud_code(value, lookup, interactive=interactive)
+    return parse
+
+
+# The parser for each of the cells in an intake CSV row that gets converted
+# to a typed value.
+INTAKE_CELL_PARSERS = OrderedDict([
+    ('SSN', parse_ssn),
+    ('DOB', parse_date),
+    ('Ethnicity (HUD)', hud_code_parser(consts.HUD_CLIENT_ETHNICITY_LOOKUP)),
+    ('Gender (HUD)', hud_code_parser(consts.HUD_CLIENT_GENDER_LOOKUP)),
+    ('Veteran Status (HUD)', hud_code_parser(consts.HUD_YES_NO_LOOKUP)),
+    ('Race (HUD)', parse_races),
+    ('Relationship to HoH', hud_code_parser(consts.HUD_CLIENT_HOH_RELATIONSHIP_LOOKUP)),
+    ('Head of Household\'s SSN', parse_ssn),
+    ('Program Start Date', parse_date),
+    ('Program End Date', parse_date),
+    ('Exit Destination', hud_code_parser(consts.HUD_CLIENT_DESTINATION_LOOKUP)),
+    ('Physical Disability', hud_code_parser(consts.HUD_YES_NO_LOOKUP)),
+    ('Developmental Disability', hud_code_parser(consts.HUD_YES_NO_LOOKUP)),
+    ('Chronic Health Condition', hud_code_parser(consts.HUD_YES_NO_LOOKUP)),
+    ('HIV/AIDS', hud_code_parser(consts.HUD_YES_NO_LOOKUP)),
+    ('Mental Health Problem', hud_code_parser(consts.HUD_YES_NO_LOOKUP)),
+    ('Substance Abuse', hud_code_parser(consts.HUD_CLIENT_SUBSTANCE_ABUSE_LOOKUP)),
+    ('Domestic Violence', hud_code_parser(consts.HUD_YES_NO_LOOKUP)),
+    ('Has Been Continuously Homeless (on the streets, in EH or in a Safe Haven) for at Least One Year', hud_code_parser(consts.HUD_YES_NO_LOOKUP)),
+    ('Residence Prior to Program Entry - Type of Residence', hud_code_parser(consts.HUD_CLIENT_PRIOR_RESIDENCE_LOOKUP)),
+    ('Residence Prior to Program Entry - Length of Stay in Previous Place', hud_code_parser(consts.HUD_CLIENT_LENGTH_AT_PRIOR_RESIDENCE_LOOKUP)),
+    ('Number of Times the Client has Been Homeless in the Past Three Years (streets, in EH, or in a safe haven)', hud_code_parser(consts.HUD_CLIENT_HOMELESS_COUNT_LOOKUP)),
+])
+
+
+def parse_cell(row, column, interactive=True):
+    """
+    Get the typed value of a cell in an intake row, from the values that
+    `normalize_row` parsed ahead of time if it's there.
+    """
+    values = row.get('_values', {})
+    if column in values:
+        return values[column]
+    return INTAKE_CELL_PARSERS[column](row[column], interactive=interactive)
+
+
+def is_head_of_household(row):
+    return row['Relationship to HoH'].lower() == 'self (head of household)'
+
+
+def is_no_show(row):
+    # Treat clients with a destination including "never" as never having
+    # shown up (there's no valid HUD destination code with "never" in it).
+    destination = row['Exit Destination'].lower()
+    return 'never' in destination or 'no show' in destination
+
+
+def normalize_row(row):
+    """
+    Parse all of the cells in an intake row, without prompting for any
+    corrections. Return the typed values by column, and a list of
+    (column, message) pairs for the cells that couldn't be parsed.
+    """
+    values = {}
+    errors = []
+    for column, parse in INTAKE_CELL_PARSERS.items():
+        if column not in row:
+            continue
+        elif row[column] is None:
+            errors.append((column, 'Missing value'))
+            continue
+        elif column == 'Exit Destination' and is_no_show(row):
+            continue
+
+        try:
+            values[column] = parse(row[column], interactive=False)
+        except ValueError as e:
+            errors.append((column, str(e)))
+
+    # A head of household should be listed with their own SSN.
+    ssn = values.get('SSN')
+    hoh_ssn = values.get('Head of Household\'s SSN')
+    if ssn is not None and hoh_ssn and ssn != hoh_ssn and is_head_of_household(row):
+        errors.append(('Head of Household\'s SSN', 'Client is listed as the head of household, but does not match the head of household\'s SSN: {!r} vs {!r}.'.format(row['SSN'], row['Head of Household\'s SSN'])))
+
+    return values, errors
+
+
+def hash_file(filename):
+    """
+    Get the SHA-256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_numbered_rows(reader):
+    """
+    Yield the rows from a CSV reader, noting the line each one ends on.
+    """
+    for row in reader:
+        row['_line'] = reader.line_num
+        yield row
+
+
+@contextmanager
+def normalization_pool(jobs):
+    """
+    Provide a process pool to normalize rows in, or None if the rows should
+    just be normalized in this process.
+    """
+    if jobs <= 1:
+        yield None
+        return
+
+    pool = Pool(jobs)
+    try:
+        yield pool
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+@contextmanager
+def dry_run_transaction():
+    """
+    Read the database for a dry run of a load, which doesn't write to it, as
+    of one moment, and without holding up anyone else's writes.
+
+    On PostgreSQL, the block runs in a READ ONLY, REPEATABLE READ
+    transaction. On SQLite, the default connection reads from a copy of the
+    database file, so that the database isn't kept locked for the length of
+    the load. Otherwise (including inside of a transaction that's already
+    started), the block runs in a transaction that's rolled back.
+    """
+    name = connection.settings_dict['NAME']
+    starts_transaction = not connection.in_atomic_block
+
+    if starts_transaction and connection.vendor == 'postgresql':
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+            yield
+        return
+
+    if starts_transaction and connection.vendor == 'sqlite' and not connection.is_in_memory_db(name):
+        from simplehmis.management.dumper_utils import copy_sqlite_database
+        dirname = mkdtemp()
+        try:
+            copy_name = os.path.join(dirname, 'dry_run.sqlite3')
+            copy_sqlite_database(copy_name)
+            connection.close()
+            connection.settings_dict['NAME'] = copy_name
+            try:
+                yield
+            finally:
+                connection.close()
+                connection.settings_dict['NAME'] = name
+        finally:
+            shutil.rmtree(dirname)
+        return
+
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+class LoadErrorReport:
+    """
+    A list of the cells that couldn't be loaded from an intake CSV, by line
+    and column, to be written out as CSV or (for a `.json` filename) JSON.
+
+    """
+    FIELDS = ('line', 'column', 'value', 'message')
+
+    def __init__(self):
+        self.errors = []
+
+    def __len__(self):
+        return len(self.errors)
+
+    def add(self, row, column, message):
+        self.errors.append(OrderedDict([
+            ('line', row.get('_line')),
+            ('column', column),
+            ('value', row.get(column)),
+            ('message', message),
+        ]))
+
+    def row_count(self):
+        return len(set(error['line'] for error in self.errors))
+
+    def write(self, filename):
+        errors = sorted(self.errors, key=lambda error: error['line'] or 0)
+        with open(filename, 'w') as outfile:
+            if filename.endswith('.json'):
+                json.dump(errors, outfile, indent=2)
+            else:
+                writer = csv.DictWriter(outfile, self.FIELDS)
+                writer.writeheader()
+                writer.writerows(errors)
+
+
+class LoadDiffReport:
+    """
+    What a load did (or, for a dry run, would have done) to the database:
+    the clients it created or matched for each row, the household
+    memberships and households it created, and the assessments it created
+    or changed, to be written out as JSON.
+
+    Rows are told apart from the ones that already existed by their primary
+    keys, so a diff report must be started before the load is. Anything
+    created during the load has no primary key in the report, since a dry
+    run's keys are only guesses at what the load would have used.
+
+    """
+    def __init__(self):
+        self.last_pks = {}
+        self.new_client_pks = set()
+        self.new_household_pks = set()
+        self.clients = []
+        self.members = []
+        self.assessments = []
+        self.no_shows = []
+
+    def start(self):
+        for model in (Client, Household):
+            self.last_pks[model] = model.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+
+    def is_new(self, obj):
+        return obj.pk > self.last_pks[type(obj)]
+
+    def describe_member(self, member):
+        client = member.client
+        return OrderedDict([
+            ('client', None if self.is_new(client) else client.pk),
+            ('first', client.first),
+            ('last', client.last),
+            ('project', member.household.project.name),
+            ('entry_date', member.entry_date),
+        ])
+
+    def add_client(self, row, client):
+        if self.is_new(client) and client.pk not in self.new_client_pks:
+            self.new_client_pks.add(client.pk)
+            action = 'created'
+        else:
+            action = 'matched'
+
+        self.clients.append(OrderedDict([
+            ('line', row.get('_line')),
+            ('action', action),
+            ('client', None if self.is_new(client) else client.pk),
+            ('first', client.first),
+            ('last', client.last),
+        ]))
+
+    def add_member(self, row, member, created):
+        household = member.household
+        if self.is_new(household):
+            household_created = household.pk not in self.new_household_pks
+            self.new_household_pks.add(household.pk)
+        else:
+            household_created = False
+
+        entry = OrderedDict([
+            ('line', row.get('_line')),
+            ('action', 'created' if created else 'matched'),
+            ('household', None if self.is_new(household) else household.pk),
+            ('household_created', household_created),
+            ('hoh_relationship', member.hoh_relationship),
+        ])
+        entry.update(self.describe_member(member))
+        self.members.append(entry)
+
+    def add_assessment(self, kind, assessment, changes, conflicts):
+        """
+        Note an assessment that's about to be created or updated, with the
+        values that changed and the ones that conflicted, as (old, new)
+        pairs by field name.
+        """
+        if assessment.pk is None:
+            action = 'created'
+        elif changes:
+            action = 'changed'
+        elif conflicts:
+            action = 'unchanged'
+        else:
+            return
+
+        entry = OrderedDict([('kind', kind), ('action', action)])
+        entry.update(self.describe_member(assessment.member))
+        if assessment.pk is not None:
+            entry['changes'] = changes
+        entry['conflicts'] = conflicts
+        self.assessments.append(entry)
+
+    def add_no_show(self, member):
+        self.no_shows.append(self.describe_member(member))
+
+    def summary(self):
+        def count(entries, **values):
+            return sum(1 for entry in entries if all(entry[k] == v for k, v in values.items()))
+
+        return OrderedDict([
+            ('rows', len(self.clients)),
+            ('created_clients', count(self.clients, action='created')),
+            ('matched_clients', count(self.clients, action='matched')),
+            ('created_households', len(self.new_household_pks)),
+            ('created_members', count(self.members, action='created')),
+            ('matched_members', count(self.members, action='matched')),
+            ('created_entry_assessments', count(self.assessments, kind='entry', action='created')),
+            ('changed_entry_assessments', count(self.assessments, kind='entry', action='changed')),
+            ('created_exit_assessments', count(self.assessments, kind='exit', action='created')),
+            ('changed_exit_assessments', count(self.assessments, kind='exit', action='changed')),
+            ('assessment_conflicts', sum(len(entry['conflicts']) for entry in self.assessments)),
+            ('no_shows', len(self.no_shows)),
+        ])
+
+    def write(self, filename):
+        report = OrderedDict([
+            ('summary', self.summary()),
+            ('clients', sorted(self.clients, key=lambda entry: entry['line'] or 0)),
+            ('members', sorted(self.members, key=lambda entry: entry['line'] or 0)),
+            ('assessments', self.assessments),
+            ('no_shows', self.no_shows),
+        ])
+        with open(filename, 'w') as outfile:
+            json.dump(report, outfile, indent=2, cls=DjangoJSONEncoder)
+
+
+# A good number of CSV rows to load at a time when streaming a large file.
+LOAD_WINDOW_SIZE = 1000
+
+# How many more windows of rows a dependent waits for their head of
+# household to be loaded, after the window they're in. A household's rows
+# are expected to be listed together.
+PENDING_DEPENDENT_WINDOWS = 1
+
+
+def iter_row_windows(rows, window_size):
+    """
+    Yield lists of up to `window_size` rows.
+    """
+    window = []
+    for row in rows:
+        window.append(row)
+        if len(window) >= window_size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+class PendingDependents:
+    """
+    Dependent rows that can't be loaded until their head of household has
+    been, keyed by what the head of household will be matched on: their SSN
+    and entry date, or their project, entry date, and last name.
+
+    Each entry remembers the window of rows that it was set aside in, so
+    that the entries that have waited too long can be taken out with
+    `pop_stale`.
+
+    """
+    def __init__(self):
+        self.by_key = OrderedDict()
+        self.count = 0
+        self.window = 0
+        self.added_in_window = {}
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.by_key.values())
+
+    def add(self, key, row, hoh_state):
+        self.by_key.setdefault(key, []).append((self.count, row, hoh_state))
+        self.added_in_window[self.count] = self.window
+        self.count += 1
+
+    def next_window(self):
+        self.window += 1
+
+    def pop(self, keys):
+        """
+        Remove and return the entries waiting on any of the keys, in the
+        order they were added.
+        """
+        entries = []
+        for key in keys:
+            entries.extend(self.by_key.pop(key, []))
+        for count, _, _ in entries:
+            del self.added_in_window[count]
+        return sorted(entries, key=lambda entry: entry[0])
+
+    def pop_stale(self, windows):
+        """
+        Remove and return the entries that have waited through the given
+        number of windows since the one they were added in, in the order
+        they were added.
+        """
+        entries = []
+        for key in list(self.by_key):
+            waiting = []
+            for entry in self.by_key[key]:
+                if self.window - self.added_in_window[entry[0]] >= windows:
+                    entries.append(entry)
+                    del self.added_in_window[entry[0]]
+                else:
+                    waiting.append(entry)
+            if waiting:
+                self.by_key[key] = waiting
+            else:
+                del self.by_key[key]
+        return sorted(entries, key=lambda entry: entry[0])
+
+    def entries(self):
+        """
+        Get all of the entries, in the order they were added.
+        """
+        return sorted(
+            (entry for entries in self.by_key.values() for entry in entries),
+            key=lambda entry: entry[0])
+
+    def pop_all(self):
+        return self.pop(list(self.by_key))
+
+
+# The number of values to put in a single `IN` query, to stay clear of the
+# database's limit on query parameters (999 on older SQLite builds).
+IN_QUERY_BATCH_SIZE = 500
+
+
+def batches(values, size=IN_QUERY_BATCH_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class ClientIndex:
+    """
+    An in-memory index of clients by the keys that the loader matches them
+    on: SSN, SSN and last name, and first name, last name, and date of birth.
+    Clients are kept in the order they're added, so add existing clients in
+    primary key order before any new ones.
+
+    """
+    def __init__(self):
+        self.by_key = {}
+
+    def add(self, client):
+        keys = []
+        if client.ssn:
+            keys.append(('ssn', client.ssn))
+            keys.append(('ssn', client.ssn, client.last))
+        if client.first and client.last and client.dob:
+            keys.append(('name', client.first, client.last, client.dob))
+        for key in keys:
+            self.by_key.setdefault(key, []).append(client)
+
+    def get(self, key):
+        return self.by_key.get(key, [])
+
+
+class UnsavedRows:
+    """
+    The rows that a dry run of a load would have created, which are kept in
+    memory instead of being saved. Each one is given the primary key that it
+    would most likely have gotten. The clients are indexed like they would
+    be matched in the database, and the assessments that would have been
+    created or changed are kept by model and member.
+
+    """
+    def __init__(self):
+        self.next_pks = {}
+        self.clients = ClientIndex()
+        self.assessments = {}
+
+    def add(self, objs):
+        for obj in objs:
+            model = type(obj)
+            if model not in self.next_pks:
+                self.next_pks[model] = (model.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0) + 1
+            obj.pk = self.next_pks[model]
+            self.next_pks[model] += 1
+            if model is Client:
+                self.clients.add(obj)
+        return objs
+
+    def add_assessments(self, assessments):
+        for assessment in assessments:
+            self.assessments[(type(assessment), assessment.member_id)] = assessment
+
+    def get_assessments(self, model, member_pks):
+        return dict(
+            (pk, self.assessments[(model, pk)]) for pk in member_pks
+            if (model, pk) in self.assessments)
+
+
+class HouseholdIndex:
+    """
+    An in-memory index of the household members that dependents get attached
+    to: every member by their client's SSN (with their entry dates in
+    order), and heads of household by project, entry date, and last name.
+
+    Keys are loaded from the database the first time they're looked up, or
+    ahead of time with `warm`. After that, the loader keeps them up to date
+    by adding each member it creates. The loader clears the index between
+    windows of rows, so that it doesn't grow with the size of the file.
+
+    For a dry run, where the members that are added are never saved, the
+    index keeps them (with `keep_added`), to add back in as keys are loaded
+    and to look up by client.
+
+    """
+    keep_added = False
+
+    def __init__(self):
+        self.added_by_ssn = {}
+        self.added_hohs_by_name = {}
+        self.added_by_client = {}
+        self.clear()
+
+    def clear(self):
+        self.by_ssn = {}
+        self.hohs_by_name = {}
+
+    def warm(self, ssns=(), names=()):
+        """
+        Load the members for any of the SSNs, and the heads of household
+        for any of the (project name, entry date, last name) keys, that
+        haven't been loaded yet.
+        """
+        ssns = set(ssns) - set(self.by_ssn)
+        for ssn in ssns:
+            self.by_ssn[ssn] = ([], [])
+        for batch in batches(ssns):
+            members = HouseholdMember.objects\
+                .filter(client__ssn__in=batch)\
+                .select_related('client', 'household__project')\
+                .order_by('pk')
+            for member in members:
+                self.add_by_ssn(member.client.ssn, member)
+        for ssn in ssns:
+            for member in self.added_by_ssn.get(ssn, []):
+                self.add_by_ssn(ssn, member)
+
+        names = set(names) - set(self.hohs_by_name)
+        for name in names:
+            self.hohs_by_name[name] = []
+        for batch in batches(names):
+            members = HouseholdMember.objects\
+                .filter(hoh_relationship=1,
+                        household__project__name__in=set(project_name for project_name, _, _ in batch),
+                        entry_date__in=set(entry_date for _, entry_date, _ in batch),
+                        client__last__in=set(last_name for _, _, last_name in batch))\
+                .select_related('client', 'household__project')\
+                .order_by('pk')
+            for member in members:
+                key = (member.household.project.name, member.entry_date, member.client.last)
+                if key in names:
+                    self.hohs_by_name[key].append(member)
+        for name in names:
+            self.hohs_by_name[name].extend(self.added_hohs_by_name.get(name, []))
+
+    def add_by_ssn(self, ssn, member):
+        keys, members = self.by_ssn[ssn]
+        key = (member.entry_date, member.pk)
+        index = bisect_right(keys, key)
+        keys.insert(index, key)
+        members.insert(index, member)
+
+    def add(self, member):
+        """
+        Add a new member to any keys that have already been loaded.
+        """
+        client = member.client
+        if client.ssn in self.by_ssn:
+            self.add_by_ssn(client.ssn, member)
+
+        if member.hoh_relationship == 1:
+            key = (member.household.project.name, member.entry_date, client.last)
+            if key in self.hohs_by_name:
+                self.hohs_by_name[key].append(member)
+
+        if self.keep_added:
+            if client.ssn:
+                self.added_by_ssn.setdefault(client.ssn, []).append(member)
+            if member.hoh_relationship == 1:
+                self.added_hohs_by_name.setdefault(key, []).append(member)
+            self.added_by_client.setdefault(client.pk, []).append(member)
+
+    def find_added_membership(self, client, project_name, entry_date):
+        """
+        Get the kept member for the client in the project with the entry
+        date, or None.
+        """
+        for member in self.added_by_client.get(client.pk, []):
+            if member.household.project.name == project_name and member.entry_date == entry_date:
+                return member
+        return None
+
+    def find_by_ssn(self, ssn, entry_date):
+        """
+        Get the member with the SSN that has the latest entry date on or
+        before the given one, or None.
+        """
+        self.warm(ssns=[ssn])
+        keys, members = self.by_ssn[ssn]
+        index = bisect_right(keys, (entry_date, float('inf')))
+        if index == 0:
+            return None
+        latest_entry_date = keys[index - 1][0]
+        return members[bisect_left(keys, (latest_entry_date, 0))]
+
+    def has_ssn_on(self, ssn, entry_date):
+        member = self.find_by_ssn(ssn, entry_date)
+        return member is not None and member.entry_date == entry_date
+
+    def find_hohs_by_name(self, project_name, entry_date, last_name):
+        """
+        Get the heads of household in the project with the entry date and
+        last name.
+        """
+        key = (project_name, entry_date, last_name)
+        self.warm(names=[key])
+        return self.hohs_by_name[key]
+
+
+def bulk_update(model, objs, field_names):
+    """
+    Save the given fields of the objects, along with their `updated_at`
+    time, with one `UPDATE` query per batch of objects.
+    """
+    updated_at = now()
+    for batch in batches(objs):
+        values = {}
+        for name in field_names:
+            field = model._meta.get_field(name)
+            values[name] = Case(
+                *[When(pk=obj.pk, then=Value(getattr(obj, name), output_field=field)) for obj in batch],
+                default=F(name), output_field=field)
+        model.objects\
+            .filter(pk__in=[obj.pk for obj in batch])\
+            .update(updated_at=updated_at, **values)
+
+
+class AssessmentBuffer:
+    """
+    The entry and exit assessment values from a set of rows, and the members
+    that didn't show, to be written all at once with `flush`.
+
+    Members that already have an assessment are looked up in batches. Like
+    a client's values, an assessment's values are filled in wherever a row
+    is more specific than what's stored, and any that conflict are warned
+    about and left alone.
+
+    """
+    ASSESSMENT_MODELS = OrderedDict([
+        ('entry', ClientEntryAssessment),
+        ('exit', ClientExitAssessment),
+    ])
+
+    # A LoadDiffReport to note the assessments that are created or changed
+    # in, if there is one.
+    diff_report = None
+
+    # For a dry run, the UnsavedRows to keep the assessments in, instead of
+    # saving them.
+    unsaved = None
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.values = OrderedDict((kind, OrderedDict()) for kind in self.ASSESSMENT_MODELS)
+        self.no_shows = OrderedDict()
+
+    def add(self, kind, member, values):
+        _, rows = self.values[kind].setdefault(member.pk, (member, []))
+        rows.append(values)
+
+    def add_no_show(self, member):
+        member.present_at_enrollment = False
+        self.no_shows[member.pk] = member
+
+    def flush(self):
+        household_ids = \
+            [member.household_id for values in self.values.values() for member, _ in values.values()] + \
+            [member.household_id for member in self.no_shows.values()]
+
+        for kind, model in self.ASSESSMENT_MODELS.items():
+            self.save_assessments(kind, model, self.values[kind])
+
+        if self.diff_report is not None:
+            for member in self.no_shows.values():
+                self.diff_report.add_no_show(member)
+        if self.unsaved is not None:
+            self.clear()
+            return
+
+        for batch in batches(self.no_shows):
+            # Only the members that were present leave the export.
+            present = list(HouseholdMember.objects\
+                .filter(pk__in=batch, present_at_enrollment=True)\
+                .values_list('pk', flat=True))
+            HouseholdMember.objects\
+                .filter(pk__in=present)\
+                .update(present_at_enrollment=False, updated_at=now())
+            record_members_left_export(present)
+
+        # None of these writes send signals, so the households' statuses
+        # are updated here instead.
+        update_household_statuses(household_ids)
+        self.clear()
+
+    def save_assessments(self, kind, model, values_by_member):
+        existing = {}
+        for batch in batches(values_by_member):
+            existing.update((assessment.member_id, assessment) for assessment in model.objects.filter(member_id__in=batch))
+        if self.unsaved is not None:
+            existing.update(self.unsaved.get_assessments(model, values_by_member))
+
+        new_assessments = []
+        changed_assessments = []
+        changed_fields = set()
+        for member_pk, (member, rows) in values_by_member.items():
+            assessment = existing.get(member_pk)
+            if assessment is None:
+                assessment = model(member=member, **rows[0])
+                new_assessments.append(assessment)
+            else:
+                assessment.member = member
+
+            changes, conflicts = self.merge_values(kind, assessment, rows)
+            if changes and assessment.pk is not None:
+                changed_assessments.append(assessment)
+                changed_fields.update(changes)
+            if self.diff_report is not None:
+                self.diff_report.add_assessment(kind, assessment, changes, conflicts)
+
+        if self.unsaved is None:
+            model.objects.bulk_create(new_assessments)
+            bulk_update(model, changed_assessments, sorted(changed_fields))
+        else:
+            self.unsaved.add(new_assessments)
+            self.unsaved.add_assessments(new_assessments + changed_assessments)
+        logger.debug('Created {} and updated {} {} assessments'.format(
+            len(new_assessments), len(changed_assessments), kind))
+
+    def merge_values(self, kind, assessment, rows):
+        """
+        Merge each row's values into the assessment, in order, and return
+        the values that changed and the ones that conflicted, as (old, new)
+        pairs by field name.
+        """
+        changes = OrderedDict()
+        conflicts = OrderedDict()
+        for values in rows:
+            for k, v in values.items():
+                old_value = getattr(assessment, k)
+                if old_value == v:
+                    continue
+
+                # If the value has gotten more specific, use the new value.
+                if old_value in (None, '', 99):
+                    setattr(assessment, k, v)
+                    changes[k] = (old_value, v)
+
+                # If the value has gotten less specific, ignore it.
+                elif v in (None, '', 99):
+                    pass
+
+                # Otherwise, warn.
+                else:
+                    logger.warn('Warning: {} changed for {} assessment on client {} while loading from CSV: {!r} --> {!r}'.format(k, kind, assessment.member, old_value, v))
+                    conflicts[k] = (old_value, v)
+        return changes, conflicts
+
+
 class ClientLoaderHelper:
     """
     A helper class for a `ClientManager` to load data from a
     CSV file -- a fairly *ad hoc* process.
 
     """
-    def load_from_csv_stream(self, manager, stream, interactive=True, strong_matching=False):
-        reader = csv.DictReader(stream)
-        rows = list(reader)
+    # A LoadErrorReport for the cells and rows that can't be loaded. If
+    # there isn't one, the first bad cell raises an error instead (or, if
+    # interactive, asks for a corrected value).
+    error_report = None
+
+    # A LoadDiffReport to note what the load changes in, if there is one.
+    diff_report = None
+
+    # For a dry run, the UnsavedRows to keep what the load creates in,
+    # instead of saving it.
+    unsaved = None
+
+    def __init__(self):
+        self.households = HouseholdIndex()
+        self.assessments = AssessmentBuffer()
+        self.projects_by_name = None
+
+    def load_from_csv_stream(self, manager, stream, interactive=True, strong_matching=False, window_size=None, jobs=1, error_report=None, checkpoint=None, diff_report=None, dry_run=False):
+        """
+        Load the clients in a CSV stream. By default the whole file is read
+        in at once, and the loaded clients are returned.
+
+        With a `window_size`, the stream is instead loaded that many rows at
+        a time, so that memory use doesn't grow with the size of the file,
+        and the number of rows loaded is returned. Dependents whose head of
+        household hasn't been loaded yet are set aside until they are, for
+        up to PENDING_DEPENDENT_WINDOWS more windows, and are then loaded
+        the way they would be at the end of the file.
+
+        A streamed load only differs from a whole-file load where the file
+        is ambiguous: a dependent is matched against the heads of household
+        that have been loaded so far, so if an HOH with the same last name
+        (or the dependent themselves, as an HOH) comes later in the file,
+        the earlier match wins. The same goes for an HOH that is listed
+        more than a window after their dependents.
+
+        Before they're loaded, the rows' cells are all parsed up front by
+        `normalize_row`, in a pool of `jobs` processes if there's more than
+        one. Rows with bad cells are left out of the load and added to the
+        `error_report`, if there is one.
+
+        A whole-file load is committed all at once. A streamed load commits
+        each window separately, and if there's a `LoadCheckpoint`, records
+        how far it got along with each one. A checkpoint that has already
+        gotten partway through the stream is picked up from there.
+
+        What the load changes is noted in the `diff_report`, if there is
+        one. A `dry_run` goes through the whole load the same way, so that
+        the diff report says what the load would have done, but without
+        writing anything: what it would have created or changed is kept in
+        memory instead, and the database is read in a `dry_run_transaction`.
+        """
+        if dry_run:
+            self.unsaved = self.assessments.unsaved = UnsavedRows()
+            self.households.keep_added = True
+            try:
+                with dry_run_transaction():
+                    return self.load_from_csv_stream(
+                        manager, stream, interactive=interactive, strong_matching=strong_matching, window_size=window_size,
+                        jobs=jobs, error_report=error_report, diff_report=diff_report)
+            finally:
+                self.unsaved = self.assessments.unsaved = None
+
+        self.error_report = error_report
+        self.diff_report = self.assessments.diff_report = diff_report
+        if diff_report is not None:
+            diff_report.start()
+        rows = iter_numbered_rows(csv.DictReader(stream))
+
+        with normalization_pool(jobs) as pool:
+            if not window_size:
+                with transaction.atomic(), deferred_household_status_updates():
+                    rows = self.normalize_rows(list(rows), pool=pool)
+                    self.load_rows(manager, rows, interactive=interactive, strong_matching=strong_matching)
+                    self.note_clients(rows)
+                return (row['_client'] for row in rows)
+
+            pending = PendingDependents()
+            if checkpoint is not None and checkpoint.last_line:
+                rows = self.skip_to_checkpoint(manager, rows, checkpoint, pending, interactive=interactive, pool=pool)
+
+            row_count = 0
+            for window in iter_row_windows(rows, window_size):
+                with transaction.atomic(), deferred_household_status_updates():
+                    loadable_rows = self.normalize_rows(window, pool=pool)
+                    self.load_rows(manager, loadable_rows, interactive=interactive, strong_matching=strong_matching, pending=pending)
+                    # Keep the pending dependents (and the checkpoint state)
+                    # from growing with the size of the file.
+                    self.load_pending_dependents(manager, pending.pop_stale(PENDING_DEPENDENT_WINDOWS), interactive=interactive, pending=pending)
+                    self.assessments.flush()
+                    self.note_clients(loadable_rows)
+                    if checkpoint is not None:
+                        checkpoint.record(window[-1]['_line'], self.dump_checkpoint_state(pending))
+                pending.next_window()
+                row_count += len(loadable_rows)
+                logger.debug('Loaded {} rows; {} dependents pending'.format(row_count, len(pending)))
+
+        # Whatever is still pending gets loaded the same way it would have
+        # been if the whole file had been read at once.
+        with transaction.atomic(), deferred_household_status_updates():
+            self.load_pending_dependents(manager, pending.pop_all(), interactive=interactive)
+            self.assessments.flush()
+            if checkpoint is not None:
+                checkpoint.finish()
+        return row_count
+
+    def create(self, model, **values):
+        """
+        Create a row, or for a dry run, just make the object.
+        """
+        if self.unsaved is None:
+            return model.objects.create(**values)
+        return self.unsaved.add([model(**values)])[0]
+
+    def create_missing_projects(self, rows):
+        """
+        Create the projects that the heads of household in the rows are
+        listed in that don't exist yet, all at once, and cache all of the
+        projects by name.
+        """
+        self.create_projects(row['Program Name'] for row in rows if is_head_of_household(row))
+
+    def create_projects(self, names):
+        """
+        Create the projects with the given names that don't exist yet, all
+        at once, and cache all of the projects by name.
+        """
+        if self.projects_by_name is None:
+            self.projects_by_name = {}
+            for project in Project.objects.order_by('pk'):
+                self.projects_by_name.setdefault(project.name, []).append(project)
+
+        missing_names = OrderedDict((name, None) for name in names if name not in self.projects_by_name)
+        if missing_names and self.unsaved is not None:
+            for project in self.unsaved.add([Project(name=name) for name in missing_names]):
+                self.projects_by_name[project.name] = [project]
+        elif missing_names:
+            Project.objects.bulk_create([Project(name=name) for name in missing_names])
+            for project in Project.objects.filter(name__in=list(missing_names)).order_by('pk'):
+                self.projects_by_name.setdefault(project.name, []).append(project)
+            logger.debug('Created {} projects'.format(len(missing_names)))
+
+    def get_project(self, project_name):
+        """
+        Get the project with the given name, from the cache if it's been
+        loaded, creating it if need be.
+        """
+        if self.projects_by_name is None or project_name not in self.projects_by_name:
+            if self.unsaved is not None:
+                self.create_projects([project_name])
+            else:
+                project, _ = Project.objects.get_or_create(name=project_name)
+                return project
+
+        projects = self.projects_by_name[project_name]
+        if len(projects) > 1:
+            raise Project.MultipleObjectsReturned('{} projects are named {!r}'.format(len(projects), project_name))
+        return projects[0]
+
+    def dump_checkpoint_state(self, pending):
+        """
+        Get the state of a streamed load between windows, for a checkpoint:
+        the line and client of each pending dependent, and the last heads of
+        household seen (as of each dependent, and now).
+        """
+        def member_pks(hoh_state):
+            last_seen_hoh, last_blank_hoh, _ = hoh_state
+            return [getattr(last_seen_hoh, 'pk', None), getattr(last_blank_hoh, 'pk', None)]
+
+        return {
+            'hoh_state': member_pks(self.get_hoh_state()),
+            'pending': [
+                {'line': row['_line'], 'client': row['_client'].pk, 'hoh_state': member_pks(hoh_state)}
+                for _, row, hoh_state in pending.entries()
+            ],
+        }
+
+    def load_checkpoint_hoh_state(self, member_pks):
+        last_seen_hoh, last_blank_hoh = [
+            HouseholdMember.objects.select_related('client', 'household__project').get(pk=pk) if pk is not None else None
+            for pk in member_pks]
+        return (last_seen_hoh, last_blank_hoh, last_blank_hoh.entry_date if last_blank_hoh else None)
+
+    def skip_to_checkpoint(self, manager, rows, checkpoint, pending, interactive=True, pool=None):
+        """
+        Skip the rows that were committed as of the checkpoint, setting the
+        dependents that were pending then aside again, and return the rest.
+        """
+        state = checkpoint.get_state()
+        pending_entries = dict((entry['line'], entry) for entry in state['pending'])
+        logger.debug('Resuming {} after line {}'.format(checkpoint.filename, checkpoint.last_line))
+
+        pending_rows = []
+        for row in rows:
+            if row['_line'] in pending_entries:
+                pending_rows.append(row)
+            if row['_line'] >= checkpoint.last_line:
+                break
+
+        with transaction.atomic():
+            for row in self.normalize_rows(pending_rows, pool=pool):
+                entry = pending_entries[row['_line']]
+                row['_client'] = manager.get(pk=entry['client'])
+                hoh_state = self.load_checkpoint_hoh_state(entry['hoh_state'])
+
+                self.set_hoh_state(hoh_state)
+                key = self.get_missing_hoh_key(row, interactive=interactive)
+                if key is None:
+                    self.load_dependent_row(manager, row, interactive=interactive)
+                else:
+                    pending.add(key, row, hoh_state)
+
+        self.set_hoh_state(self.load_checkpoint_hoh_state(state['hoh_state']))
+        return rows
+
+    def normalize_rows(self, rows, pool=None):
+        """
+        Parse the cells of each row (in the pool, if there is one), and keep
+        the typed values on the row for loading. Return the rows that can be
+        loaded: those with bad cells are added to the error report instead,
+        if there is one, and otherwise left for the errors to come up as
+        the row is loaded.
+        """
+        if pool is None:
+            results = map(normalize_row, rows)
+        else:
+            results = pool.map(normalize_row, rows)
+
+        loadable_rows = []
+        for row, (values, errors) in zip(rows, results):
+            row['_values'] = values
+            if errors and self.error_report is not None:
+                for column, message in errors:
+                    self.error_report.add(row, column, message)
+            else:
+                loadable_rows.append(row)
+        return loadable_rows
+
+    def load_rows(self, manager, rows, interactive=True, strong_matching=False, pending=None):
+        self.create_missing_projects(rows)
 
         # First create all the clients. We do the clients and households in
         # separate steps just in case any dependents are listed before the
@@ -183,8 +1182,19 @@ class ClientLoaderHelper:
             client, created = self.get_or_create_client_from_row(manager, row, interactive=interactive, strong_matching=strong_matching)
             logger.debug('{} client'.format('Created' if created else 'Updated'))
 
-        # Next, for all those rows where a household member was not created,
-        # create one.
+        self.load_dependents_from_rows(manager, rows, interactive=interactive, pending=pending)
+        self.assessments.flush()
+
+    def load_dependents_from_rows(self, manager, rows, interactive=True, pending=None):
+        """
+        For all those rows where a household member was not created (i.e.,
+        the dependents), create one. If a `PendingDependents` buffer is
+        given, dependents whose head of household hasn't been loaded yet are
+        added to it instead, and any that were waiting on the households in
+        these rows are loaded.
+        """
+        self.warm_household_index(rows, interactive=interactive)
+
         for row in rows:
 
             # If the member has been created and the SSN is blank, remember the
@@ -200,44 +1210,194 @@ class ClientLoaderHelper:
                     self.last_blank_hoh = None
                     self.last_blank_entry_date = None
 
-            elif '_member' not in row:
-                self.get_or_create_household_member_from_row(manager, row, interactive=interactive)
-                self.get_or_create_assessments_from_row(manager, row, interactive=interactive)
+                if pending is not None:
+                    self.load_pending_dependents(manager, pending.pop(self.get_member_keys(row)), interactive=interactive, pending=pending)
 
-        return (row['_client'] for row in rows)
+            elif '_member' not in row:
+                if pending is not None:
+                    key = self.get_missing_hoh_key(row, interactive=interactive)
+                    if key is not None:
+                        pending.add(key, row, self.get_hoh_state())
+                        continue
+
+                loaded = self.load_dependent_row(manager, row, interactive=interactive)
+
+                if loaded and pending is not None:
+                    self.load_pending_dependents(manager, pending.pop(self.get_member_keys(row)), interactive=interactive, pending=pending)
+
+    def load_pending_dependents(self, manager, entries, interactive=True, pending=None):
+        """
+        Load dependents that were set aside, as of the last blank HOH that
+        had been seen when each one was.
+        """
+        current_state = self.get_hoh_state()
+        for _, row, hoh_state in entries:
+            self.set_hoh_state(hoh_state)
+            loaded = self.load_dependent_row(manager, row, interactive=interactive)
+
+            if loaded and pending is not None:
+                self.load_pending_dependents(manager, pending.pop(self.get_member_keys(row)), interactive=interactive, pending=pending)
+        self.set_hoh_state(current_state)
+
+    def warm_household_index(self, rows, interactive=True):
+        """
+        Load the heads of household that the dependents in the rows could
+        be attached to into a fresh household index, all at once.
+        """
+        ssns = set()
+        names = set()
+        for row in rows:
+            if '_member' in row:
+                continue
+            hoh_ssn = parse_cell(row, 'Head of Household\'s SSN', interactive=interactive)
+            if hoh_ssn:
+                ssns.add(hoh_ssn)
+            else:
+                entry_date = parse_cell(row, 'Program Start Date', interactive=interactive)
+                names.add((row['Program Name'], entry_date, row['Last Name']))
+
+        self.households.clear()
+        self.households.warm(ssns=ssns, names=names)
+
+    def load_dependent_row(self, manager, row, interactive=True):
+        """
+        Create the household membership and assessments for a dependent.
+        Return whether they were created; they won't be if the dependent's
+        head of household can't be found, and there's an error report to
+        note that in.
+        """
+        try:
+            self.get_or_create_household_member_from_row(manager, row, interactive=interactive)
+        except (HouseholdMember.DoesNotExist, AssertionError) as e:
+            if self.error_report is None:
+                raise
+            self.error_report.add(row, 'Head of Household\'s SSN', str(e))
+            return False
+
+        self.add_assessments_from_row(manager, row, interactive=interactive)
+        return True
+
+    def get_hoh_state(self):
+        return (getattr(self, 'last_seen_hoh', None),
+                getattr(self, 'last_blank_hoh', None),
+                getattr(self, 'last_blank_entry_date', None))
+
+    def set_hoh_state(self, hoh_state):
+        self.last_seen_hoh, self.last_blank_hoh, self.last_blank_entry_date = hoh_state
+
+    def get_member_keys(self, row):
+        """
+        Get the keys that dependents waiting on the household member in a
+        row would be pending under.
+        """
+        client = row['_client']
+        member = row['_member']
+        keys = []
+        if client.ssn:
+            keys.append(('ssn', client.ssn, member.entry_date))
+        if member.hoh_relationship == 1:
+            keys.append(('name', row['Program Name'], member.entry_date, client.last))
+        return keys
+
+    def get_missing_hoh_key(self, row, interactive=True):
+        """
+        Get the key for the head of household that a dependent row is
+        waiting on, or None if the dependent can be loaded now.
+
+        A dependent with an HOH SSN waits for an HOH with the same entry
+        date, as that's the one it'd be matched with once the whole file is
+        loaded. One without waits for an HOH with the same last name, unless
+        it can fall back to the last blank HOH seen.
+        """
+        client = row['_client']
+        project_name = row['Program Name']
+        entry_date = parse_cell(row, 'Program Start Date', interactive=interactive)
+
+        if client.memberships.filter(household__project__name=project_name, entry_date=entry_date).exists() or \
+           self.households.find_added_membership(client, project_name, entry_date) is not None:
+            return None
+
+        hoh_ssn = parse_cell(row, 'Head of Household\'s SSN', interactive=interactive)
+        if hoh_ssn:
+            if self.households.has_ssn_on(hoh_ssn, entry_date):
+                return None
+            return ('ssn', hoh_ssn, entry_date)
+
+        last_name = row['Last Name']
+        if self.households.find_hohs_by_name(project_name, entry_date, last_name):
+            return None
+        if getattr(self, 'last_blank_hoh', None) is not None and entry_date == self.last_blank_entry_date:
+            return None
+        return ('name', project_name, entry_date, last_name)
+
+    def load_from_csv_file(self, manager, filename, interactive=True, strong_matching=False, window_size=None, jobs=1, error_report=None, resume=False, diff_report=None, dry_run=False):
+        """
+        Load the clients in a CSV file. A streamed load is checkpointed, and
+        with `resume`, picks up from the last checkpoint for a file with the
+        same contents. A dry run isn't checkpointed.
+        """
+        checkpoint = None
+        if window_size and not dry_run:
+            checkpoint = LoadCheckpoint.objects.start(filename, hash_file(filename), resume=resume)
+            if checkpoint.finished_at:
+                logger.warn('{} was already loaded at {}'.format(filename, checkpoint.finished_at))
+                return 0
 
-    def load_from_csv_file(self, manager, filename, interactive=True, strong_matching=False):
         logger.debug('Opening the CSV file {}'.format(filename))
 
         with open(filename, 'rU') as csvfile:
-            return self.load_from_csv_stream(manager, csvfile, interactive=interactive, strong_matching=strong_matching)
+            return self.load_from_csv_stream(manager, csvfile, interactive=interactive, strong_matching=strong_matching, window_size=window_size, jobs=jobs, error_report=error_report, checkpoint=checkpoint, diff_report=diff_report, dry_run=dry_run)
 
-    def get_or_create_client_from_row(self, manager, row, interactive=True, strong_matching=False):
-        ssn = parse_ssn(row['SSN'], interactive=interactive)
+    def parse_client_values(self, row, interactive=True):
+        """
+        Get the SSN, name and date of birth, client field values, and race
+        codes for the client in a row.
+        """
+        ssn = parse_cell(row, 'SSN', interactive=interactive)
 
         name_and_dob = dict(
             first=row['First Name'],
             last=row['Last Name'],
-            dob=parse_date(row['DOB'], interactive=interactive)
+            dob=parse_cell(row, 'DOB', interactive=interactive)
         )
 
         client_values = dict(
             name_and_dob,
             ssn=ssn,
             middle=row['Middle Name'],
-            ethnicity=hud_code(row['Ethnicity (HUD)'], consts.HUD_CLIENT_ETHNICITY, interactive=interactive),
-            gender=hud_code(row['Gender (HUD)'], consts.HUD_CLIENT_GENDER, interactive=interactive),
-            veteran_status=hud_code(row['Veteran Status (HUD)'], consts.HUD_YES_NO, interactive=interactive),
+            ethnicity=parse_cell(row, 'Ethnicity (HUD)', interactive=interactive),
+            gender=parse_cell(row, 'Gender (HUD)', interactive=interactive),
+            veteran_status=parse_cell(row, 'Veteran Status (HUD)', interactive=interactive),
         )
 
         # Race, as a many-to-many field, gets applied separately.
-        race = [
-            hud_code(race, consts.HUD_CLIENT_RACE, interactive=interactive)
-            for race in row['Race (HUD)'].split(';')
-        ]
+        race = parse_cell(row, 'Race (HUD)', interactive=interactive)
+
+        return ssn, name_and_dob, client_values, race
+
+    def get_client_match(self, ssn, name_and_dob, strong_matching=False):
+        """
+        Get the index key and the equivalent query parameters that a client
+        would be matched on, or (None, None) if the client shouldn't be
+        matched at all.
+        """
+        if ssn:
+            if strong_matching:
+                return ('ssn', ssn, name_and_dob['last']), dict(ssn=ssn, last=name_and_dob['last'])
+            else:
+                return ('ssn', ssn), dict(ssn=ssn)
+        elif all(name_and_dob.values()):
+            return ('name', name_and_dob['first'], name_and_dob['last'], name_and_dob['dob']), name_and_dob
+        else:
+            return None, None
 
-        def relaxed_get_or_create(defaults={}, **params):
+    def get_or_create_client_from_row(self, manager, row, interactive=True, strong_matching=False):
+        ssn, name_and_dob, client_values, race = self.parse_client_values(row, interactive=interactive)
+
+        def relaxed_get_or_create(key, defaults={}, **params):
             clients = manager.filter(**params)
+            if not clients and self.unsaved is not None:
+                clients = self.unsaved.clients.get(key)
             if len(clients) > 1:
                 logger.warn('more than one client found for {}'.format(params))
 
@@ -245,30 +1405,48 @@ class ClientLoaderHelper:
                 client = clients[0]
                 created = False
             except IndexError:
-                client = manager.create(**defaults)
+                client = self.create(manager.model, **defaults)
                 created = True
 
             return client, created
 
-        # First, try to match on SSN (or SSN, name, and DOB if strong matching)
-        if ssn:
-            if strong_matching:
-                client, created = relaxed_get_or_create(ssn=ssn, last=name_and_dob['last'], defaults=client_values)
-            else:
-                client, created = relaxed_get_or_create(ssn=ssn, defaults=client_values)
-
-        # Failing that, try first, last, and date of birth
-        elif all(name_and_dob.values()):
-            client, created = relaxed_get_or_create(defaults=client_values, **name_and_dob)
-
-        # Otherwise, just create a new client.
+        # Match on SSN (or SSN and last name, if strong matching), failing
+        # that, on first, last, and date of birth, and otherwise, just create
+        # a new client.
+        key, params = self.get_client_match(ssn, name_and_dob, strong_matching=strong_matching)
+        if key is not None:
+            client, created = relaxed_get_or_create(key, defaults=client_values, **params)
         else:
-            client = manager.create(**client_values)
+            client = self.create(manager.model, **client_values)
             created = True
 
-        client.race = ClientRace.objects.filter(hud_value__in=race)
+        if self.unsaved is None:
+            # Reassigning the races clears and re-adds them, which marks the
+            # client as changed for the export, so only do it if they differ.
+            races = set(ClientRace.objects.filter(hud_value__in=race).values_list('pk', flat=True))
+            if races != (set() if created else set(client.race.values_list('pk', flat=True))):
+                client.race = races
         row['_client'] = client
 
+        self.update_client_values(client, client_values, ssn)
+
+        # The following only apply to clients that are listed as a head of
+        # household.
+        if is_head_of_household(row):
+            self.check_head_of_household_ssn(row, ssn, client_values, interactive=interactive)
+
+            # Check whether a household exists for this HoH's project and entry
+            # date. If not, create one.
+            self.get_or_create_household_member_from_row(manager, row, interactive=interactive)
+            self.add_assessments_from_row(manager, row, interactive=interactive)
+
+        return client, created
+
+    def update_client_values(self, client, client_values, ssn):
+        """
+        Fill in any of the client's values that the row is more specific
+        about, and warn about any that conflict.
+        """
         client_changed = False
         for k, v in client_values.items():
             if getattr(client, k) != v:
@@ -284,133 +1462,158 @@ class ClientLoaderHelper:
                 # Otherwise, warn.
                 else:
                     logger.warn('Warning: {} changed for client {} while loading from CSV: {!r} --> {!r}'.format(k, ssn, getattr(client, k), v))
-
-        # The following only apply to clients that are listed as a head of
-        # household.
-        hoh_rel = row['Relationship to HoH']
-        if hoh_rel.lower() == 'self (head of household)':
-            # Make sure that the HoH SSN matches the client's.
-            hoh_ssn = parse_ssn(row['Head of Household\'s SSN'], interactive=interactive)
-            if hoh_ssn and ssn != hoh_ssn:
-                message = (
-                    'Client is listed as the head of household, but does not '
-                    'match the head of household\'s SSN: {!r} vs {!r}: {}.'
-                    ).format(row['SSN'], row['Head of Household\'s SSN'], pretty.pformat(row))
-
-                if interactive:
-                    print(message + '\n\nWhich would you like to keep?\n>>>', end='', file=sys.stderr)
-                    hoh_ssn = ssn = client_values['ssn'] = parse_ssn(input(), interactive=interactive)
-                else:
-                    raise AssertionError(message)
-
-            # Check whether a household exists for this HoH's project and entry
-            # date. If not, create one.
-            self.get_or_create_household_member_from_row(manager, row, interactive=interactive)
-            self.get_or_create_assessments_from_row(manager, row, interactive=interactive)
-
-        return client, created
+        return client_changed
+
+    def check_head_of_household_ssn(self, row, ssn, client_values, interactive=True):
+        """
+        Make sure that the HoH SSN matches the client's.
+        """
+        hoh_ssn = parse_cell(row, 'Head of Household\'s SSN', interactive=interactive)
+        if hoh_ssn and ssn != hoh_ssn:
+            message = (
+                'Client is listed as the head of household, but does not '
+                'match the head of household\'s SSN: {!r} vs {!r}: {}.'
+                ).format(row['SSN'], row['Head of Household\'s SSN'], pretty.pformat(row))
+
+            if interactive:
+                print(message + '\n\nWhich would you like to keep?\n>>>', end='', file=sys.stderr)
+                hoh_ssn = ssn = client_values['ssn'] = parse_ssn(input(), interactive=interactive)
+            else:
+                raise AssertionError(message)
 
     def get_or_create_household_member_from_row(self, manager, row, interactive=True):
         client = row['_client']
         project_name = row['Program Name']
-        entry_date = parse_date(row['Program Start Date'], interactive=interactive)
-        exit_date = parse_date(row['Program End Date'], interactive=interactive)
+        entry_date = parse_cell(row, 'Program Start Date', interactive=interactive)
+        exit_date = parse_cell(row, 'Program End Date', interactive=interactive)
 
-        try:
-            # If we can find a household membership that already exists for
-            # this client in this project on this date, then use it
-            # immediately.
-            member = client.memberships.get(
-                household__project__name=project_name,
-                entry_date=entry_date)
+        # If we can find a household membership that already exists for
+        # this client in this project on this date, then use it immediately.
+        member = self.find_membership(client, project_name, entry_date)
+        if member is not None:
             row['_member'] = member
+            self.note_member(row, member, created=False)
             return member, False
-        except HouseholdMember.DoesNotExist:
-            pass
 
         if row['Relationship to HoH'].lower() == 'self (head of household)':
             # For heads of households, if we haven't found an existing
             # membership, then we can assume that we need to create a new
             # household.
-            project, _ = Project.objects.get_or_create(name=project_name)
-            household = Household.objects.create(project=project)
-            ssn = parse_ssn(row['SSN'], interactive=interactive)
+            household = self.create(Household, project=self.get_project(project_name))
+            ssn = parse_cell(row, 'SSN', interactive=interactive)
 
         else:
             # For dependants, we should use the household that exists for the
             # corresponding head of household.
-            hoh_ssn = parse_ssn(row['Head of Household\'s SSN'], interactive=interactive)
+            hoh_ssn = parse_cell(row, 'Head of Household\'s SSN', interactive=interactive)
             last_name = row['Last Name']
-            entry_date = parse_date(row['Program Start Date'], interactive=interactive)
+            entry_date = parse_cell(row, 'Program Start Date', interactive=interactive)
 
             hoh_is_blank = (hoh_ssn == '')
             if hoh_is_blank:
                 # Try matching on the dependent's last name and entry date
-                try:
-                    hoh = HouseholdMember.objects.get(client__last=last_name, entry_date=entry_date, household__project__name=project_name, hoh_relationship=1)
+                hohs = self.households.find_hohs_by_name(project_name, entry_date, last_name)
 
                 # Failing that, get the most recent HOH that did not have an
                 # SSN set.
-                except HouseholdMember.DoesNotExist:
+                if not hohs:
                     assert hasattr(self, 'last_blank_hoh') and self.last_blank_hoh is not None, 'Last seen HOH ({}) did not have a blank SSN ({}); the current row does: {}.'.format(self.last_seen_hoh, self.last_seen_hoh.client.ssn, pretty.pformat(row))
                     assert entry_date == self.last_blank_entry_date, 'Entry dates for {} does not match recalled HOH -- {}'.format(pretty.pformat(row), self.last_blank_hoh)
                     hoh = self.last_blank_hoh
 
-                except HouseholdMember.MultipleObjectsReturned:
-                    hohs = HouseholdMember.objects.filter(client__last=last_name, entry_date=entry_date, household__project__name=project_name, hoh_relationship=1).order_by('-client__dob')
+                elif len(hohs) == 1:
                     hoh = hohs[0]
+
+                else:
+                    # Sort like the database would: latest date of birth
+                    # first, with the unknowns last.
+                    hoh = sorted(hohs, key=lambda m: (m.client.dob is not None, m.client.dob or date.min), reverse=True)[0]
                     logger.warn('Take note: Multiple HOHs were found with the same last name and entry date. Assuming the eldest is HOH: {}'.format(hoh))
 
             else:
-                try:
-                    hoh = HouseholdMember.objects.filter(client__ssn=hoh_ssn, entry_date__lte=entry_date).order_by('-entry_date')[0]
-                except IndexError:
+                hoh = self.households.find_by_ssn(hoh_ssn, entry_date)
+                if hoh is None:
                     raise HouseholdMember.DoesNotExist('Could not find HOH with SSN {} and entry_date before {}'.format(row['Head of Household\'s SSN'], entry_date))
 
             household = hoh.household
             is_hoh = False
 
-        member = HouseholdMember.objects.create(
+        member = self.create(
+            HouseholdMember,
             client=client,
             household=household,
-            hoh_relationship=hud_code(row['Relationship to HoH'], consts.HUD_CLIENT_HOH_RELATIONSHIP, interactive=interactive),
+            hoh_relationship=parse_cell(row, 'Relationship to HoH', interactive=interactive),
             entry_date=entry_date,
             exit_date=exit_date,
         )
+        self.households.add(member)
 
         row['_member'] = member
+        self.note_member(row, member, created=True)
         return member, True
 
+    def find_membership(self, client, project_name, entry_date):
+        """
+        Get the client's household membership in the project with the entry
+        date, or None.
+        """
+        try:
+            return client.memberships\
+                .select_related('household__project')\
+                .get(household__project__name=project_name, entry_date=entry_date)
+        except HouseholdMember.DoesNotExist:
+            return self.households.find_added_membership(client, project_name, entry_date)
+
+    def note_member(self, row, member, created):
+        if self.diff_report is not None:
+            self.diff_report.add_member(row, member, created)
+
+    def note_clients(self, rows):
+        if self.diff_report is not None:
+            for row in rows:
+                self.diff_report.add_client(row, row['_client'])
+
     def get_or_create_assessments_from_row(self, manager, row, interactive=True):
+        """
+        Save the assessments for a single row right away, and return the
+        entry and exit assessments (or None, for either that the row
+        doesn't have).
+        """
+        kinds = self.add_assessments_from_row(manager, row, interactive=interactive)
+        self.assessments.flush()
+        return tuple(
+            model.objects.get(member=row['_member']) if kind in kinds else None
+            for kind, model in AssessmentBuffer.ASSESSMENT_MODELS.items())
+
+    def add_assessments_from_row(self, manager, row, interactive=True):
+        """
+        Add the row's entry and exit assessments to the ones waiting to be
+        saved, and return the kinds of assessment that were added.
+        """
         member = row['_member']
-        entry_date = parse_date(row['Program Start Date'], interactive=interactive)
-        exit_date = parse_date(row['Program End Date'], interactive=interactive)
-
-        if 'never' in row['Exit Destination'].lower() or \
-           'no show' in row['Exit Destination'].lower():
-            # Treat clients with a destination including "never" as never
-            # having shown up (there's no valid HUD destination code with
-            # "never" in it).
-            member.present_at_enrollment = False
-            member.save()
-            return None, None
+        entry_date = parse_cell(row, 'Program Start Date', interactive=interactive)
+        exit_date = parse_cell(row, 'Program End Date', interactive=interactive)
+
+        if is_no_show(row):
+            self.assessments.add_no_show(member)
+            return []
 
         shared_values = dict(
-            physical_disability=hud_code(row['Physical Disability'], consts.HUD_YES_NO, interactive=interactive),
-            developmental_disability=hud_code(row['Developmental Disability'], consts.HUD_YES_NO, interactive=interactive),
-            chronic_health=hud_code(row['Chronic Health Condition'], consts.HUD_YES_NO, interactive=interactive),
-            hiv_aids=hud_code(row['HIV/AIDS'], consts.HUD_YES_NO, interactive=interactive),
-            mental_health=hud_code(row['Mental Health Problem'], consts.HUD_YES_NO, interactive=interactive),
-            substance_abuse=hud_code(row['Substance Abuse'], consts.HUD_CLIENT_SUBSTANCE_ABUSE, interactive=interactive),
-            domestic_violence=hud_code(row['Domestic Violence'], consts.HUD_YES_NO, interactive=interactive),
+            physical_disability=parse_cell(row, 'Physical Disability', interactive=interactive),
+            developmental_disability=parse_cell(row, 'Developmental Disability', interactive=interactive),
+            chronic_health=parse_cell(row, 'Chronic Health Condition', interactive=interactive),
+            hiv_aids=parse_cell(row, 'HIV/AIDS', interactive=interactive),
+            mental_health=parse_cell(row, 'Mental Health Problem', interactive=interactive),
+            substance_abuse=parse_cell(row, 'Substance Abuse', interactive=interactive),
+            domestic_violence=parse_cell(row, 'Domestic Violence', interactive=interactive),
         )
 
         # Prepare to convert the following fields from HUD 2.1 entry assessment
         # values to HUD 3.0 entry assessment values.
         #
         # See simplehmis migration 0010 for more information on this conversion.
-        homeless_at_least_one_year = hud_code(row['Has Been Continuously Homeless (on the streets, in EH or in a Safe Haven) for at Least One Year'], consts.HUD_YES_NO, interactive=interactive)
-        prior_residence = hud_code(row['Residence Prior to Program Entry - Type of Residence'], consts.HUD_CLIENT_PRIOR_RESIDENCE, interactive=interactive)
+        homeless_at_least_one_year = parse_cell(row, 'Has Been Continuously Homeless (on the streets, in EH or in a Safe Haven) for at Least One Year', interactive=interactive)
+        prior_residence = parse_cell(row, 'Residence Prior to Program Entry - Type of Residence', interactive=interactive)
         if prior_residence in (1, 16, 18) or \
            homeless_at_least_one_year == 1:
             entering_from_streets = 1  # Yes
@@ -426,7 +1629,7 @@ class ClientLoaderHelper:
         if prior_residence in (1, 16, 18):
             from dateutil.relativedelta import relativedelta
             length_of_homeless_map = {10: 1, 11: 1, 2: 1, 3: 1, 4: 3, 5: 12}
-            length_at_prior_residence = hud_code(row['Residence Prior to Program Entry - Length of Stay in Previous Place'], consts.HUD_CLIENT_LENGTH_AT_PRIOR_RESIDENCE, interactive=interactive)
+            length_at_prior_residence = parse_cell(row, 'Residence Prior to Program Entry - Length of Stay in Previous Place', interactive=interactive)
             homeless_months_prior = length_of_homeless_map.get(length_at_prior_residence, 0)
             month_count = homeless_months_prior or 0
             homeless_start_date = entry_date - relativedelta(months=month_count)
@@ -438,38 +1641,25 @@ class ClientLoaderHelper:
             project_entry_date=entry_date,
             entering_from_streets=entering_from_streets,
             homeless_start_date=homeless_start_date,
-            homeless_in_three_years=hud_code(row['Number of Times the Client has Been Homeless in the Past Three Years (streets, in EH, or in a safe haven)'], consts.HUD_CLIENT_HOMELESS_COUNT, interactive=interactive),
-            prior_residence=hud_code(row['Residence Prior to Program Entry - Type of Residence'], consts.HUD_CLIENT_PRIOR_RESIDENCE, interactive=interactive),
-            length_at_prior_residence=hud_code(row['Residence Prior to Program Entry - Length of Stay in Previous Place'], consts.HUD_CLIENT_LENGTH_AT_PRIOR_RESIDENCE, interactive=interactive),
+            homeless_in_three_years=parse_cell(row, 'Number of Times the Client has Been Homeless in the Past Three Years (streets, in EH, or in a safe haven)', interactive=interactive),
+            prior_residence=parse_cell(row, 'Residence Prior to Program Entry - Type of Residence', interactive=interactive),
+            length_at_prior_residence=parse_cell(row, 'Residence Prior to Program Entry - Length of Stay in Previous Place', interactive=interactive),
         )
 
         exit_values = dict(
             shared_values,
             project_exit_date=exit_date,
-            destination=hud_code(row['Exit Destination'], consts.HUD_CLIENT_DESTINATION, interactive=interactive),
+            destination=parse_cell(row, 'Exit Destination', interactive=interactive),
         )
 
-        # Get or create the entry and exit assessments, if there is an entry
-        # or exit date, respectively. Spit a warning if there are different
-        # values for the assessments.
+        # Queue up the entry and exit assessments, if there is an entry or
+        # exit date, respectively. They're saved when the assessments are
+        # flushed, at the end of the batch of rows.
+        kinds = []
         if entry_date:
-            entry, _ = ClientEntryAssessment.objects.get_or_create(
-                member=member,
-                defaults=entry_values)
-            for k, v in entry_values.items():
-                if getattr(entry, k) != v:
-                    logger.warn('Warning: {} changed for entry assessment on client {} while loading from CSV: {!r} --> {!r}'.format(k, entry.member, getattr(entry, k), v))
-        else:
-            entry = None
-
+            self.assessments.add('entry', member, entry_values)
+            kinds.append('entry')
         if exit_date:
-            exit, _ = ClientExitAssessment.objects.get_or_create(
-                member=member,
-                defaults=exit_values)
-            for k, v in exit_values.items():
-                if getattr(exit, k) != v:
-                    logger.warn('Warning: {} changed for exit assessment on client {} while loading from CSV: {!r} --> {!r}'.format(k, exit.member, getattr(exit, k), v))
-        else:
-            exit = None
-
-        return entry, exit
+            self.assessments.add('exit', member, exit_values)
+            kinds.append('exit')
+        return kinds
@@ -0,0 +1,125 @@
+import struct
+import time
+import zlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Signatures and flags from the PKWARE .ZIP file format specification
+# (APPNOTE.TXT), sections 4.3.7 - 4.3.16.
+LOCAL_FILE_HEADER_SIGNATURE = 0x04034b50
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+CENTRAL_DIRECTORY_SIGNATURE = 0x02014b50
+END_OF_CENTRAL_DIRECTORY_SIGNATURE = 0x06054b50
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8_NAME = 0x800
+ZIP_DEFLATED = 8
+ZIP_VERSION = 20
+ZIP_MAX_SIZE = 0xFFFFFFFF
+
+
+def dos_datetime(timestamp=None):
+    """
+    Get the (time, date) pair that a zip header uses for a timestamp.
+    """
+    t = time.localtime(timestamp)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+class ZipStream:
+    """
+    Build a zip archive as a series of byte strings, so that it can be
+    written to an unseekable stream (like an HTTP response) while the data
+    for each entry is still being generated.
+
+    Each entry's size and checksum are written in a data descriptor after
+    the entry's contents, rather than in the local file header. Zip64
+    archives are not supported, so no entry (or the archive as a whole) may
+    be larger than 4GB.
+
+    Usage:
+
+        zipstream = ZipStream()
+        for chunk in zipstream.add('file.csv', iter_bytes()):
+            ...
+        for chunk in zipstream.finish():
+            ...
+
+    """
+    def __init__(self, compresslevel=6):
+        self.compresslevel = compresslevel
+        self.entries = []
+        self.offset = 0
+
+    def _emit(self, data):
+        self.offset += len(data)
+        if self.offset > ZIP_MAX_SIZE:
+            raise ValueError('Zip archive is larger than 4GB; zip64 is not supported.')
+        return data
+
+    def add(self, arcname, chunks):
+        """
+        Add an entry to the archive, yielding the compressed bytes as the
+        chunks of uncompressed data are consumed.
+        """
+        name = arcname.encode('utf-8')
+        dos_time, dos_date = dos_datetime()
+        header_offset = self.offset
+
+        logger.debug('Adding {} to the zip stream'.format(arcname))
+        yield self._emit(struct.pack(
+            '<IHHHHHIIIHH',
+            LOCAL_FILE_HEADER_SIGNATURE, ZIP_VERSION,
+            FLAG_DATA_DESCRIPTOR | FLAG_UTF8_NAME, ZIP_DEFLATED,
+            dos_time, dos_date, 0, 0, 0, len(name), 0) + name)
+
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        crc = 0
+        size = 0
+        compressed_size = 0
+        for chunk in chunks:
+            if not chunk:
+                continue
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            data = compressor.compress(chunk)
+            if data:
+                compressed_size += len(data)
+                yield self._emit(data)
+        data = compressor.flush()
+        compressed_size += len(data)
+        yield self._emit(data)
+
+        if size > ZIP_MAX_SIZE:
+            raise ValueError('Zip entry {} is larger than 4GB; zip64 is not supported.'.format(arcname))
+
+        crc &= 0xFFFFFFFF
+        yield self._emit(struct.pack(
+            '<IIII', DATA_DESCRIPTOR_SIGNATURE, crc, compressed_size, size))
+
+        self.entries.append((name, dos_time, dos_date, crc, compressed_size,
+                             size, header_offset))
+
+    def finish(self):
+        """
+        Yield the central directory that closes off the archive.
+        """
+        directory_offset = self.offset
+        for name, dos_time, dos_date, crc, compressed_size, size, header_offset in self.entries:
+            yield self._emit(struct.pack(
+                '<IHHHHHHIIIHHHHHII',
+                CENTRAL_DIRECTORY_SIGNATURE, ZIP_VERSION, ZIP_VERSION,
+                FLAG_DATA_DESCRIPTOR | FLAG_UTF8_NAME, ZIP_DEFLATED,
+                dos_time, dos_date, crc, compressed_size, size, len(name),
+                0, 0, 0, 0, 0o644 << 16, header_offset) + name)
+        directory_size = self.offset - directory_offset
+
+        yield self._emit(struct.pack(
+            '<IHHHHIIH',
+            END_OF_CENTRAL_DIRECTORY_SIGNATURE, 0, 0,
+            len(self.entries), len(self.entries),
+            directory_size, directory_offset, 0))
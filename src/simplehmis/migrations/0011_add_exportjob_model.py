@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('simplehmis', '0010_auto_update_to_hud_assessment_v3'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('status', models.CharField(max_length=10, db_index=True, choices=[('pending', 'Waiting to start'), ('running', 'Preparing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending')),
+                ('progress', models.CharField(max_length=200, blank=True)),
+                ('archive', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(null=True, blank=True)),
+                ('finished_at', models.DateTimeField(null=True, blank=True)),
+                ('requested_by', models.ForeignKey(null=True, blank=True, related_name='export_jobs', on_delete=models.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'get_latest_by': 'created_at',
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simplehmis', '0012_add_export_watermark_and_tombstones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoadCheckpoint',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('filename', models.CharField(max_length=1024)),
+                ('file_hash', models.CharField(max_length=64, db_index=True)),
+                ('last_line', models.PositiveIntegerField(default=0)),
+                ('state', models.TextField(blank=True)),
+                ('finished_at', models.DateTimeField(null=True, blank=True)),
+            ],
+            options={
+                'get_latest_by': 'created_at',
+            },
+        ),
+    ]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def backfill_household_statuses(apps, schema_editor):
+    Household = apps.get_model('simplehmis', 'Household')
+    HouseholdMember = apps.get_model('simplehmis', 'HouseholdMember')
+
+    members_by_household = dict((pk, []) for pk in Household.objects.values_list('pk', flat=True))
+    members = HouseholdMember.objects\
+        .filter(present_at_enrollment=True)\
+        .values_list('household_id', 'entry_date', 'exit_date', 'entry_assessment', 'exit_assessment')
+    for household_id, entry_date, exit_date, entry_assessment, exit_assessment in members:
+        members_by_household[household_id].append((entry_date, exit_date, entry_assessment, exit_assessment))
+
+    households_by_status = {}
+    for pk, members in members_by_household.items():
+        if not members:
+            status, complete = None, None
+        else:
+            if any(entry_date is None for entry_date, _, _, _ in members):
+                status = -1
+            elif any(exit_date is None for _, exit_date, _, _ in members):
+                status = 0
+            else:
+                status = 1
+            complete = all(
+                (entry_date is None or entry_assessment is not None) and
+                (exit_date is None or exit_assessment is not None)
+                for entry_date, exit_date, entry_assessment, exit_assessment in members)
+        households_by_status.setdefault((status, complete), []).append(pk)
+
+    for (status, complete), pks in households_by_status.items():
+        for start in range(0, len(pks), 500):
+            Household.objects\
+                .filter(pk__in=pks[start:start + 500])\
+                .update(enrollment_status=status, assessments_complete=complete)
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simplehmis', '0013_add_loadcheckpoint_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='household',
+            name='enrollment_status',
+            field=models.IntegerField(verbose_name='Enrollment status', choices=[(-1, 'pending'), (0, 'enrolled'), (1, 'exited')], null=True, blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='household',
+            name='assessments_complete',
+            field=models.NullBooleanField(verbose_name='Assessments complete', editable=False),
+        ),
+        migrations.RunPython(
+            backfill_household_statuses,
+            noop
+        ),
+    ]
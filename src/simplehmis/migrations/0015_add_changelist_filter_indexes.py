@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# Indexes for the queries that the household and household member admin
+# changelists run for each value of their enrollment and assessment status
+# filters: a count of the matching rows, and the first page of them, sorted
+# by the default ordering plus the admin's tie-breaking '-pk'.
+#
+# On PostgreSQL, each member enrollment status gets its own partial index,
+# in changelist order, with the same predicate that the filter sends (the
+# admin's `present_at_enrollment = true` is interpolated, so the planner
+# can match it). Django 1.8 can't declare partial indexes on a model.
+#
+# On SQLite, the filter values are bound parameters, which rules out
+# partial indexes. Instead, plain composites on the filtered columns,
+# followed by the changelist order, cover the pending and enrolled filters
+# and their sorting. The exited filter's `exit_date IS NOT NULL` is a range,
+# after which the rows would have to be sorted, so it gets an index in
+# changelist order that carries the dates, and reads the first page in
+# order instead.
+CHANGELIST_INDEXES = {
+    'postgresql': [
+        ('simplehmis_householdmember_pending',
+         'CREATE INDEX simplehmis_householdmember_pending ON simplehmis_householdmember (hoh_relationship, id DESC) '
+         'WHERE present_at_enrollment = true AND entry_date IS NULL'),
+        ('simplehmis_householdmember_enrolled',
+         'CREATE INDEX simplehmis_householdmember_enrolled ON simplehmis_householdmember (hoh_relationship, id DESC) '
+         'WHERE present_at_enrollment = true AND exit_date IS NULL AND entry_date IS NOT NULL'),
+        ('simplehmis_householdmember_exited',
+         'CREATE INDEX simplehmis_householdmember_exited ON simplehmis_householdmember (hoh_relationship, id DESC) '
+         'WHERE present_at_enrollment = true AND exit_date IS NOT NULL'),
+    ],
+    'sqlite': [
+        ('simplehmis_householdmember_present_entry',
+         'CREATE INDEX simplehmis_householdmember_present_entry ON simplehmis_householdmember '
+         '(present_at_enrollment, entry_date, hoh_relationship, id DESC)'),
+        ('simplehmis_householdmember_present_exit',
+         'CREATE INDEX simplehmis_householdmember_present_exit ON simplehmis_householdmember '
+         '(present_at_enrollment, exit_date, hoh_relationship, id DESC)'),
+        ('simplehmis_householdmember_present_order',
+         'CREATE INDEX simplehmis_householdmember_present_order ON simplehmis_householdmember '
+         '(present_at_enrollment, hoh_relationship, id DESC, entry_date, exit_date)'),
+    ],
+}
+
+# Indexes that both databases get: the household filters on their stored
+# statuses, ordered by '-pk' (the only indexes on those columns, since they
+# serve lookups of a status just as well), and the member changelist's
+# sortable entry and exit date columns.
+COMMON_INDEXES = [
+    ('simplehmis_household_enrollment_status',
+     'CREATE INDEX simplehmis_household_enrollment_status ON simplehmis_household (enrollment_status, id DESC)'),
+    ('simplehmis_household_assessments_complete',
+     'CREATE INDEX simplehmis_household_assessments_complete ON simplehmis_household (assessments_complete, id DESC)'),
+    ('simplehmis_cliententryassessment_project_entry_date',
+     'CREATE INDEX simplehmis_cliententryassessment_project_entry_date ON simplehmis_cliententryassessment (project_entry_date)'),
+    ('simplehmis_clientexitassessment_project_exit_date',
+     'CREATE INDEX simplehmis_clientexitassessment_project_exit_date ON simplehmis_clientexitassessment (project_exit_date)'),
+]
+
+
+def get_changelist_indexes(connection):
+    """
+    Get the (name, CREATE INDEX statement) of each of the indexes for the
+    connection's database; there are none for other databases.
+    """
+    if connection.vendor not in CHANGELIST_INDEXES:
+        return []
+    return CHANGELIST_INDEXES[connection.vendor] + COMMON_INDEXES
+
+
+def create_changelist_indexes(apps, schema_editor):
+    for name, sql in get_changelist_indexes(schema_editor.connection):
+        schema_editor.execute(sql)
+
+
+def drop_changelist_indexes(apps, schema_editor):
+    for name, sql in get_changelist_indexes(schema_editor.connection):
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simplehmis', '0014_add_household_status_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            create_changelist_indexes,
+            drop_changelist_indexes
+        ),
+    ]
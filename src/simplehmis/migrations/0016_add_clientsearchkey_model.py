@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+import unicodedata
+
+from django.db import models, migrations, transaction, DatabaseError
+
+
+# The indexes that the client search matches name fragments against.
+#
+# On PostgreSQL, a trigram index on the normalized names serves the
+# `LIKE '%...%'` that the search sends for each word. The index needs the
+# pg_trgm extension, which only a superuser or the database's owner can
+# create; on hosts where the app's user is neither, create it beforehand
+# with `CREATE EXTENSION pg_trgm`.
+#
+# On SQLite, an external-content FTS5 table, with the trigram tokenizer (so
+# that words match anywhere in a name, like on PostgreSQL), is kept in step
+# with the search key table by triggers. SQLite builds without FTS5 trigrams
+# (before 3.34) don't get the table, and the search falls back to `LIKE`s
+# on the key table. Note that SQLite drops the triggers if the key table is
+# ever rebuilt by a later migration, so such a migration has to recreate
+# them.
+SEARCH_INDEX_SQL = {
+    'postgresql': [
+        'CREATE INDEX simplehmis_clientsearchkey_names_trgm ON simplehmis_clientsearchkey USING gin (names gin_trgm_ops)',
+    ],
+    'sqlite': [
+        'CREATE VIRTUAL TABLE simplehmis_clientsearchkey_fts USING fts5 '
+        '(names, content=\'simplehmis_clientsearchkey\', content_rowid=\'client_id\', tokenize=\'trigram\')',
+
+        'CREATE TRIGGER simplehmis_clientsearchkey_fts_insert AFTER INSERT ON simplehmis_clientsearchkey BEGIN '
+        'INSERT INTO simplehmis_clientsearchkey_fts (rowid, names) VALUES (new.client_id, new.names); '
+        'END',
+
+        'CREATE TRIGGER simplehmis_clientsearchkey_fts_delete AFTER DELETE ON simplehmis_clientsearchkey BEGIN '
+        'INSERT INTO simplehmis_clientsearchkey_fts (simplehmis_clientsearchkey_fts, rowid, names) VALUES (\'delete\', old.client_id, old.names); '
+        'END',
+
+        'CREATE TRIGGER simplehmis_clientsearchkey_fts_update AFTER UPDATE ON simplehmis_clientsearchkey BEGIN '
+        'INSERT INTO simplehmis_clientsearchkey_fts (simplehmis_clientsearchkey_fts, rowid, names) VALUES (\'delete\', old.client_id, old.names); '
+        'INSERT INTO simplehmis_clientsearchkey_fts (rowid, names) VALUES (new.client_id, new.names); '
+        'END',
+    ],
+}
+
+DROP_SEARCH_INDEX_SQL = {
+    'postgresql': [
+        'DROP INDEX IF EXISTS simplehmis_clientsearchkey_names_trgm',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS simplehmis_clientsearchkey_fts_insert',
+        'DROP TRIGGER IF EXISTS simplehmis_clientsearchkey_fts_delete',
+        'DROP TRIGGER IF EXISTS simplehmis_clientsearchkey_fts_update',
+        'DROP TABLE IF EXISTS simplehmis_clientsearchkey_fts',
+    ],
+}
+
+
+def create_trigram_extension(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if cursor.fetchone():
+            return
+
+    try:
+        schema_editor.execute('CREATE EXTENSION pg_trgm')
+    except DatabaseError as e:
+        raise DatabaseError(
+            'The client search index needs the pg_trgm extension, and the '
+            'database user can\'t create it ({}). Have a superuser run '
+            '`CREATE EXTENSION pg_trgm` in the database, then migrate '
+            'again.'.format(e)) from e
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    statements = SEARCH_INDEX_SQL.get(connection.vendor, [])
+    if connection.vendor == 'postgresql':
+        create_trigram_extension(schema_editor)
+    if connection.vendor != 'sqlite':
+        for sql in statements:
+            schema_editor.execute(sql)
+        return
+
+    try:
+        with transaction.atomic(using=connection.alias):
+            for sql in statements:
+                schema_editor.execute(sql)
+    except DatabaseError:
+        # No FTS5, or no trigram tokenizer.
+        pass
+
+
+def drop_search_index(apps, schema_editor):
+    for sql in DROP_SEARCH_INDEX_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def normalize_search_text(text):
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub('[\'’]', '', text)
+    return ' '.join(re.findall(r'[^\W_]+', text))
+
+
+def backfill_search_keys(apps, schema_editor):
+    Client = apps.get_model('simplehmis', 'Client')
+    ClientSearchKey = apps.get_model('simplehmis', 'ClientSearchKey')
+
+    last_pk = 0
+    while True:
+        clients = list(Client.objects\
+            .filter(pk__gt=last_pk)\
+            .order_by('pk')\
+            .values_list('pk', 'first', 'middle', 'last', 'ssn')[:5000])
+        if not clients:
+            break
+
+        ClientSearchKey.objects.bulk_create([
+            ClientSearchKey(
+                client_id=pk,
+                names=normalize_search_text(' '.join([first, middle, last])),
+                ssn_last4=ssn[-4:] if ssn else '')
+            for pk, first, middle, last, ssn in clients
+        ])
+        last_pk = clients[-1][0]
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simplehmis', '0015_add_changelist_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientSearchKey',
+            fields=[
+                ('client', models.OneToOneField(primary_key=True, serialize=False, related_name='search_key', to='simplehmis.Client')),
+                ('names', models.TextField(blank=True)),
+                ('ssn_last4', models.CharField(max_length=4, blank=True, db_index=True)),
+            ],
+        ),
+        migrations.RunPython(
+            create_search_index,
+            drop_search_index
+        ),
+        migrations.RunPython(
+            backfill_search_keys,
+            noop
+        ),
+    ]
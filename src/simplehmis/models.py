@@ -1,6 +1,15 @@
 # -*- encoding: utf-8 -*-
 
-from django.db import models
+import json
+import os
+import re
+import threading
+import unicodedata
+from contextlib import contextmanager
+
+from django.db import DatabaseError, DEFAULT_DB_ALIAS, connections, models
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.utils.timezone import now, timedelta, datetime
@@ -122,18 +131,52 @@ class Project (TimestampedModel):
 
 
 class ClientManager (models.Manager):
-    def get_load_helper(self):
+    def get_load_helper(self, bulk=False):
+        if bulk:
+            from simplehmis.management.bulk_loader_utils import BulkClientLoaderHelper
+            return BulkClientLoaderHelper()
         from simplehmis.management.loader_utils import ClientLoaderHelper
         helper = ClientLoaderHelper()
         return helper
 
-    def load_from_csv_stream(self, stream, interactive=True, strong_matching=False):
-        helper = self.get_load_helper()
-        return helper.load_from_csv_stream(self, stream, interactive=interactive, strong_matching=strong_matching)
+    def load_from_csv_stream(self, stream, interactive=True, strong_matching=False, bulk=False, window_size=None, jobs=1, error_report=None, diff_report=None, dry_run=False):
+        helper = self.get_load_helper(bulk=bulk)
+        return helper.load_from_csv_stream(self, stream, interactive=interactive, strong_matching=strong_matching, window_size=window_size, jobs=jobs, error_report=error_report, diff_report=diff_report, dry_run=dry_run)
 
-    def load_from_csv_file(self, filename, interactive=True, strong_matching=False):
-        helper = self.get_load_helper()
-        return helper.load_from_csv_file(self, filename, interactive=interactive, strong_matching=strong_matching)
+    def load_from_csv_file(self, filename, interactive=True, strong_matching=False, bulk=False, window_size=None, jobs=1, error_report=None, resume=False, diff_report=None, dry_run=False):
+        helper = self.get_load_helper(bulk=bulk)
+        return helper.load_from_csv_file(self, filename, interactive=interactive, strong_matching=strong_matching, window_size=window_size, jobs=jobs, error_report=error_report, resume=resume, diff_report=diff_report, dry_run=dry_run)
+
+    def names_contain(self, text):
+        """
+        Filter the clients down to the ones with a first, middle, or last name
+        that contains the text, ignoring case, as the admin's search_fields
+        would. When the text is plain ASCII, every one of its normalized words
+        has to be in the client's search key too, so the index of the keys
+        can narrow the clients down first.
+        """
+        clients = self.filter(
+            models.Q(first__icontains=text) |
+            models.Q(middle__icontains=text) |
+            models.Q(last__icontains=text))
+
+        words = get_indexed_search_words(text)
+        if words:
+            keys = ClientSearchKey.objects.filter_by_names(words)
+            clients = clients.filter(pk__in=keys.values('client_id'))
+        return clients
+
+    def ssn_contains(self, text):
+        """
+        Filter the clients down to the ones with an SSN that contains the
+        text, ignoring case, as the admin's search_fields would.
+        """
+        if len(text) > self.model._meta.get_field('ssn').max_length:
+            return self.none()
+        if len(text) == 9 and text.isdigit():
+            # Only an equal SSN can contain it, which the index can find.
+            return self.filter(ssn=text)
+        return self.filter(ssn__icontains=text)
 
     def get_or_create_client_from_row(self, row, interactive=True, strong_matching=False):
         helper = self.get_load_helper()
@@ -153,19 +196,11 @@ class ClientManager (models.Manager):
         return helper
 
     def dump_to_csv_file(self, filename):
+        from simplehmis.management.dumper_utils import CLIENT_DUMP_OPTIONS
         helper = self.get_dump_helper()
         helper.dump_to_csv_file(
-            self.prefetch_related('race'), filename,
-            all_fields=('client_id', 'first', 'middle', 'last', 'suffix',
-                        'dob', 'ssn','gender', 'race', 'ethnicity',
-                        'veteran_status'),
-            hud_code_fields={
-                'gender': dict(consts.HUD_CLIENT_GENDER),
-                'ethnicity': dict(consts.HUD_CLIENT_ETHNICITY),
-                'veteran_status': dict(consts.HUD_YES_NO),
-            },
-            multi_hud_code_fields={'race'},
-            renamed_fields={'client_id': 'id'}
+            self.all(), filename,
+            **CLIENT_DUMP_OPTIONS
         )
 
 
@@ -227,6 +262,77 @@ class Client (TimestampedModel):
     def __str__(self):
         return '{} (SSN: {})'.format(self.name_display(), self.ssn_display())
 
+
+class ClientSearchKeyQuerySet (models.QuerySet):
+    def search(self, search_term):
+        """
+        Filter the keys down to those of the clients that match every word of
+        the search term. A 9-digit number (with or without hyphens) has to be
+        the client's SSN, and a 4-digit number the last four digits of it; any
+        other number can be any part of the SSN or names. Any other word can
+        be any part of the client's first, middle, or last name, and a word
+        with no letters or digits at all (like "-") is matched as it is.
+        """
+        keys = self
+        name_words = []
+        for bit in search_term.split():
+            digits = bit.replace('-', '')
+            if digits.isdigit():
+                if len(digits) == 9:
+                    keys = keys.filter(client__ssn=digits)
+                elif len(digits) == 4:
+                    keys = keys.filter(ssn_last4=digits)
+                else:
+                    keys = keys.filter(models.Q(client__ssn__contains=digits) | models.Q(names__contains=digits))
+            else:
+                words = normalize_search_text(bit).split()
+                if words:
+                    name_words.extend(words)
+                else:
+                    # Nothing to look for in the keys (e.g. "-"), so match
+                    # the word as it is.
+                    clients = Client.objects.names_contain(bit) | Client.objects.ssn_contains(bit)
+                    keys = keys.filter(client__in=clients.values('pk'))
+        return keys.filter_by_names(name_words)
+
+    def filter_by_names(self, words):
+        """
+        Filter the keys down to those whose names contain every one of the
+        (normalized) words. On PostgreSQL, the trigram index on the names
+        serves the `LIKE`s. On SQLite, the words long enough to have a
+        trigram are matched against the full-text index instead.
+        """
+        keys = self
+        if has_client_search_index(self.db):
+            indexed_words = [word for word in words if len(word) >= 3]
+            if indexed_words:
+                keys = keys.extra(
+                    where=['client_id IN (SELECT rowid FROM {0} WHERE {0} MATCH %s)'.format(CLIENT_SEARCH_INDEX_TABLE)],
+                    params=[' '.join('"{}"'.format(word) for word in indexed_words)])
+            words = [word for word in words if len(word) < 3]
+
+        for word in words:
+            keys = keys.filter(names__contains=word)
+        return keys
+
+
+class ClientSearchKey (models.Model):
+    """
+    A client's names and SSN, normalized for searching. The key is kept up
+    to date when a client is saved; code that writes clients in bulk should
+    call `update_client_search_keys`.
+
+    """
+    client = models.OneToOneField(Client, primary_key=True, related_name='search_key')
+    names = models.TextField(blank=True)
+    ssn_last4 = models.CharField(max_length=4, blank=True, db_index=True)
+
+    objects = ClientSearchKeyQuerySet.as_manager()
+
+    def __str__(self):
+        return self.names
+
+
 class HouseholdManager (models.QuerySet):
     def get_queryset(self):
         return super().get_queryset().prefetch_related('members')
@@ -238,34 +344,13 @@ class HouseholdManager (models.QuerySet):
         0  -- Is currently at least partially enrolled in a program
         1  -- Has completely exited a program
         """
-        from django.db.models import Count, F, Q
         if status is None:
             return self
 
         status = str(status)
-        if status == '-1':
-            qs = self\
-                .filter(members__present_at_enrollment=True)\
-                .annotate(total_member_count=Count('members'))\
-                .annotate(enrolled_count=Count('members__entry_date'))\
-                .filter(enrolled_count__lt=F('total_member_count'))
-        elif status == '0':
-            qs = self\
-                .filter(members__present_at_enrollment=True)\
-                .annotate(total_member_count=Count('members'))\
-                .annotate(enrolled_count=Count('members__entry_date'))\
-                .annotate(exited_count=Count('members__exit_date'))\
-                .filter(enrolled_count=F('total_member_count'))\
-                .filter(exited_count__lt=F('total_member_count'))
-        elif status == '1':
-            qs = self\
-                .filter(members__present_at_enrollment=True)\
-                .annotate(total_member_count=Count('members'))\
-                .annotate(exited_count=Count('members__exit_date'))\
-                .filter(exited_count=F('total_member_count'))
-        else:
+        if status not in ('-1', '0', '1'):
             raise ValueError('Status should only be one of -1, 0, or 1. Got {}'.format(status))
-        return qs
+        return self.filter(enrollment_status=int(status))
 
     def filter_by_assessments(self, status):
         """
@@ -275,33 +360,79 @@ class HouseholdManager (models.QuerySet):
               * members with exit dates don't have exit assessments
         1  -- Assessments are up to date
         """
-        from django.db.models import Count, F, Q
         if status is None:
             return self
 
         status = str(status)
-        if status == '0':
-            qs = self\
-                .filter(members__present_at_enrollment=True)\
-                .annotate(total_entered_count=Count('members__entry_date'))\
-                .annotate(total_exited_count=Count('members__exit_date'))\
-                .annotate(entry_count=Count('members__entry_assessment'))\
-                .annotate(exit_count=Count('members__exit_assessment'))\
-                .filter(
-                    Q(entry_count__lt=F('total_entered_count')) |
-                    Q(exit_count__lt=F('total_exited_count')))
-        elif status == '1':
-            qs = self\
-                .filter(members__present_at_enrollment=True)\
-                .annotate(total_entered_count=Count('members__entry_date'))\
-                .annotate(total_exited_count=Count('members__exit_date'))\
-                .annotate(entry_count=Count('members__entry_assessment'))\
-                .annotate(exit_count=Count('members__exit_assessment'))\
-                .filter(entry_count=F('total_entered_count'))\
-                .filter(exit_count=F('total_exited_count'))
-        else:
+        if status not in ('0', '1'):
             raise ValueError('Status should only be 0 or 1. Got {}'.format(status))
-        return qs
+        return self.filter(assessments_complete=(status == '1'))
+
+    def search(self, search_term):
+        """
+        Filter the households down to the ones that match every word of the
+        search term, exactly as the admin's search_fields would: through
+        their project's name, or through the first, middle, or last name, or
+        the SSN, of any one of their members' clients (each word can match a
+        different member). The members are matched in subqueries, so each
+        household appears only once, without a `DISTINCT`.
+        """
+        households = self
+        for bit in search_term.split():
+            # There are few enough projects to look up their keys first.
+            # If none of them match, SQLite can drive the query from the
+            # members instead of scanning every household.
+            project_ids = list(Project.objects\
+                .filter(name__icontains=bit)\
+                .values_list('pk', flat=True))
+
+            if get_indexed_search_words(bit):
+                matches = models.Q(pk__in=self.members_of(Client.objects.names_contain(bit))) | \
+                          models.Q(pk__in=self.members_of(Client.objects.ssn_contains(bit)))
+                if project_ids:
+                    matches = models.Q(project__in=project_ids) | matches
+                households = households.filter(matches)
+            else:
+                # Words that the index can't narrow down (like "3") tend to
+                # match most of the clients, so check each household's
+                # members as it comes up, instead of finding every match
+                # first; a page of the results can then stop early.
+                where, params = self.get_members_match_sql(bit)
+                if project_ids:
+                    where = '({}.project_id IN ({}) OR {})'.format(
+                        Household._meta.db_table, ', '.join(['%s'] * len(project_ids)), where)
+                    params = project_ids + params
+                households = households.extra(where=[where], params=params)
+        return households
+
+    @staticmethod
+    def members_of(clients):
+        return HouseholdMember.objects\
+            .filter(client__in=clients.values('pk'))\
+            .values('household_id')
+
+    def get_members_match_sql(self, bit):
+        """
+        Get the SQL (and its params) of a condition on a household that any
+        one of its members' clients has a first, middle, or last name, or an
+        SSN, that contains the word, ignoring case.
+        """
+        members = HouseholdMember.objects\
+            .filter(models.Q(client__first__icontains=bit) |
+                    models.Q(client__middle__icontains=bit) |
+                    models.Q(client__last__icontains=bit) |
+                    models.Q(client__ssn__icontains=bit))\
+            .extra(where=['{}.household_id = {}.id'.format(HouseholdMember._meta.db_table, Household._meta.db_table)])\
+            .values('pk')
+        sql, params = members.query.get_compiler(self.db).as_sql()
+        return 'EXISTS ({})'.format(sql), list(params)
+
+    def update_statuses(self):
+        """
+        Recompute the stored enrollment and assessment statuses of the
+        households.
+        """
+        update_household_statuses(self.values_list('pk', flat=True))
 
 
 class Household (TimestampedModel):
@@ -322,9 +453,25 @@ class Household (TimestampedModel):
     into the project is  unacceptable.
 
     """
+    PENDING = -1
+    ENROLLED = 0
+    EXITED = 1
+    ENROLLMENT_STATUS_CHOICES = (
+        (PENDING, _('pending')),
+        (ENROLLED, _('enrolled')),
+        (EXITED, _('exited')),
+    )
+
     project = models.ForeignKey('Project', null=True)
     referral_notes = models.TextField(_('Referral notes'), blank=True)
 
+    # Kept up to date from the members that were present at enrollment, and
+    # their assessments, by `update_household_statuses`. Both are None if no
+    # member was present. Each is indexed together with the id, in the
+    # changelist's order, by migration 0015, rather than on its own.
+    enrollment_status = models.IntegerField(_('Enrollment status'), choices=ENROLLMENT_STATUS_CHOICES, null=True, blank=True, editable=False)
+    assessments_complete = models.NullBooleanField(_('Assessments complete'), editable=False)
+
     objects = HouseholdManager.as_manager()
 
     class Meta:
@@ -356,25 +503,11 @@ class Household (TimestampedModel):
     dependents_display.short_description = _('Dependents')
 
     def is_enrolled(self):
-        members = self.members.all()
-
-        # If any present member is pending, then the whole
-        # household is pending
-        for member in members:
-            if member.present_at_enrollment:
-                if member.is_enrolled() is None:
-                    return None
-
-        # If none are pending, then if any member is
-        # enrolled, then the whole household is enrolled.
-        for member in members:
-            if member.present_at_enrollment:
-                if member.is_enrolled() is True:
-                    return True
-
-        # If no one present is pending or enrolled, then
-        # The whole household is exited.
-        return False
+        # A household is pending if any present member is, enrolled if any
+        # present member is enrolled, and otherwise exited.
+        if self.enrollment_status == self.PENDING:
+            return None
+        return self.enrollment_status == self.ENROLLED
     is_enrolled.boolean = True
 
     def date_of_entry(self):
@@ -438,16 +571,11 @@ class HouseholdMemberQuerySet (models.QuerySet):
         return helper
 
     def dump_to_csv_file(self, filename):
+        from simplehmis.management.dumper_utils import ENROLLMENT_DUMP_OPTIONS
         helper = self.get_dump_helper()
         helper.dump_to_csv_file(
-            self.select_related('household__project'), filename,
-            all_fields=('project_id', 'project_name', 'client_id',
-                        'household_id', 'enrollment_id', 'hoh_relationship',
-                        'entry_date', 'exit_date'),
-            hud_code_fields={
-                'hoh_relationship': dict(consts.HUD_CLIENT_HOH_RELATIONSHIP),
-            },
-            renamed_fields={'enrollment_id': 'id'}
+            self.all(), filename,
+            **ENROLLMENT_DUMP_OPTIONS
         )
 
 
@@ -756,3 +884,581 @@ class ClientExitAssessment (TimestampedModel, HealthInsuranceFields,
 
     def __str__(self):
         return '{} Exit Information'.format(self.member)
+
+
+@contextmanager
+def separate_connection(alias='separate'):
+    """
+    Open a second connection to the default database, for writes that should
+    be committed while the default connection is in a transaction. Yields the
+    alias of the new connection, or the default alias if the database is an
+    in-memory SQLite database (like the test database), which can only be
+    reached through the connection that owns it.
+    """
+    default = connections[DEFAULT_DB_ALIAS]
+    if default.vendor == 'sqlite' and default.is_in_memory_db(default.settings_dict['NAME']):
+        yield DEFAULT_DB_ALIAS
+        return
+
+    settings_dict = dict(default.settings_dict)
+    if default.vendor == 'sqlite':
+        # Fail straight away, rather than waiting on the default connection's
+        # locks.
+        settings_dict['OPTIONS'] = dict(settings_dict['OPTIONS'], timeout=0)
+    connections.databases[alias] = settings_dict
+    try:
+        yield alias
+    finally:
+        connections[alias].close()
+        del connections[alias]
+        del connections.databases[alias]
+
+
+class ExportJobQuerySet (models.QuerySet):
+    def enqueue(self, user=None):
+        """
+        Request a new export, unless one is already waiting to be run.
+        """
+        try:
+            return self.filter(status__in=(ExportJob.PENDING, ExportJob.RUNNING)).latest('created_at')
+        except ExportJob.DoesNotExist:
+            return self.create(requested_by=user)
+
+    def claim_next(self):
+        """
+        Mark the oldest pending job as running and return it, or return None
+        if there are no pending jobs. A job is only ever claimed by one
+        worker.
+        """
+        for job in self.filter(status=ExportJob.PENDING).order_by('created_at'):
+            claimed = self\
+                .filter(pk=job.pk, status=ExportJob.PENDING)\
+                .update(status=ExportJob.RUNNING, started_at=now())
+            if claimed:
+                return self.get(pk=job.pk)
+        return None
+
+    def stalled(self):
+        """
+        The running jobs that have gone on for longer than any export should
+        take, most likely because the worker running them was stopped.
+        """
+        timeout = timedelta(hours=settings.HUD_EXPORT_JOB_TIMEOUT_HOURS)
+        return self.filter(status=ExportJob.RUNNING, started_at__lt=now() - timeout)
+
+    def fail_stalled(self):
+        return self.stalled().update(
+            status=ExportJob.FAILED, finished_at=now(),
+            error='The export worker was stopped before the job finished.')
+
+    def expired(self):
+        retention = timedelta(days=settings.HUD_EXPORT_RETENTION_DAYS)
+        return self.filter(finished_at__lt=now() - retention)
+
+    def delete_expired(self):
+        """
+        Delete the jobs (and their archives) that are older than the
+        retention window.
+        """
+        jobs = list(self.expired())
+        for job in jobs:
+            job.delete_archive()
+            job.delete()
+        return len(jobs)
+
+
+class ExportJob (TimestampedModel):
+    """
+    A request for an archive of the complete HUD data export. Export jobs are
+    run outside of the web request by the `run_export_jobs` management
+    command, and their archives are kept for HUD_EXPORT_RETENTION_DAYS.
+
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, _('Waiting to start')),
+        (RUNNING, _('Preparing')),
+        (READY, _('Ready')),
+        (FAILED, _('Failed')),
+    )
+
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, related_name='export_jobs', on_delete=models.SET_NULL)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    progress = models.CharField(max_length=200, blank=True)
+    archive = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ExportJobQuerySet.as_manager()
+
+    class Meta:
+        get_latest_by = 'created_at'
+
+    def __str__(self):
+        return 'Export requested {} ({})'.format(self.created_at, self.get_status_display())
+
+    def is_preparing(self):
+        return self.status in (self.PENDING, self.RUNNING)
+
+    def is_ready(self):
+        return self.status == self.READY and os.path.exists(self.archive)
+
+    def expires_at(self):
+        if self.finished_at:
+            return self.finished_at + timedelta(days=settings.HUD_EXPORT_RETENTION_DAYS)
+
+    def set_progress(self, filename, index, count, using=DEFAULT_DB_ALIAS):
+        self.progress = 'Writing {} ({} of {})'.format(filename, index + 1, count)
+        try:
+            ExportJob.objects.using(using).filter(pk=self.pk).update(progress=self.progress)
+        except DatabaseError:
+            if using == DEFAULT_DB_ALIAS:
+                raise
+            # SQLite (unless it's in WAL mode) won't take a write while the
+            # export is reading. The progress is only informational.
+            logger.debug('Could not record the progress of export job {}'.format(self.pk))
+
+    def run(self):
+        """
+        Write the export archive into HUD_EXPORT_ROOT. The archive is written
+        to a partial file and only moved into place once it is complete.
+        """
+        from simplehmis.management.dumper_utils import iter_hud_export_zip
+
+        if not os.path.exists(settings.HUD_EXPORT_ROOT):
+            os.makedirs(settings.HUD_EXPORT_ROOT)
+        archive = os.path.join(settings.HUD_EXPORT_ROOT, 'simplehmis_data_{}.zip'.format(self.pk))
+        partial = archive + '.part'
+
+        try:
+            # The export is read in a single transaction, so the progress is
+            # written through a connection of its own, to be seen before the
+            # export is finished.
+            with separate_connection() as using:
+                progress = lambda *args: self.set_progress(*args, using=using)
+                with open(partial, 'wb') as zipfile:
+                    for chunk in iter_hud_export_zip(progress=progress):
+                        zipfile.write(chunk)
+            os.rename(partial, archive)
+        except Exception as e:
+            logger.exception('Export job {} failed'.format(self.pk))
+            if os.path.exists(partial):
+                os.remove(partial)
+            self.status = self.FAILED
+            self.error = str(e)
+        else:
+            self.status = self.READY
+            self.archive = archive
+            self.progress = ''
+
+        self.finished_at = now()
+        self.save()
+
+    def delete_archive(self):
+        if self.archive and os.path.exists(self.archive):
+            os.remove(self.archive)
+
+
+class ExportRun (models.Model):
+    """
+    A record of a successful `dump_hud_data` export. The `as_of` time of the
+    latest run is the watermark for the next incremental export.
+
+    """
+    as_of = models.DateTimeField(db_index=True)
+    since = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        get_latest_by = 'as_of'
+
+    def __str__(self):
+        if self.since:
+            return 'Changes from {} to {}'.format(self.since, self.as_of)
+        return 'Full export as of {}'.format(self.as_of)
+
+
+class LoadCheckpointQuerySet (models.QuerySet):
+    def start(self, filename, file_hash, resume=False):
+        """
+        Get the checkpoint to load a file from: the latest one for the same
+        file contents if resuming (and there is one), or a new one.
+        """
+        if resume:
+            try:
+                return self.filter(file_hash=file_hash).latest('created_at')
+            except LoadCheckpoint.DoesNotExist:
+                logger.warn('No checkpoint found for {}; loading from the start'.format(filename))
+        return self.create(filename=filename, file_hash=file_hash)
+
+
+class LoadCheckpoint (TimestampedModel):
+    """
+    How far a streamed `load_clients` run has gotten through a CSV file. The
+    checkpoint is saved along with each batch of rows, so a failed load can
+    be picked up after the last committed batch with `--resume`.
+
+    The `state` is what the loader needs to carry on from there, as JSON:
+    the dependents still waiting on their heads of household, and the last
+    heads of household seen.
+
+    """
+    filename = models.CharField(max_length=1024)
+    file_hash = models.CharField(max_length=64, db_index=True)
+    last_line = models.PositiveIntegerField(default=0)
+    state = models.TextField(blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LoadCheckpointQuerySet.as_manager()
+
+    class Meta:
+        get_latest_by = 'created_at'
+
+    def __str__(self):
+        if self.finished_at:
+            return 'Loaded {} at {}'.format(self.filename, self.finished_at)
+        return 'Loaded {} through line {}'.format(self.filename, self.last_line)
+
+    def get_state(self):
+        return json.loads(self.state) if self.state else {}
+
+    def record(self, last_line, state):
+        self.last_line = last_line
+        self.state = json.dumps(state)
+        self.save()
+
+    def finish(self):
+        self.state = ''
+        self.finished_at = now()
+        self.save()
+
+
+class DeletedRecord (models.Model):
+    """
+    A tombstone for a row that has been removed from one of the HUD export
+    files, so that incremental exports can report deletions.
+
+    """
+    filename = models.CharField(max_length=100)
+    key_field = models.CharField(max_length=100)
+    key = models.PositiveIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return '{} {}={} (deleted {})'.format(self.filename, self.key_field, self.key, self.deleted_at)
+
+
+# The export file, key column, and key attribute that identify a row of each
+# model in the HUD export.
+EXPORT_KEYS = {
+    Client: ('clients.csv', 'client_id', 'id'),
+    HouseholdMember: ('enrollments.csv', 'enrollment_id', 'id'),
+    ClientEntryAssessment: ('entry_assessments.csv', 'enrollment_id', 'member_id'),
+    # A member can have any number of annual assessments, so they're
+    # identified by their own id.
+    ClientAnnualAssessment: ('annual_assessments.csv', 'annual_assessment_id', 'id'),
+    ClientExitAssessment: ('exit_assessments.csv', 'enrollment_id', 'member_id'),
+}
+
+
+def record_deleted_export_row(sender, instance, **kwargs):
+    filename, key_field, key_attr = EXPORT_KEYS[sender]
+    DeletedRecord.objects.create(
+        filename=filename,
+        key_field=key_field,
+        key=getattr(instance, key_attr))
+
+# Connected to each exported model rather than to every model, since a
+# delete receiver stops Django from fast-deleting a model's rows.
+for exported_model in EXPORT_KEYS:
+    post_delete.connect(record_deleted_export_row, sender=exported_model)
+
+
+EXPORTED_ASSESSMENT_MODELS = (ClientEntryAssessment, ClientAnnualAssessment, ClientExitAssessment)
+
+
+def record_members_left_export(member_ids):
+    """
+    Write tombstones for the enrollments and assessments of members that are
+    no longer present at enrollment. Their rows drop out of the export files
+    without being deleted.
+    """
+    member_ids = list(member_ids)
+    filename, key_field, _ = EXPORT_KEYS[HouseholdMember]
+    records = [DeletedRecord(filename=filename, key_field=key_field, key=pk) for pk in member_ids]
+    for model in EXPORTED_ASSESSMENT_MODELS:
+        filename, key_field, key_attr = EXPORT_KEYS[model]
+        records.extend(
+            DeletedRecord(filename=filename, key_field=key_field, key=key)
+            for key in model.objects.filter(member_id__in=member_ids).values_list(key_attr, flat=True))
+    DeletedRecord.objects.bulk_create(records)
+
+
+def touch_member_assessments(member_ids):
+    """
+    Mark the assessments of members that are present at enrollment again as
+    changed, so that they return to incremental exports.
+    """
+    for model in EXPORTED_ASSESSMENT_MODELS:
+        model.objects.filter(member_id__in=member_ids).update(updated_at=now())
+
+
+@receiver(m2m_changed, sender=Client.race.through)
+def touch_clients_with_changed_races(sender, instance, action, reverse, pk_set, **kwargs):
+    # A client's races are exported with the client, but changing them
+    # doesn't save the client.
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            Client.objects.filter(pk=instance.pk).update(updated_at=now())
+    elif action in ('post_add', 'post_remove'):
+        Client.objects.filter(pk__in=pk_set).update(updated_at=now())
+    elif action == 'pre_clear':
+        instance.client_set.update(updated_at=now())
+
+
+@receiver(pre_save, sender=Project)
+def remember_previous_project_name(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._previous_name = Project.objects\
+            .filter(pk=instance.pk)\
+            .values_list('name', flat=True)\
+            .first()
+
+
+@receiver(post_save, sender=Project)
+def touch_renamed_project_members(sender, instance, created, **kwargs):
+    # The project name is exported with each enrollment.
+    if not created and getattr(instance, '_previous_name', instance.name) != instance.name:
+        HouseholdMember.objects\
+            .filter(household__project=instance)\
+            .update(updated_at=now())
+
+
+# The number of households to recompute the statuses of at a time.
+HOUSEHOLD_STATUS_BATCH_SIZE = 500
+
+_household_status_updates = threading.local()
+
+
+def get_household_status(members):
+    """
+    Get the enrollment status of a household, and whether its assessments
+    are complete, from the (entry date, exit date, entry assessment id,
+    exit assessment id) of each member that was present at enrollment.
+    """
+    if not members:
+        return None, None
+
+    if any(entry_date is None for entry_date, _, _, _ in members):
+        status = Household.PENDING
+    elif any(exit_date is None for _, exit_date, _, _ in members):
+        status = Household.ENROLLED
+    else:
+        status = Household.EXITED
+
+    complete = all(
+        (entry_date is None or entry_assessment is not None) and
+        (exit_date is None or exit_assessment is not None)
+        for entry_date, exit_date, entry_assessment, exit_assessment in members)
+    return status, complete
+
+
+def get_household_statuses(household_ids):
+    """
+    Get the (enrollment status, assessments complete) of each of a batch of
+    households, by primary key, from their members.
+    """
+    members_by_household = dict((pk, []) for pk in household_ids)
+    members = HouseholdMember.objects\
+        .filter(household__in=list(members_by_household), present_at_enrollment=True)\
+        .values_list('household_id', 'entry_date', 'exit_date', 'entry_assessment', 'exit_assessment')
+    for household_id, *values in members:
+        members_by_household[household_id].append(tuple(values))
+    return dict((pk, get_household_status(members)) for pk, members in members_by_household.items())
+
+
+def update_household_statuses(household_ids):
+    """
+    Recompute the stored statuses of the households, in batches, grouping
+    the households that end up with the same statuses into one `UPDATE`.
+    Inside a `deferred_household_status_updates` block, the households are
+    only collected, to be updated at the end of the block.
+    """
+    household_ids = set(household_ids) - set([None])
+    deferred_ids = getattr(_household_status_updates, 'household_ids', None)
+    if deferred_ids is not None:
+        deferred_ids.update(household_ids)
+        return
+
+    household_ids = sorted(household_ids)
+    for start in range(0, len(household_ids), HOUSEHOLD_STATUS_BATCH_SIZE):
+        batch = household_ids[start:start + HOUSEHOLD_STATUS_BATCH_SIZE]
+        households_by_status = {}
+        for pk, (status, complete) in get_household_statuses(batch).items():
+            households_by_status.setdefault((status, complete), []).append(pk)
+        for (status, complete), pks in households_by_status.items():
+            Household.objects\
+                .filter(pk__in=pks)\
+                .update(enrollment_status=status, assessments_complete=complete)
+
+
+@contextmanager
+def deferred_household_status_updates():
+    """
+    Update the statuses of the households whose members or assessments
+    change inside the block all at once, at the end of the block, instead of
+    as each one is saved. Code that writes members or assessments in bulk
+    (which sends no signals) should call `update_household_statuses` for
+    the households it touches.
+    """
+    if getattr(_household_status_updates, 'household_ids', None) is not None:
+        yield
+        return
+
+    household_ids = _household_status_updates.household_ids = set()
+    try:
+        yield
+    finally:
+        _household_status_updates.household_ids = None
+    update_household_statuses(household_ids)
+
+
+@receiver(post_save, sender=Household)
+def update_saved_household_status(sender, instance, **kwargs):
+    # A household loaded from a fixture (or saved from a stale instance)
+    # may have been given the wrong statuses.
+    update_household_statuses([instance.pk])
+
+
+@receiver(pre_save, sender=HouseholdMember)
+def remember_previous_household(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._previous_household_id, instance._previously_present = HouseholdMember.objects\
+            .filter(pk=instance.pk)\
+            .values_list('household_id', 'present_at_enrollment')\
+            .first() or (None, None)
+
+
+@receiver(post_save, sender=HouseholdMember)
+@receiver(post_delete, sender=HouseholdMember)
+def update_member_household_status(sender, instance, **kwargs):
+    update_household_statuses([instance.household_id, getattr(instance, '_previous_household_id', None)])
+
+
+@receiver(post_save, sender=HouseholdMember)
+def update_member_export_rows(sender, instance, created, **kwargs):
+    # Only the members that are present at enrollment are exported.
+    previously_present = getattr(instance, '_previously_present', None)
+    if created or previously_present is None or previously_present == instance.present_at_enrollment:
+        return
+    if previously_present:
+        record_members_left_export([instance.pk])
+    else:
+        touch_member_assessments([instance.pk])
+
+
+@receiver(post_save, sender=ClientEntryAssessment)
+@receiver(post_save, sender=ClientExitAssessment)
+@receiver(post_delete, sender=ClientEntryAssessment)
+@receiver(post_delete, sender=ClientExitAssessment)
+def update_assessment_household_status(sender, instance, **kwargs):
+    update_household_statuses(HouseholdMember.objects\
+        .filter(pk=instance.member_id)\
+        .values_list('household_id', flat=True))
+
+
+# The SQLite full-text index of the client search keys' names, if the
+# SQLite build supports FTS5 trigrams. See migration 0016.
+CLIENT_SEARCH_INDEX_TABLE = 'simplehmis_clientsearchkey_fts'
+
+# The number of clients to update the search keys of at a time.
+CLIENT_SEARCH_KEY_BATCH_SIZE = 500
+
+_client_search_indexes = {}
+
+
+def normalize_search_text(text):
+    """
+    Lowercase the text, take the accents off of its letters, drop its
+    apostrophes, and separate the rest of it into words with single spaces,
+    so that "D'Angelo-Peña" becomes "dangelo pena".
+    """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub("['\u2019]", '', text)
+    return ' '.join(re.findall(r'[^\W_]+', text))
+
+
+def get_indexed_search_words(text):
+    """
+    Get the normalized words of the text that the index of the client search
+    keys can narrow a search for the text down with, or an empty list if it
+    can't. Only plain ASCII text is sure to be in the keys of the names that
+    contain it: other text could match through case folding that the keys
+    don't share (e.g. of a Greek final sigma). Words need three letters to
+    have a trigram in the index.
+
+    Note that on PostgreSQL, UPPER() also folds a dotless i onto an "I",
+    which the keys don't, so a name with one isn't found through an "i".
+    """
+    if any(ord(c) >= 128 for c in text):
+        return []
+    words = normalize_search_text(text).split()
+    if not any(len(word) >= 3 for word in words):
+        return []
+    return words
+
+
+def has_client_search_index(using):
+    """
+    Check (once per database) whether the database has a full-text index of
+    the client search keys.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+
+    name = connection.settings_dict['NAME']
+    if name not in _client_search_indexes:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM sqlite_master WHERE name = %s', [CLIENT_SEARCH_INDEX_TABLE])
+            _client_search_indexes[name] = bool(cursor.fetchone()[0])
+    return _client_search_indexes[name]
+
+
+def get_client_search_key(client):
+    names = ' '.join([client.first, client.middle, client.last])
+    return ClientSearchKey(
+        client_id=client.pk,
+        names=normalize_search_text(names),
+        ssn_last4=client.ssn[-4:] if client.ssn else '')
+
+
+def update_client_search_keys(clients):
+    """
+    Create or update the search keys of the clients, in batches, leaving
+    alone the ones that haven't changed.
+    """
+    clients = [client for client in clients if client.pk is not None]
+    for start in range(0, len(clients), CLIENT_SEARCH_KEY_BATCH_SIZE):
+        batch = clients[start:start + CLIENT_SEARCH_KEY_BATCH_SIZE]
+        existing_keys = ClientSearchKey.objects.in_bulk([client.pk for client in batch])
+
+        new_keys = []
+        for client in batch:
+            key = get_client_search_key(client)
+            existing_key = existing_keys.get(client.pk)
+            if existing_key is None:
+                new_keys.append(key)
+            elif (existing_key.names, existing_key.ssn_last4) != (key.names, key.ssn_last4):
+                key.save()
+        ClientSearchKey.objects.bulk_create(new_keys)
+
+
+@receiver(post_save, sender=Client)
+def update_saved_client_search_key(sender, instance, **kwargs):
+    update_client_search_keys([instance])
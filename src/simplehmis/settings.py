@@ -155,6 +155,18 @@ STATIC_ROOT = os.environ.get('STATIC_ROOT', os.path.join(os.path.dirname(BASE_DI
 HELP_EMAIL = os.environ.get('HELP_EMAIL', 'test@example.com')
 SERVER_EMAIL = os.environ.get('SERVER_EMAIL', 'admin@example.com')
 
+# Where the background export jobs write their archives, and how many days
+# a finished archive is kept before the worker deletes it.
+HUD_EXPORT_ROOT = os.environ.get('HUD_EXPORT_ROOT', os.path.join(os.path.dirname(BASE_DIR), 'exports'))
+HUD_EXPORT_RETENTION_DAYS = int(os.environ.get('HUD_EXPORT_RETENTION_DAYS', '7'))
+# How many hours an export job may run before the workers give up on it, as
+# left behind by a worker that was stopped part way through.
+HUD_EXPORT_JOB_TIMEOUT_HOURS = float(os.environ.get('HUD_EXPORT_JOB_TIMEOUT_HOURS', '6'))
+# The longest that a transaction that changes HUD data may take. Incremental
+# dumps pick up from this long before the last dump started, so that they
+# include the rows of transactions that were still open at the time.
+HUD_EXPORT_MAX_TRANSACTION_SECONDS = int(os.environ.get('HUD_EXPORT_MAX_TRANSACTION_SECONDS', '600'))
+
 
 # Logging
 
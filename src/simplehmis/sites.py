@@ -26,3 +26,14 @@ class HMISAdminSite(BaseAdminSite):
             request.session.set_test_cookie()
 
         return super().login(request, extra_context=extra_context)
+
+    def index(self, request, extra_context=None):
+        if request.user.is_superuser:
+            from simplehmis.models import ExportJob
+            extra_context = extra_context or {}
+            try:
+                extra_context['export_job'] = ExportJob.objects.latest()
+            except ExportJob.DoesNotExist:
+                extra_context['export_job'] = None
+
+        return super().index(request, extra_context=extra_context)
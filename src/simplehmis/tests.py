@@ -1,8 +1,18 @@
-from django.test import TestCase, RequestFactory
+import os
+from datetime import date
+from io import StringIO
+from unittest import skipIf
+from django.db import transaction
+from django.test import TestCase, RequestFactory, override_settings
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from simplehmis import models, admin
 
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 User = get_user_model()
 
 
@@ -119,6 +129,39 @@ class AdminTests (TestCase):
         response = admin.dump_hud_data(request)
         assert response.status_code == 200
 
+    def test_dumped_data_is_a_streamed_zipfile(self):
+        from io import BytesIO
+        from zipfile import ZipFile
+        request = RequestFactory().get('/simplehmis/download_data')
+        request.user = User.objects.get(username='admin')
+        response = admin.dump_hud_data(request)
+        assert response.streaming
+        # Make sure the streamed chunks make up a valid zip file with all of
+        # the CSV files in it.
+        zipfile = ZipFile(BytesIO(b''.join(response.streaming_content)))
+        assert zipfile.testzip() is None
+        assert set(zipfile.namelist()) == set([
+            'clients.csv', 'enrollments.csv', 'entry_assessments.csv',
+            'annual_assessments.csv', 'exit_assessments.csv'])
+        clients = zipfile.read('clients.csv').decode('utf-8').splitlines()
+        assert clients[0].startswith('client_id,first,middle,last,suffix,dob')
+        assert len(clients) == models.Client.objects.count() + 1
+
+    def test_enrollment_demographics_are_streamed(self):
+        import csv
+        request = RequestFactory().get('/simplehmis/download_enrollments')
+        request.user = User.objects.get(username='admin')
+        response = admin.dump_enrollment_demographics(request)
+        assert response.streaming
+        content = b''.join(response.streaming_content).decode('utf-8')
+        rows = list(csv.reader(StringIO(content)))
+        assert rows[0][:2] == ['project name', 'entry date']
+        assert len(rows) == models.HouseholdMember.objects.count() + 1
+
+        member = models.HouseholdMember.objects.order_by('pk')[0]
+        assert rows[1][0] == member.household.project.name
+        assert rows[1][5] == member.client.name_display()
+
     def test_dual_staff_cannot_dump_all_data(self):
         request = RequestFactory().get('/simplehmis/download_data')
         # Set the dual_admin as the request user.
@@ -154,6 +197,58 @@ class AdminTests (TestCase):
             "projects: {}".format(filters)
 
 
+class HudCodeLookupTests (TestCase):
+    def test_labels_and_codes(self):
+        from simplehmis import consts
+        lookup = consts.HUD_YES_NO_LOOKUP
+        assert lookup.label(1) == 'Yes'
+        assert lookup.label(12345) is None
+        assert lookup.code('yes') == 1
+        assert lookup.code('Client Refused') == consts.HUD_CLIENT_REFUSED
+        assert lookup.code('') == consts.HUD_DATA_NOT_COLLECTED
+        with self.assertRaises(KeyError):
+            lookup.code('Maybe')
+
+    def test_lookups_are_read_only(self):
+        from simplehmis import consts
+        with self.assertRaises(AttributeError):
+            consts.HUD_YES_NO_LOOKUP.choices = []
+        with self.assertRaises(TypeError):
+            consts.HUD_YES_NO_LOOKUP.labels[2] = 'Maybe'
+
+    def test_loader_accepts_lookups_and_choice_lists(self):
+        from simplehmis import consts
+        from simplehmis.management.loader_utils import hud_code
+        assert hud_code(' Drugs ', consts.HUD_CLIENT_SUBSTANCE_ABUSE_LOOKUP) == 2
+        assert hud_code(' Drugs ', consts.HUD_CLIENT_SUBSTANCE_ABUSE) == 2
+        with self.assertRaises(ValueError):
+            hud_code('Maybe', consts.HUD_YES_NO_LOOKUP, interactive=False)
+
+    def test_loader_caches_codes_for_lookups(self):
+        from simplehmis import consts
+        from simplehmis.management.loader_utils import hud_code, cached_hud_code
+        cached_hud_code.cache_clear()
+        for _ in range(3):
+            assert hud_code(' Drugs ', consts.HUD_CLIENT_SUBSTANCE_ABUSE_LOOKUP) == 2
+            assert hud_code('', consts.HUD_YES_NO_LOOKUP) == consts.HUD_DATA_NOT_COLLECTED
+            with self.assertRaises(ValueError):
+                hud_code('Maybe', consts.HUD_YES_NO_LOOKUP, interactive=False)
+        assert cached_hud_code.cache_info().hits == 4
+        assert cached_hud_code.cache_info().currsize == 2
+
+    def test_loader_parses_dates_like_strptime(self):
+        from datetime import datetime
+        from simplehmis.management.loader_utils import parse_date
+        for value in ('1/5/2015', '01/05/2015', '12/31/99', '2/29/68', '2/28/69', '1/ 5/15'):
+            expected = datetime.strptime(value, '%m/%d/%Y' if len(value.split('/')[2]) == 4 else '%m/%d/%y').date()
+            assert parse_date(value) == expected
+        assert parse_date('') is None
+        assert parse_date('Not collected') is None
+        for value in ('2/30/2015', '13/1/2015', '1/1/201', '2015-01-05'):
+            with self.assertRaises(ValueError):
+                parse_date(value, interactive=False)
+
+
 class EnrollmentFilterTests (TestCase):
     fixtures = ['staff-groups', 'hmis-test-data']
 
@@ -226,3 +321,905 @@ class EnrollmentFilterTests (TestCase):
         assert household in models.Household.objects.filter_by_enrollment(1)
         assert household not in models.Household.objects.filter_by_enrollment(-1)
         assert household not in models.Household.objects.filter_by_enrollment(0)
+
+
+class ChangelistBenchmarkTests (TestCase):
+    fixtures = ['staff-groups', 'hmis-test-data']
+
+    def test_benchmark_times_each_filter_and_rolls_back(self):
+        from django.core.management import call_command
+        member_count = models.HouseholdMember.objects.count()
+        out = StringIO()
+        call_command('benchmark_changelist_filters', members=50, repeat=1, stdout=out)
+        lines = out.getvalue().splitlines()
+
+        assert lines[0] == 'Created 50 of 50 household members'
+        assert lines[1].split() == ['changelist', 'rows', 'before', '(ms)', 'after', '(ms)']
+        rows = [(line[:40].strip(), line[40:].split()) for line in lines[2:]]
+        assert [label for label, _ in rows] == [
+            'household referrals unfiltered', 'household referrals enrolled=-1',
+            'household referrals enrolled=0', 'household referrals enrolled=1',
+            'household referrals assessed=0', 'household referrals assessed=1',
+            'household members unfiltered', 'household members enrolled=-1',
+            'household members enrolled=0', 'household members enrolled=1',
+        ]
+        for label, (count, before_ms, after_ms) in rows:
+            assert int(count) >= 0 and float(before_ms) >= 0 and float(after_ms) >= 0, label
+
+        # Everything the benchmark created is rolled back.
+        assert models.HouseholdMember.objects.count() == member_count
+
+
+class HouseholdStatusTests (TestCase):
+    fixtures = ['staff-groups', 'hmis-test-data']
+
+    def assertStatusesUpToDate(self):
+        households = models.Household.objects.values_list('pk', 'enrollment_status', 'assessments_complete')
+        expected = models.get_household_statuses([pk for pk, _, _ in households])
+        assert dict((pk, (status, complete)) for pk, status, complete in households) == expected
+
+    def test_fixture_households_have_statuses(self):
+        self.assertStatusesUpToDate()
+        assert models.Household.objects.get(pk=7).enrollment_status == models.Household.PENDING
+        assert models.Household.objects.get(pk=1).enrollment_status == models.Household.ENROLLED
+        assert models.Household.objects.get(pk=8).enrollment_status == models.Household.EXITED
+
+    def test_each_status_has_one_index(self):
+        from django.db import connection
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, models.Household._meta.db_table)
+        for column in ['enrollment_status', 'assessments_complete']:
+            indexes = [name for name, constraint in constraints.items()
+                       if constraint['index'] and constraint['columns'][0] == column]
+            assert len(indexes) == 1, (column, indexes)
+
+    def test_statuses_follow_member_and_assessment_changes(self):
+        household = models.Household.objects.get(pk=1)
+        member = household.members.filter(present_at_enrollment=True)[0]
+
+        # Exit every present member, and the household has exited.
+        for other in household.members.filter(present_at_enrollment=True):
+            other.exit_date = date(2016, 1, 1)
+            other.save()
+        assert models.Household.objects.get(pk=1).enrollment_status == models.Household.EXITED
+        assert models.Household.objects.get(pk=1).assessments_complete is False
+
+        for other in household.members.filter(present_at_enrollment=True):
+            models.ClientExitAssessment.objects.get_or_create(member=other, defaults=dict(project_exit_date=date(2016, 1, 1)))
+        self.assertStatusesUpToDate()
+
+        member.exit_assessment.delete()
+        assert models.Household.objects.get(pk=1).assessments_complete is False
+
+        # Moving a member updates both the old and the new household.
+        member.household = models.Household.objects.get(pk=7)
+        member.save()
+        self.assertStatusesUpToDate()
+
+        member.delete()
+        self.assertStatusesUpToDate()
+
+    def test_deferred_status_updates(self):
+        member = models.Household.objects.get(pk=1).members.filter(present_at_enrollment=True)[0]
+        with transaction.atomic(), models.deferred_household_status_updates():
+            member.entry_date = None
+            member.save()
+            assert models.Household.objects.get(pk=1).enrollment_status == models.Household.ENROLLED
+        assert models.Household.objects.get(pk=1).enrollment_status == models.Household.PENDING
+        self.assertStatusesUpToDate()
+
+
+class ClientSearchTests (TestCase):
+    fixtures = ['staff-groups', 'hmis-test-data']
+
+    def search(self, search_term):
+        request = RequestFactory().get('/simplehmis/client', {'q': search_term})
+        request.user = User.objects.get(username='admin')
+        admin_view = admin.ClientAdmin(models.Client, admin.site)
+        queryset, use_distinct = admin_view.get_search_results(request, models.Client.objects.all(), search_term)
+        assert not use_distinct
+        return sorted(client.pk for client in queryset)
+
+    def test_fixture_clients_have_search_keys(self):
+        assert models.ClientSearchKey.objects.count() == models.Client.objects.count()
+        key = models.ClientSearchKey.objects.get(client=3)
+        assert (key.names, key.ssn_last4) == ('marisol leboeuf', '8912')
+
+    def test_search_matches_parts_of_names_and_ssns(self):
+        assert self.search('LEBOEUF') == [3]
+        assert self.search('mari boeuf') == [3]
+        assert self.search('marisol halsey') == []
+        assert self.search('345-67-8912') == [3]
+        assert self.search('345678912') == [3]
+        assert self.search('8912') == [3]
+        assert self.search('45678912') == [3, 4]
+        assert 3 in self.search('ar')
+
+        member_admin = admin.HouseholdMemberAdmin(models.HouseholdMember, admin.site)
+        members, _ = member_admin.get_search_results(None, models.HouseholdMember.objects.all(), 'leboeuf')
+        assert set(member.client_id for member in members) == set([3])
+
+        client = models.Client.objects.create(first='José', last='D’Angelo-Peña', ssn='555443333')
+        assert self.search('jose dangelo') == [client.pk]
+        assert self.search('D\'Angelo pena') == [client.pk]
+        assert self.search('3333') == [client.pk]
+        assert self.search('-') == [client.pk]
+        assert self.search('.') == []
+
+    def test_search_keys_follow_client_changes(self):
+        client = models.Client.objects.get(pk=3)
+        client.last = 'Halsey'
+        client.ssn = '345670000'
+        client.save()
+        assert self.search('leboeuf') == []
+        assert self.search('8912') == []
+        assert self.search('marisol halsey') == [3]
+        assert self.search('0000') == [3]
+
+        client.delete()
+        assert self.search('marisol') == []
+        assert not models.ClientSearchKey.objects.filter(client=3).exists()
+
+    def test_household_search_matches_the_search_fields(self):
+        from django.contrib.admin import ModelAdmin
+        household_admin = admin.HouseholdAdmin(models.Household, admin.site)
+        households = models.Household.objects.all()
+        household = models.Household.objects.create(project_id=3)
+        for client in [models.Client.objects.create(first='José', last='D’Angelo-Peña', ssn='555443333'),
+                       models.Client.objects.create(first='Ann', middle='St. John', last="O'Neil", ssn='n/a')]:
+            models.HouseholdMember.objects.create(household=household, client=client, hoh_relationship=1)
+
+        for search_term in ['halsey', 'HALSEY', 'rashad leboeuf', 'little halsey', 'big', 'ha', 'ar on',
+                            '456789123', 'ninja 912346578', 'nosuchname', '8912', '3456', '345-67-8912',
+                            '-', '.', "'", 'N/A', 'project 3', 'josé', 'jose', 'pena', 'angelo-peña',
+                            'd’angelo', "d'angelo", 'dangelo', "o'neil", 'oneil', 'st. john', 'st john']:
+            queryset, use_distinct = household_admin.get_search_results(None, households, search_term)
+            assert not use_distinct
+            assert 'DISTINCT' not in str(queryset.query)
+
+            expected, _ = ModelAdmin.get_search_results(household_admin, None, households, search_term)
+            assert sorted(h.pk for h in queryset) == sorted(set(h.pk for h in expected)), search_term
+        assert sorted(h.pk for h in household_admin.get_search_results(None, households, 'rashad leboeuf')[0]) == [6]
+
+    def test_bulk_loaded_clients_are_searchable(self):
+        rows = [{'SSN': '555-12-3456', 'First Name': 'Jane', 'Last Name': 'Doe', 'DOB': '05/05/1985',
+                 'Relationship to HoH': 'Self (head of household)', 'Program Name': 'Shelter',
+                 'Program Start Date': '02/01/2015'}]
+        models.Client.objects.load_from_csv_stream(intake_csv(rows), interactive=False, bulk=True)
+        client = models.Client.objects.get(ssn='555123456')
+        assert self.search('jane doe') == [client.pk]
+        assert self.search('3456') == [7, client.pk]
+
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('rebuild_client_search_keys', stdout=out)
+        assert 'Updated the search keys of {} clients'.format(models.Client.objects.count()) in out.getvalue()
+        assert self.search('jane doe') == [client.pk]
+
+
+class ChangelistCountTests (TestCase):
+    fixtures = ['staff-groups', 'hmis-test-data']
+
+    def get_changelist(self, model, params={}):
+        request = RequestFactory().get('/simplehmis/{}/'.format(model._meta.model_name), params)
+        request.user = User.objects.get(username='admin')
+        response = admin.site._registry[model].changelist_view(request)
+        response.render()
+        return response.context_data['cl'], response.content.decode('utf-8')
+
+    def test_counts_stop_at_the_limit(self):
+        clients = models.Client.objects.filter(pk__gt=0).order_by('pk')
+        paginator = admin.ApproximateCountPaginator(clients, 10, count_limit=20)
+        assert paginator.count == 21
+        assert paginator.count_label == '20+'
+        # The last page isn't cut short at the limit.
+        assert len(paginator.page(3).object_list) == 10
+
+        paginator = admin.ApproximateCountPaginator(clients, 10, count_limit=None)
+        assert (paginator.count, paginator.count_label) == (60, None)
+
+    def test_pages_past_an_approximate_count_are_shown(self):
+        from django.core.paginator import EmptyPage
+        clients = models.Client.objects.filter(pk__gt=0).order_by('pk')
+        paginator = admin.ApproximateCountPaginator(clients, 10, count_limit=20)
+        assert [client.pk for client in paginator.page(6).object_list] == list(range(51, 61))
+        with self.assertRaises(EmptyPage):
+            paginator.page(7)
+        with self.assertRaises(EmptyPage):
+            paginator.page(0)
+
+        member_admin = admin.site._registry[models.HouseholdMember]
+        limit = admin.ApproximateCountPaginator.count_limit
+        admin.ApproximateCountPaginator.count_limit = 2
+        member_admin.list_per_page = 1
+        try:
+            last_page = models.HouseholdMember.objects.filter_by_enrollment('0').count() - 1
+            cl, content = self.get_changelist(models.HouseholdMember, {'enrolled': '0', 'p': last_page})
+            assert cl.result_count_label == '2+'
+            assert len(cl.result_list) == 1
+            # The links go on past the count, and don't end.
+            assert cl.open_ended_page_range[-5:] == [last_page, last_page + 1, last_page + 2, last_page + 3, '.']
+            assert 'p={}"'.format(last_page + 1) in content
+
+            request = RequestFactory().get('/simplehmis/householdmember/', {'enrolled': '0', 'p': last_page + 1})
+            request.user = User.objects.get(username='admin')
+            response = member_admin.changelist_view(request)
+            assert response.status_code == 302 and response['Location'].endswith('?e=1')
+        finally:
+            admin.ApproximateCountPaginator.count_limit = limit
+            del member_admin.list_per_page
+
+    def test_unfiltered_counts_are_estimated_from_table_statistics(self):
+        from django.db import connection
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        assert admin.get_estimated_count(models.Client.objects.all()) == models.Client.objects.count()
+        assert admin.get_estimated_count(models.Client.objects.filter(pk__gt=0)) is None
+
+        paginator = admin.ApproximateCountPaginator(models.Client.objects.all(), 10, count_limit=20)
+        assert (paginator.count, paginator.count_label) == (60, 'about 60')
+
+    def test_changelists_count_exactly_on_demand(self):
+        limit = admin.ApproximateCountPaginator.count_limit
+        admin.ApproximateCountPaginator.count_limit = 3
+        try:
+            cl, content = self.get_changelist(models.HouseholdMember, {'enrolled': '0'})
+            assert cl.result_count_label == '3+'
+            assert '3+ household members' in content
+            assert 'exact_count=1' in content
+
+            cl, content = self.get_changelist(models.HouseholdMember, {'enrolled': '0', 'exact_count': '1'})
+            assert cl.result_count_label is None
+            assert cl.result_count == models.HouseholdMember.objects.filter_by_enrollment('0').count()
+
+            cl, content = self.get_changelist(models.Client, {'q': 'a'})
+            assert '3+ results' in content
+        finally:
+            admin.ApproximateCountPaginator.count_limit = limit
+
+        cl, content = self.get_changelist(models.Client, {'q': 'leboeuf'})
+        assert (cl.result_count, cl.result_count_label) == (1, None)
+        # The search bar is still the city's.
+        assert '<div id="toolbar" class="row">\n  <div class="medium-8 columns">' in content
+        assert 'placeholder="Search clients"' in content
+        assert '1 result (' in content
+
+
+class ExportJobTests (TestCase):
+    fixtures = ['staff-groups', 'hmis-test-data']
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        from django.test import override_settings
+        self.export_root = mkdtemp()
+        self.settings_override = override_settings(HUD_EXPORT_ROOT=self.export_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        from shutil import rmtree
+        self.settings_override.disable()
+        rmtree(self.export_root)
+
+    def test_requesting_an_export_queues_a_single_job(self):
+        request = RequestFactory().post('/simplehmis/export_data')
+        request.user = User.objects.get(username='admin')
+        response = admin.request_hud_data_export(request)
+        assert response.status_code == 302
+        # Asking again while the first job is pending shouldn't add another.
+        admin.request_hud_data_export(request)
+        assert models.ExportJob.objects.count() == 1
+        assert models.ExportJob.objects.get().status == models.ExportJob.PENDING
+
+    def test_worker_builds_downloadable_archive(self):
+        from django.core.management import call_command
+        from zipfile import ZipFile
+        job = models.ExportJob.objects.enqueue()
+        call_command('run_export_jobs', once=True, stdout=StringIO())
+
+        job = models.ExportJob.objects.get(pk=job.pk)
+        assert job.status == models.ExportJob.READY, job.error
+        assert job.is_ready()
+        assert 'clients.csv' in ZipFile(job.archive).namelist()
+
+        request = RequestFactory().get('/simplehmis/export_data/{}'.format(job.pk))
+        request.user = User.objects.get(username='admin')
+        response = admin.download_hud_data_export(request, job.pk)
+        assert response.status_code == 200
+        response.close()
+
+    def test_worker_deletes_expired_archives(self):
+        from django.core.management import call_command
+        from django.utils.timezone import now, timedelta
+        job = models.ExportJob.objects.enqueue()
+        call_command('run_export_jobs', once=True, stdout=StringIO())
+        archive = models.ExportJob.objects.get(pk=job.pk).archive
+
+        models.ExportJob.objects.filter(pk=job.pk)\
+            .update(finished_at=now() - timedelta(days=365))
+        call_command('run_export_jobs', once=True, stdout=StringIO())
+        assert not models.ExportJob.objects.filter(pk=job.pk).exists()
+        assert not os.path.exists(archive)
+
+    def test_worker_only_gives_up_on_stalled_jobs(self):
+        from django.core.management import call_command
+        from django.utils.timezone import now, timedelta
+        # One job running in another worker, and one left behind by a worker
+        # that stopped long ago.
+        running = models.ExportJob.objects.create(
+            status=models.ExportJob.RUNNING, started_at=now())
+        stalled = models.ExportJob.objects.create(
+            status=models.ExportJob.RUNNING, started_at=now() - timedelta(days=1))
+        call_command('run_export_jobs', once=True, stdout=StringIO())
+
+        assert models.ExportJob.objects.get(pk=running.pk).status == models.ExportJob.RUNNING
+        assert models.ExportJob.objects.get(pk=stalled.pk).status == models.ExportJob.FAILED
+
+    def test_index_shows_export_status(self):
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(username='admin')
+        job = models.ExportJob.objects.enqueue()
+        response = admin.site.index(request)
+        assert 'Preparing data download' in response.render().content.decode('utf-8')
+
+        models.ExportJob.objects.filter(pk=job.pk).update(status=models.ExportJob.FAILED)
+        response = admin.site.index(request)
+        assert 'Prepare All Data for Download' in response.render().content.decode('utf-8')
+
+
+class IncrementalDumpTests (TestCase):
+    fixtures = ['staff-groups', 'hmis-test-data']
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.dirname = mkdtemp()
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.dirname)
+
+    def read_csv(self, filename):
+        import csv
+        with open(os.path.join(self.dirname, filename)) as csvfile:
+            return list(csv.DictReader(csvfile))
+
+    @override_settings(HUD_EXPORT_MAX_TRANSACTION_SECONDS=0)
+    def test_dump_since_last_only_includes_changes(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+
+        # There's nothing to continue from until a full dump is done.
+        with self.assertRaises(CommandError):
+            call_command('dump_hud_data', self.dirname, since='last', stdout=StringIO())
+
+        call_command('dump_hud_data', self.dirname, stdout=StringIO())
+        assert len(self.read_csv('clients.csv')) == models.Client.objects.count()
+        assert not os.path.exists(os.path.join(self.dirname, 'deleted.csv'))
+
+        client = models.Client.objects.get(pk=1)
+        client.middle = 'Q'
+        client.save()
+        member = models.HouseholdMember.objects.filter(entry_assessment__isnull=False)[0]
+        member_id = member.pk
+        member.delete()
+
+        call_command('dump_hud_data', self.dirname, since='last', stdout=StringIO())
+        clients = self.read_csv('clients.csv')
+        assert [row['client_id'] for row in clients] == ['1']
+        assert self.read_csv('enrollments.csv') == []
+
+        deleted = set((row['filename'], row['key']) for row in self.read_csv('deleted.csv'))
+        assert ('enrollments.csv', str(member_id)) in deleted
+        assert ('entry_assessments.csv', str(member_id)) in deleted
+        assert models.ExportRun.objects.count() == 2
+
+    def test_dump_since_last_starts_before_the_last_dump(self):
+        from django.core.management import call_command
+        from django.utils.timezone import now, timedelta
+
+        started_at = now()
+        call_command('dump_hud_data', self.dirname, stdout=StringIO())
+        finished_at = now()
+        margin = timedelta(seconds=settings.HUD_EXPORT_MAX_TRANSACTION_SECONDS)
+        assert started_at - margin <= models.ExportRun.objects.get().as_of <= finished_at - margin
+
+    @override_settings(HUD_EXPORT_MAX_TRANSACTION_SECONDS=0)
+    def test_dump_since_last_includes_indirect_changes(self):
+        from django.core.management import call_command
+
+        call_command('dump_hud_data', self.dirname, stdout=StringIO())
+        models.Client.objects.get(pk=1).race.clear()
+        project = models.Project.objects.filter(household__members__present_at_enrollment=True)[0]
+        project.name = 'Renamed'
+        project.save()
+        member = models.HouseholdMember.objects\
+            .filter(present_at_enrollment=True, entry_assessment__isnull=False)\
+            .exclude(household__project=project)[0]
+        member.present_at_enrollment = False
+        member.save()
+
+        call_command('dump_hud_data', self.dirname, since='last', stdout=StringIO())
+        assert [row['client_id'] for row in self.read_csv('clients.csv')] == ['1']
+        enrollments = self.read_csv('enrollments.csv')
+        assert enrollments
+        assert set(row['project_name'] for row in enrollments) == {'Renamed'}
+
+        deleted = set((row['filename'], row['key']) for row in self.read_csv('deleted.csv'))
+        assert ('enrollments.csv', str(member.pk)) in deleted
+        assert ('entry_assessments.csv', str(member.pk)) in deleted
+
+    @override_settings(HUD_EXPORT_MAX_TRANSACTION_SECONDS=0)
+    def test_annual_assessments_are_exported_by_their_own_ids(self):
+        from django.core.management import call_command
+
+        member = models.HouseholdMember.objects.filter(present_at_enrollment=True)[0]
+        first = models.ClientAnnualAssessment.objects.create(member=member)
+        second = models.ClientAnnualAssessment.objects.create(member=member)
+        call_command('dump_hud_data', self.dirname, stdout=StringIO())
+        rows = self.read_csv('annual_assessments.csv')
+        assert [(row['annual_assessment_id'], row['enrollment_id']) for row in rows] == \
+               [(str(first.pk), str(member.pk)), (str(second.pk), str(member.pk))]
+
+        first_id = first.pk
+        first.delete()
+        second.income_notes = 'Changed'
+        second.save()
+        call_command('dump_hud_data', self.dirname, since='last', stdout=StringIO())
+        assert [row['annual_assessment_id'] for row in self.read_csv('annual_assessments.csv')] == [str(second.pk)]
+        deleted = [(row['filename'], row['key_field'], row['key']) for row in self.read_csv('deleted.csv')]
+        assert deleted == [('annual_assessments.csv', 'annual_assessment_id', str(first_id))]
+
+    def test_tombstones_dont_slow_down_other_deletes(self):
+        from django.db.models.deletion import Collector
+        collector = Collector(using='default')
+        assert collector.can_fast_delete(models.ExportRun.objects.all())
+        assert not collector.can_fast_delete(models.Client.objects.all())
+
+    def test_parallel_dump_needs_a_supported_database(self):
+        from unittest import mock
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from django.db import connections
+
+        with mock.patch.object(type(connections['default']), 'vendor', 'oracle'):
+            with self.assertRaises(CommandError):
+                call_command('dump_hud_data', self.dirname, jobs=2, stdout=StringIO())
+
+    def test_parallel_dump_matches_serial_dump(self):
+        from django.core.management import call_command
+        from filecmp import dircmp
+
+        serial_dirname = os.path.join(self.dirname, 'serial')
+        parallel_dirname = os.path.join(self.dirname, 'parallel')
+        call_command('dump_hud_data', serial_dirname, stdout=StringIO())
+        call_command('dump_hud_data', parallel_dirname, jobs=3, stdout=StringIO())
+
+        comparison = dircmp(serial_dirname, parallel_dirname)
+        assert comparison.left_list == comparison.right_list
+        assert not comparison.diff_files, comparison.diff_files
+        assert models.ExportRun.objects.count() == 2
+
+
+class ChunkedDumpTests (TestCase):
+    fixtures = ['staff-groups', 'hmis-test-data']
+
+    def dump_clients(self, chunk_size):
+        from simplehmis.management.dumper_utils import DumpHelper, CLIENT_DUMP_OPTIONS
+        return ''.join(DumpHelper().iter_csv_chunks(
+            models.Client.objects.all(), chunk_size=chunk_size, **CLIENT_DUMP_OPTIONS))
+
+    def peak_dump_memory(self, chunk_size):
+        import tracemalloc
+        from simplehmis.management.dumper_utils import DumpHelper, CLIENT_DUMP_OPTIONS
+        tracemalloc.start()
+        try:
+            for chunk in DumpHelper().iter_csv_chunks(
+                    models.Client.objects.all(), chunk_size=chunk_size, **CLIENT_DUMP_OPTIONS):
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def add_clients(self, count):
+        models.Client.objects.bulk_create(
+            models.Client(first='First{}'.format(i), last='Last{}'.format(i), ssn='{:09d}'.format(i))
+            for i in range(count))
+
+    def test_chunk_size_does_not_change_the_dump(self):
+        self.add_clients(25)
+        assert self.dump_clients(chunk_size=1) == self.dump_clients(chunk_size=1000)
+        assert self.dump_clients(chunk_size=7) == self.dump_clients(chunk_size=1000)
+
+    def test_races_are_loaded_once_per_chunk(self):
+        import csv
+        self.add_clients(35)
+        races = list(models.ClientRace.objects.all()[:2])
+        assert len(races) == 2
+        for client in models.Client.objects.all():
+            client.race.add(*races)
+
+        total = models.Client.objects.count()
+        full_chunks, remainder = divmod(total, 10)
+        # One query per chunk of clients (plus a last, empty one if the
+        # clients divide evenly), one per chunk for the races, and one for
+        # the race codes.
+        with self.assertNumQueries(2 * full_chunks + (2 if remainder else 1) + 1):
+            dump = self.dump_clients(chunk_size=10)
+
+        rows = list(csv.DictReader(StringIO(dump)))
+        assert len(rows) == total
+        for row in rows:
+            assert row['race'] == ';'.join(str(race.hud_value) for race in races)
+            assert row['race display value'] == ';'.join(race.label for race in races)
+
+    def test_peak_memory_stays_flat_as_rows_grow(self):
+        self.add_clients(1000)
+        self.peak_dump_memory(chunk_size=200)
+        small_peak = self.peak_dump_memory(chunk_size=200)
+
+        self.add_clients(4000)
+        large_peak = self.peak_dump_memory(chunk_size=200)
+        assert large_peak < small_peak * 1.5, (small_peak, large_peak)
+
+
+class ExportFormatTests (TestCase):
+    fixtures = ['staff-groups', 'hmis-test-data']
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.dirname = mkdtemp()
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.dirname)
+
+    def test_export_plan_knows_column_kinds(self):
+        from simplehmis.management.dumper_utils import DumpHelper, HouseholdMemberDumpHelper
+        from simplehmis.management.dumper_utils import ENROLLMENT_DUMP_OPTIONS, ENTRY_ASSESSMENT_DUMP_OPTIONS
+
+        plan = HouseholdMemberDumpHelper().get_export_plan(models.HouseholdMember, **ENROLLMENT_DUMP_OPTIONS)
+        kinds = dict(zip(plan.columns, plan.column_kinds))
+        assert kinds['project_id'] == 'integer'
+        assert kinds['project_name'] == 'text'
+        assert kinds['entry_date'] == 'date'
+        assert kinds['hoh_relationship'] == 'integer'
+        assert kinds['hoh_relationship display value'] == 'label'
+
+        plan = DumpHelper().get_export_plan(models.ClientEntryAssessment, **ENTRY_ASSESSMENT_DUMP_OPTIONS)
+        kinds = dict(zip(plan.columns, plan.column_kinds))
+        assert kinds['enrollment_id'] == 'integer'
+        assert kinds['homeless_start_date'] == 'date'
+        assert kinds['income_notes'] == 'text'
+
+    @skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_dump_to_parquet_keeps_the_csv_columns(self):
+        import csv
+        from django.core.management import call_command
+        call_command('dump_hud_data', self.dirname, stdout=StringIO())
+        call_command('dump_hud_data', self.dirname, format='parquet', stdout=StringIO())
+
+        with open(os.path.join(self.dirname, 'clients.csv')) as csvfile:
+            rows = list(csv.reader(csvfile))
+        table = pyarrow.parquet.read_table(os.path.join(self.dirname, 'clients.parquet'))
+        assert table.schema.names == rows[0]
+        assert table.num_rows == len(rows) - 1
+        assert str(table.schema.field('gender').type) == 'int64'
+        assert str(table.schema.field('dob').type) == 'date32[day]'
+
+
+INTAKE_COLUMNS = [
+    'SSN', 'First Name', 'Middle Name', 'Last Name', 'DOB', 'Ethnicity (HUD)',
+    'Gender (HUD)', 'Veteran Status (HUD)', 'Race (HUD)', 'Relationship to HoH',
+    'Head of Household\'s SSN', 'Program Name', 'Program Start Date',
+    'Program End Date', 'Exit Destination', 'Physical Disability',
+    'Developmental Disability', 'Chronic Health Condition', 'HIV/AIDS',
+    'Mental Health Problem', 'Substance Abuse', 'Domestic Violence',
+    'Has Been Continuously Homeless (on the streets, in EH or in a Safe Haven) for at Least One Year',
+    'Residence Prior to Program Entry - Type of Residence',
+    'Residence Prior to Program Entry - Length of Stay in Previous Place',
+    'Number of Times the Client has Been Homeless in the Past Three Years (streets, in EH, or in a safe haven)',
+]
+
+
+def intake_csv(rows):
+    import csv
+    stream = StringIO()
+    writer = csv.DictWriter(stream, INTAKE_COLUMNS, restval='')
+    writer.writeheader()
+    writer.writerows(rows)
+    stream.seek(0)
+    return stream
+
+
+class ClientLoaderTests (TestCase):
+    fixtures = ['staff-groups', 'hmis-test-data']
+
+    def setUp(self):
+        models.Client.objects.filter(pk=2).update(ssn='123456789')
+
+    def intake_rows(self):
+        hoh = 'Self (head of household)'
+        return [
+            # An existing client, matched on SSN
+            {'SSN': '123-45-6789', 'First Name': 'Long', 'Last Name': 'Leeson', 'Race (HUD)': 'Asian',
+             'Relationship to HoH': hoh, 'Program Name': 'Shelter', 'Program Start Date': '01/15/2015'},
+            # A dependent listed before their head of household
+            {'First Name': 'Kid', 'Last Name': 'Doe', 'DOB': '01/01/2010', 'Race (HUD)': 'White',
+             'Relationship to HoH': 'Head of household’s child', 'Head of Household\'s SSN': '555-12-3456',
+             'Program Name': 'Shelter', 'Program Start Date': '02/01/2015'},
+            {'SSN': '555123456', 'First Name': 'Jane', 'Last Name': 'Doe', 'DOB': '05/05/1985',
+             'Race (HUD)': 'White;Asian', 'Relationship to HoH': hoh, 'Program Name': 'Shelter',
+             'Program Start Date': '02/01/2015', 'Program End Date': '03/01/2015', 'Exit Destination': 'Rental by client'},
+            # A household with no SSNs at all
+            {'First Name': 'Sam', 'Last Name': 'Roe', 'DOB': '03/03/1980', 'Race (HUD)': 'Black',
+             'Relationship to HoH': hoh, 'Program Name': 'Outreach', 'Program Start Date': '03/01/2015'},
+            {'First Name': 'Tia', 'Last Name': 'Roe', 'DOB': '04/04/2012', 'Race (HUD)': 'Black',
+             'Relationship to HoH': 'Head of household’s child', 'Program Name': 'Outreach',
+             'Program Start Date': '03/01/2015'},
+            # The same client again, later, with a different race
+            {'SSN': '555123456', 'First Name': 'Jane', 'Last Name': 'Doe', 'DOB': '05/05/1985',
+             'Race (HUD)': 'Asian', 'Relationship to HoH': hoh, 'Program Name': 'Outreach',
+             'Program Start Date': '06/01/2016'},
+            # The same dependent, matched on name and date of birth
+            {'First Name': 'Kid', 'Last Name': 'Doe', 'DOB': '01/01/2010', 'Race (HUD)': 'White',
+             'Relationship to HoH': 'Head of household’s child', 'Head of Household\'s SSN': '555123456',
+             'Program Name': 'Outreach', 'Program Start Date': '06/01/2016'},
+        ]
+
+    def load_and_summarize(self, **options):
+        with transaction.atomic():
+            models.Client.objects.load_from_csv_stream(
+                intake_csv(self.intake_rows()), interactive=False, **options)
+            summary = self.summarize()
+            transaction.set_rollback(True)
+        return summary
+
+    def summarize(self):
+        clients = sorted(
+            (c.first, c.last, c.ssn, c.dob, tuple(r.pk for r in c.race.all()))
+            for c in models.Client.objects.all())
+        members = sorted(
+            (m.client.first, m.client.last, m.household.project.name, m.entry_date, m.exit_date,
+             m.hoh_relationship, tuple(sorted(o.client.first for o in m.household.members.all())),
+             m.has_entry_assessment(), m.has_exit_assessment())
+            for m in models.HouseholdMember.objects.all())
+        return clients, members
+
+    def test_loads_only_mark_clients_with_changed_races_as_updated(self):
+        from django.utils.timezone import now, timedelta
+        hoh = 'Self (head of household)'
+        rows = [
+            {'SSN': '345678912', 'First Name': 'Marisol', 'Last Name': 'Leboeuf', 'Race (HUD)': 'Asian',
+             'Relationship to HoH': hoh, 'Program Name': 'Shelter', 'Program Start Date': '01/15/2015'},
+            {'SSN': '456789123', 'First Name': 'Rashad', 'Last Name': 'Halsey', 'Race (HUD)': 'White',
+             'Relationship to HoH': hoh, 'Program Name': 'Shelter', 'Program Start Date': '01/15/2015'},
+        ]
+        for bulk in [False, True]:
+            with transaction.atomic():
+                models.Client.objects.get(pk=4).race = models.ClientRace.objects.filter(label='White')
+                yesterday = now() - timedelta(days=1)
+                models.Client.objects.filter(pk__in=[3, 4]).update(updated_at=yesterday)
+                models.Client.objects.load_from_csv_stream(intake_csv(rows), interactive=False, bulk=bulk)
+                updated = models.Client.objects.filter(pk__in=[3, 4], updated_at__gt=yesterday)
+                assert [client.pk for client in updated] == [3], bulk
+                assert [race.label for race in models.Client.objects.get(pk=3).race.all()] == ['Asian']
+
+                # Loading the same races again doesn't change anything.
+                models.Client.objects.filter(pk__in=[3, 4]).update(updated_at=yesterday)
+                models.Client.objects.load_from_csv_stream(intake_csv(rows), interactive=False, bulk=bulk)
+                assert not models.Client.objects.filter(pk__in=[3, 4], updated_at__gt=yesterday).exists(), bulk
+                transaction.set_rollback(True)
+
+    def test_bulk_loader_matches_the_row_by_row_loader(self):
+        clients, members = self.load_and_summarize(bulk=False)
+        assert len(clients) == models.Client.objects.count() + 4
+        assert ('Jane', 'Doe', '555123456', date(1985, 5, 5), (2,)) in clients
+        assert ('Kid', 'Doe', 'Shelter', date(2015, 2, 1), None, 2, ('Jane', 'Kid'), True, False) in members
+        assert ('Tia', 'Roe', 'Outreach', date(2015, 3, 1), None, 2, ('Sam', 'Tia'), True, False) in members
+
+        assert self.load_and_summarize(bulk=True) == (clients, members)
+        assert self.load_and_summarize(bulk=True, strong_matching=True) == \
+            self.load_and_summarize(bulk=False, strong_matching=True)
+
+    def test_streaming_loader_matches_reading_the_whole_file(self):
+        expected = self.load_and_summarize()
+
+        # With windows this small, the first dependent is read well before
+        # their head of household.
+        for window_size in (1, 2, 3):
+            assert self.load_and_summarize(window_size=window_size) == expected
+            assert self.load_and_summarize(window_size=window_size, bulk=True) == expected
+
+    def test_streaming_loader_reports_dependents_with_no_head_of_household(self):
+        rows = self.intake_rows()
+        del rows[2]
+
+        with self.assertRaises(models.HouseholdMember.DoesNotExist):
+            models.Client.objects.load_from_csv_stream(
+                intake_csv(rows), interactive=False, window_size=2)
+
+    def test_error_report_lists_every_bad_cell(self):
+        from simplehmis.management.loader_utils import LoadErrorReport
+        rows = self.intake_rows()
+        rows[0]['DOB'] = 'yesterday'
+        rows[3]['Gender (HUD)'] = 'Martian'
+
+        for options in (dict(), dict(window_size=2, jobs=2, bulk=True)):
+            report = LoadErrorReport()
+            with transaction.atomic():
+                models.Client.objects.load_from_csv_stream(
+                    intake_csv(rows), interactive=False, error_report=report, **options)
+
+                # The rest of the file is still loaded, except for the
+                # dependent of the head of household that was skipped.
+                assert models.Client.objects.filter(first='Jane', last='Doe').exists()
+                assert not models.Client.objects.filter(first='Sam', last='Roe').exists()
+                assert not models.HouseholdMember.objects.filter(client__first='Tia', client__last='Roe').exists()
+                transaction.set_rollback(True)
+
+            assert [(error['line'], error['column'], error['value']) for error in report.errors] == [
+                (2, 'DOB', 'yesterday'),
+                (5, 'Gender (HUD)', 'Martian'),
+                (6, 'Head of Household\'s SSN', ''),
+            ]
+            assert report.row_count() == 3
+
+    def test_streaming_load_resumes_from_checkpoint(self):
+        import tempfile
+        from simplehmis.management.loader_utils import LoadErrorReport
+        rows = self.intake_rows()
+        bad_row = dict(rows[0], **{'Gender (HUD)': 'Martian'})
+        # Kid Doe is still waiting on Jane Doe when the load fails.
+        rows = [rows[0], rows[1], rows[3], rows[4], bad_row] + rows[2:3] + rows[5:]
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as csvfile:
+            csvfile.write(intake_csv(rows).getvalue())
+            csvfile.flush()
+
+            with transaction.atomic():
+                models.Client.objects.load_from_csv_file(csvfile.name, interactive=False, window_size=3, error_report=LoadErrorReport())
+                expected = self.summarize()
+                transaction.set_rollback(True)
+
+            with self.assertRaises(ValueError):
+                models.Client.objects.load_from_csv_file(csvfile.name, interactive=False, window_size=3)
+            checkpoint = models.LoadCheckpoint.objects.latest()
+            assert checkpoint.last_line == 4
+            assert [entry['line'] for entry in checkpoint.get_state()['pending']] == [3]
+
+            report = LoadErrorReport()
+            models.Client.objects.load_from_csv_file(csvfile.name, interactive=False, window_size=3, error_report=report, resume=True)
+            assert [error['line'] for error in report.errors] == [6]
+            assert models.LoadCheckpoint.objects.latest().finished_at is not None
+            assert self.summarize() == expected
+
+    def test_pending_dependents_only_wait_a_window(self):
+        from simplehmis.management.loader_utils import PendingDependents
+        pending = PendingDependents()
+        pending.add('a', {'_line': 2}, None)
+        pending.next_window()
+        pending.add('a', {'_line': 3}, None)
+        pending.add('b', {'_line': 4}, None)
+        assert pending.pop_stale(1) == [(0, {'_line': 2}, None)]
+        assert pending.pop_stale(1) == []
+        pending.next_window()
+        assert [row['_line'] for _, row, _ in pending.pop_stale(1)] == [3, 4]
+        assert len(pending) == 0
+
+    def test_household_index_matches_the_database(self):
+        from datetime import timedelta
+        from simplehmis.management.loader_utils import HouseholdIndex
+        members = models.HouseholdMember.objects.exclude(entry_date=None).select_related('client', 'household__project')
+        day = timedelta(days=1)
+
+        expected_by_ssn = {}
+        for member in members.exclude(client__ssn=''):
+            for entry_date in (member.entry_date - day, member.entry_date, member.entry_date + day):
+                key = (member.client.ssn, entry_date)
+                expected_by_ssn[key] = models.HouseholdMember.objects\
+                    .filter(client__ssn=member.client.ssn, entry_date__lte=entry_date)\
+                    .order_by('-entry_date', 'pk').first()
+        expected_by_name = {}
+        for member in members:
+            key = (member.household.project.name, member.entry_date, member.client.last)
+            expected_by_name[key] = list(models.HouseholdMember.objects.filter(
+                household__project__name=key[0], entry_date=key[1], client__last=key[2], hoh_relationship=1).order_by('pk'))
+        assert expected_by_ssn and any(expected_by_name.values())
+
+        index = HouseholdIndex()
+        index.warm(ssns=set(ssn for ssn, _ in expected_by_ssn), names=expected_by_name)
+        with self.assertNumQueries(0):
+            for (ssn, entry_date), expected in expected_by_ssn.items():
+                assert index.find_by_ssn(ssn, entry_date) == expected
+            for (project_name, entry_date, last_name), expected in expected_by_name.items():
+                assert index.find_hohs_by_name(project_name, entry_date, last_name) == expected
+
+    def test_loader_creates_each_missing_project_once(self):
+        rows = self.intake_rows()
+        for row in rows:
+            if row['Program Name'] == 'Outreach':
+                row['Program Name'] = 'Street Outreach'
+        assert not models.Project.objects.filter(name='Street Outreach').exists()
+
+        for options in (dict(), dict(window_size=2), dict(window_size=2, bulk=True)):
+            with transaction.atomic():
+                models.Client.objects.load_from_csv_stream(intake_csv(rows), interactive=False, **options)
+                project = models.Project.objects.get(name='Street Outreach')
+                assert models.Household.objects.filter(project=project).count() == 2
+                transaction.set_rollback(True)
+
+    def test_loader_fills_in_assessment_values_that_get_more_specific(self):
+        jane = self.intake_rows()[2]
+        rows = [
+            dict(jane, **{'Mental Health Problem': 'No'}),
+            dict(jane, **{'Physical Disability': 'Yes', 'Mental Health Problem': 'Yes'}),
+        ]
+
+        for options in (dict(), dict(window_size=1), dict(window_size=1, bulk=True)):
+            with transaction.atomic():
+                with self.assertLogs('simplehmis.management.loader_utils', 'WARNING') as logs:
+                    models.Client.objects.load_from_csv_stream(intake_csv(rows), interactive=False, **options)
+                assert any('mental_health changed for entry assessment' in line for line in logs.output)
+
+                member = models.HouseholdMember.objects.get(client__ssn='555123456')
+                assert (member.entry_assessment.physical_disability, member.entry_assessment.mental_health) == (1, 0)
+                assert (member.exit_assessment.physical_disability, member.exit_assessment.mental_health) == (1, 0)
+                transaction.set_rollback(True)
+
+    def test_dry_run_reports_the_load_without_saving_it(self):
+        from simplehmis.management.loader_utils import LoadDiffReport
+        counts = [model.objects.count() for model in (models.Client, models.Household, models.HouseholdMember, models.ClientEntryAssessment)]
+
+        for options in (dict(), dict(window_size=2, bulk=True)):
+            report = LoadDiffReport()
+            models.Client.objects.load_from_csv_stream(
+                intake_csv(self.intake_rows()), interactive=False, diff_report=report, dry_run=True, **options)
+            assert [model.objects.count() for model in (models.Client, models.Household, models.HouseholdMember, models.ClientEntryAssessment)] == counts
+
+            summary = report.summary()
+            assert (summary['rows'], summary['created_clients'], summary['matched_clients']) == (7, 4, 3)
+            assert (summary['created_households'], summary['created_members'], summary['matched_members']) == (4, 7, 0)
+            assert summary['created_entry_assessments'] == 7
+            assert [entry['action'] for entry in report.clients] == ['matched', 'created', 'created', 'created', 'created', 'matched', 'matched']
+
+        # Once the file has been loaded for real, loading it again would
+        # only match what's already there.
+        with transaction.atomic():
+            models.Client.objects.load_from_csv_stream(intake_csv(self.intake_rows()), interactive=False)
+            report = LoadDiffReport()
+            models.Client.objects.load_from_csv_stream(
+                intake_csv(self.intake_rows()), interactive=False, diff_report=report, dry_run=True)
+            summary = report.summary()
+            assert (summary['created_clients'], summary['created_households'], summary['created_members']) == (0, 0, 0)
+            assert (summary['matched_members'], summary['created_entry_assessments']) == (7, 0)
+            transaction.set_rollback(True)
+
+    def test_dry_run_writes_nothing(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from simplehmis.management.loader_utils import LoadDiffReport
+
+        # Jane Doe is listed again at the end, in a later window.
+        rows = self.intake_rows()
+        rows = rows + [dict(rows[2], **{'Physical Disability': 'Yes'})]
+        for options in (dict(), dict(window_size=1), dict(window_size=2, bulk=True)):
+            with CaptureQueriesContext(connection) as queries:
+                dry_run_report = LoadDiffReport()
+                models.Client.objects.load_from_csv_stream(
+                    intake_csv(rows), interactive=False, diff_report=dry_run_report, dry_run=True, **options)
+            writes = [query['sql'] for query in queries
+                      if query['sql'].split()[0].upper() in ('INSERT', 'UPDATE', 'DELETE')]
+            assert writes == [], writes
+
+            # The dry run reports what the load itself does.
+            with transaction.atomic():
+                report = LoadDiffReport()
+                models.Client.objects.load_from_csv_stream(
+                    intake_csv(rows), interactive=False, diff_report=report, **options)
+                transaction.set_rollback(True)
+            if options:
+                # Jane Doe's assessment would be changed by the later window.
+                assert report.summary()['changed_entry_assessments'] == 1
+            assert dry_run_report.summary() == report.summary()
+            assert dry_run_report.clients == report.clients
+            assert dry_run_report.members == report.members
+            assert dry_run_report.assessments == report.assessments
@@ -22,5 +22,7 @@ urlpatterns = [
     url(r'^', include('phila.urls')),
     url(r'^', include(admin.site.urls)),
     url(r'^simplehmis/download_data$', admin.dump_hud_data, name='simplehmis_download_data'),
+    url(r'^simplehmis/export_data$', admin.request_hud_data_export, name='simplehmis_export_data'),
+    url(r'^simplehmis/export_data/(?P<job_id>\d+)$', admin.download_hud_data_export, name='simplehmis_download_export'),
     url(r'^simplehmis/download_enrollments$', admin.dump_enrollment_demographics, name='simplehmis_download_enrollments'),
 ]